@@ -0,0 +1,125 @@
+import sys
+import os
+import argparse
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+
+# Add the src directory to the system path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from classes import market, venue_fetcher, to_raw
+
+class stand_in_server:
+    """
+    A local HTTP server standing in for the pool pages: /pool/<i> answers, after latency seconds,
+    a page with the liquidities of the tokens A<i> and B<i> in the format 'pooled {token} is {value}'.
+    The first request of every failure_every-th pool is answered with a 503, to exercise the retries.
+    """
+
+    def __init__(self, n_pools, latency=0.05, failure_every=0, seed=0):
+        rng = np.random.default_rng(seed)
+        self.liquidity = np.round(rng.lognormal(np.log(1e6), 1.0, size=(n_pools, 2)), 6)
+        self.latency = latency
+        self.failure_every = failure_every
+        self.requests = 0
+        self._failed = set()
+        self._lock = threading.Lock()
+        server = self
+
+        class handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1' # Keep the connections alive
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                with server._lock:
+                    server.requests += 1
+                i = int(self.path.rsplit('/', 1)[-1])
+                time.sleep(server.latency)
+                if server.failure_every and i % server.failure_every == 0 and i not in server._failed:
+                    with server._lock:
+                        server._failed.add(i)
+                    self.send_response(503)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                body = (f"<html><body><p>Pool {i}</p><p>The pooled A{i} is {server.liquidity[i, 0]:,.6f} and "
+                        f"the pooled B{i} is {server.liquidity[i, 1]:,.6f}.</p></body></html>").encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        class http_server(ThreadingHTTPServer):
+            request_queue_size = 128
+            daemon_threads = True
+
+        self.httpd = http_server(('127.0.0.1', 0), handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/pool/"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def run(n_pools, workers, latency, failure_every):
+    """
+    Refreshes the pools of a stand-in server into a market sequentially and concurrently, checks
+    the reserves written and returns the timings.
+    """
+    server = stand_in_server(n_pools, latency=latency, failure_every=failure_every)
+    pools = [(f"POOL_{i}", server.url + str(i), f"A{i}", f"B{i}") for i in range(n_pools)]
+    timings = {}
+    try:
+        for label, n_workers in (('sequential', 1), ('concurrent', workers)):
+            Fetcher = venue_fetcher(market([]), workers=n_workers, backoff=0.01)
+            Fetcher.add_pools(pools)
+            start = time.perf_counter()
+            changed = Fetcher.update_market()
+            timings[label] = time.perf_counter() - start
+            Fetcher.close()
+            server._failed.clear()
+
+        Market = Fetcher.market
+        expected = [to_raw(f"{value:.6f}") for value in server.liquidity.ravel()]
+        found = [Market.raw_reserve(Market.reserve_slot(f"POOL_{i}", token))
+                 for i in range(n_pools) for token in (f"A{i}", f"B{i}")]
+
+        # Within the ttl the pools are answered by the cache, without any request
+        requests = server.requests
+        start = time.perf_counter()
+        cached = Fetcher.update_market()
+        timings['cached'] = time.perf_counter() - start
+        cache_requests = server.requests - requests
+    finally:
+        server.close()
+
+    return {
+        'changed': len(changed),
+        'exact': found == expected,
+        'errors': Fetcher.errors,
+        'cached_changed': len(cached),
+        'cache_requests': cache_requests,
+        'timings': timings
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Refreshes the pools of a local stand-in server sequentially and concurrently.')
+    parser.add_argument('--pools', type=int, default=500, help='Number of pools')
+    parser.add_argument('--workers', type=int, default=32, help='Number of threads of the concurrent refresh')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds the server waits before answering')
+    parser.add_argument('--failure-every', type=int, default=50, help='Every how many pools the first request fails, 0 for never')
+    args = parser.parse_args()
+
+    result = run(args.pools, args.workers, args.latency, args.failure_every)
+    timings = result['timings']
+    print(f"{args.pools} pools, {args.latency * 1e3:.0f} ms latency: sequential {timings['sequential']:.2f}s, "
+          f"{args.workers} workers {timings['concurrent']:.2f}s, cached {timings['cached'] * 1e3:.1f} ms")
+    print(f"{result['changed']} venues written, exact reserves: {result['exact']}, errors: {len(result['errors'])}, "
+          f"requests within the ttl: {result['cache_requests']}")
+    sys.exit(0 if result['exact'] and not result['errors'] and result['cache_requests'] == 0 else 1)
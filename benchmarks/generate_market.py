@@ -0,0 +1,135 @@
+import sys
+import os
+import argparse
+import json
+import numpy as np
+
+# Add the src directory to the system path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from classes.amount import format_amount, to_raw
+
+def generate_market(n_pools, n_tokens=None, pools_per_pair=1, degree=4.0, reserve_distribution='lognormal',
+                    n_orders=10, seed=0):
+    """
+    Generates a random market, and random orders on it, in the JSON schema of the input files.
+
+    This function performs the following steps:
+    1. Draws a price for each token, so that the pools of the market are roughly consistent
+       with each other and the orders have realistic limit prices.
+    2. Connects the tokens with a random spanning tree, so that every token can be reached,
+       and adds random token pairs until the pairs can hold n_pools pools.
+    3. Creates pools_per_pair pools for each pair, with the value of the pool drawn from
+       reserve_distribution and the reserves split at the token prices, with a 1% noise.
+    4. Creates orders between tokens one or two pools away, selling 0.1% to 5% of the
+       reserve of a pool, with a limit price 10% below the market price.
+
+    Parameters:
+    -----------
+    n_pools : int
+        The number of pools (venues) of the market.
+    n_tokens : int, optional
+        The number of tokens. Default is the number giving on average `degree` neighbours per token.
+    pools_per_pair : int, optional
+        The number of parallel pools on each token pair. Default is 1.
+    degree : float, optional
+        The average number of neighbour tokens of each token, used if n_tokens is not given. Default is 4.
+    reserve_distribution : str, optional
+        The distribution of the value locked in each pool. Default is 'lognormal'.
+        Supported values:
+        - 'lognormal': median 1e6, heavy tailed.
+        - 'uniform': uniform between 1e4 and 1e7.
+    n_orders : int, optional
+        The number of orders. Default is 10.
+    seed : int, optional
+        The seed of the random generator. Default is 0.
+
+    Returns:
+    --------
+    data: dict
+        The 'orders' and 'venues' sections of an input file.
+    """
+    rng = np.random.default_rng(seed)
+    n_pairs = -(-n_pools // pools_per_pair)
+    if n_tokens is None:
+        n_tokens = max(2, int(round(2 * n_pairs / degree)))
+    n_pairs = min(n_pairs, n_tokens * (n_tokens - 1) // 2)
+    tokens = [f"T{i}" for i in range(n_tokens)]
+    prices = rng.lognormal(0.0, 2.0, n_tokens)
+
+    # Random spanning tree first, then random extra pairs
+    pairs = set()
+    for token in range(1, min(n_tokens, n_pairs + 1)):
+        pairs.add((int(rng.integers(token)), token))
+    while len(pairs) < n_pairs:
+        token1, token2 = sorted(rng.choice(n_tokens, 2, replace=False).tolist())
+        pairs.add((token1, token2))
+    pairs = sorted(pairs)
+
+    if reserve_distribution == 'lognormal':
+        values = rng.lognormal(np.log(1e6), 1.5, len(pairs) * pools_per_pair)
+    elif reserve_distribution == 'uniform':
+        values = rng.uniform(1e4, 1e7, len(pairs) * pools_per_pair)
+    else:
+        raise ValueError(f"Unsupported reserve distribution: {reserve_distribution}")
+    noise = rng.normal(1.0, 0.01, (len(pairs) * pools_per_pair, 2))
+
+    venues = {}
+    neighbours = {token: [] for token in range(n_tokens)}
+    for i, (token1, token2) in enumerate(pairs):
+        neighbours[token1].append(token2)
+        neighbours[token2].append(token1)
+        for j in range(pools_per_pair):
+            k = i * pools_per_pair + j
+            if len(venues) == n_pools:
+                break
+            venues[f"AMM_{k}_{tokens[token1]}_{tokens[token2]}"] = {
+                "reserves": {
+                    tokens[token1]: format_amount(to_raw(values[k] / 2 / prices[token1] * noise[k, 0])),
+                    tokens[token2]: format_amount(to_raw(values[k] / 2 / prices[token2] * noise[k, 1]))
+                }
+            }
+
+    orders = {}
+    for i in range(n_orders):
+        token1, token2 = pairs[int(rng.integers(len(pairs)))]
+        if rng.random() < 0.5:
+            # Two pools away, when possible
+            candidates = [token for token in neighbours[token2] if token != token1]
+            if candidates:
+                token2 = candidates[int(rng.integers(len(candidates)))]
+        if rng.random() < 0.5:
+            token1, token2 = token2, token1
+        median_value = 1e6 if reserve_distribution == 'lognormal' else 5e6
+        sell_amount = rng.uniform(0.001, 0.05) * median_value / 2 / prices[token1]
+        buy_amount = 0.9 * sell_amount * prices[token1] / prices[token2]
+        orders[str(i)] = {
+            "sell_token": tokens[token1],
+            "buy_token": tokens[token2],
+            "limit_sell_amount": format_amount(to_raw(sell_amount)),
+            "limit_buy_amount": format_amount(to_raw(buy_amount)),
+            "partial_fill": bool(rng.random() < 0.5)
+        }
+
+    return {
+        "orders": orders,
+        "venues": venues
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generates a random market in the JSON schema of the input files.')
+    parser.add_argument('file_path', type=str, help='Path of the JSON file to write')
+    parser.add_argument('--pools', type=int, default=100, help='Number of pools')
+    parser.add_argument('--tokens', type=int, default=None, help='Number of tokens')
+    parser.add_argument('--pools-per-pair', type=int, default=1, help='Number of parallel pools on each token pair')
+    parser.add_argument('--degree', type=float, default=4.0, help='Average number of neighbour tokens of each token')
+    parser.add_argument('--reserves', type=str, default='lognormal', choices=['lognormal', 'uniform'],
+                        help='Distribution of the value locked in each pool')
+    parser.add_argument('--orders', type=int, default=10, help='Number of orders')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator')
+    args = parser.parse_args()
+
+    data = generate_market(args.pools, n_tokens=args.tokens, pools_per_pair=args.pools_per_pair, degree=args.degree,
+                           reserve_distribution=args.reserves, n_orders=args.orders, seed=args.seed)
+    with open(args.file_path, 'w') as f:
+        json.dump(data, f, indent=4)
@@ -0,0 +1,192 @@
+import sys
+import os
+import argparse
+import json
+import time
+import platform
+import subprocess
+import tracemalloc
+import numpy as np
+import scipy
+
+# Add the src directory to the system path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+import mev_project_interface as interface
+from classes import market, agent
+from generate_market import generate_market
+
+STAGES = ['parse', 'market', 'generate_graph', 'find_paths', 'read_market', 'optimize_strategy', 'commit']
+
+def summarize(samples):
+    """
+    Returns the count, mean, maximum and the 50th, 90th and 99th percentiles of a list of samples.
+    """
+    if not samples:
+        return {'count': 0}
+    samples = np.asarray(samples, dtype=float)
+    return {
+        'count': int(samples.size),
+        'mean': float(samples.mean()),
+        'p50': float(np.percentile(samples, 50)),
+        'p90': float(np.percentile(samples, 90)),
+        'p99': float(np.percentile(samples, 99)),
+        'max': float(samples.max())
+    }
+
+def run_pipeline(text, timings=None, solver_stats=None):
+    """
+    Runs the whole pipeline on a generated market: parses the JSON text, builds the market and
+    its networkx graph, and solves every order one after the other, committing its trades.
+
+    Parameters:
+    -----------
+    text : str
+        The generated market, in the JSON schema of the input files.
+    timings : dict, optional
+        The lists of the seconds spent in each stage, appended to if given.
+    solver_stats : dict, optional
+        The lists of the solver statistics of each order, appended to if given.
+
+    Returns:
+    --------
+    int
+        The number of orders that could not be solved.
+    """
+    def timed(stage, function, *args, **kwargs):
+        start = time.perf_counter()
+        output = function(*args, **kwargs)
+        if timings is not None:
+            timings[stage].append(time.perf_counter() - start)
+        return output
+
+    def parse():
+        data = json.loads(text)
+        return data, interface.create_venues(data)
+
+    data, Venues = timed('parse', parse)
+    Market = timed('market', market, Venues)
+    timed('generate_graph', Market.generate_graph)
+
+    failed = 0
+    for Order in interface.create_orders(data):
+        paths = timed('find_paths', Market.find_paths, Order.sell_token, Order.buy_token)
+        if not paths:
+            failed += 1
+            continue
+        Agent = agent()
+        Agent.read_order(Order)
+        timed('read_market', Agent.read_market, Market, verbose=False)
+        timed('optimize_strategy', Agent.optimize_strategy, verbose=False)
+        timed('commit', Agent.commit)
+        if solver_stats is not None:
+            solver_stats['n_paths'].append(len(Agent.paths))
+            solver_stats['n_hops'].append(int(Agent.engine.n_hops.sum()))
+            solver_stats['nit'].append(int(Agent.result.nit))
+            solver_stats['nfev'].append(int(Agent.result.nfev))
+            solver_stats['njev'].append(int(Agent.result.njev))
+            solver_stats['status'].append(int(Agent.result.status))
+    return failed
+
+def run_benchmarks(sizes, n_orders=20, pools_per_pair=1, degree=4.0, reserve_distribution='lognormal',
+                   seed=0, repeat=3, memory=True):
+    """
+    Benchmarks each stage of the pipeline on generated markets of increasing size.
+
+    Parameters:
+    -----------
+    sizes : list
+        The numbers of pools of the generated markets.
+    n_orders : int, optional
+        The number of orders solved on each market. Default is 20.
+    pools_per_pair, degree, reserve_distribution, seed :
+        Passed to generate_market().
+    repeat : int, optional
+        The number of times the pipeline is run on each market. Default is 3.
+    memory : bool, optional
+        Measures the peak memory of the pipeline with tracemalloc, in an additional run so that
+        the timings are not affected. Default is True.
+
+    Returns:
+    --------
+    list
+        One dictionary per size, with the latency percentiles of each stage, the solver
+        statistics and the peak memory.
+    """
+    results = []
+    for n_pools in sizes:
+        data = generate_market(n_pools, pools_per_pair=pools_per_pair, degree=degree,
+                               reserve_distribution=reserve_distribution, n_orders=n_orders, seed=seed)
+        text = json.dumps(data)
+        timings = {stage: [] for stage in STAGES}
+        solver_stats = {key: [] for key in ['n_paths', 'n_hops', 'nit', 'nfev', 'njev', 'status']}
+        for i in range(repeat):
+            failed = run_pipeline(text, timings, solver_stats if i == 0 else None)
+
+        peak_memory = None
+        if memory:
+            tracemalloc.start()
+            run_pipeline(text)
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        n_tokens = len({token for venue_info in data['venues'].values() for token in venue_info['reserves']})
+        result = {
+            'n_pools': len(data['venues']),
+            'n_tokens': n_tokens,
+            'n_orders': n_orders,
+            'failed_orders': failed,
+            'stages': {stage: summarize(samples) for stage, samples in timings.items()},
+            'solver': {key: summarize(values) for key, values in solver_stats.items() if key != 'status'},
+            'status_counts': {str(status): solver_stats['status'].count(status) for status in sorted(set(solver_stats['status']))},
+            'peak_memory_bytes': peak_memory
+        }
+        results.append(result)
+        print(f"{result['n_pools']:>8} pools {n_tokens:>7} tokens | " +
+              " ".join(f"{stage} {result['stages'][stage].get('p50', float('nan')) * 1e3:.3f}ms" for stage in STAGES) +
+              (f" | peak {peak_memory / 2**20:.1f} MiB" if memory else ""))
+    return results
+
+def metadata(args):
+    """
+    Returns the environment of the run, to compare the results of different commits.
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'platform': platform.platform(),
+        'arguments': vars(args)
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmarks the pipeline on generated markets of increasing size.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000, 100000], help='Numbers of pools')
+    parser.add_argument('--orders', type=int, default=20, help='Number of orders solved on each market')
+    parser.add_argument('--pools-per-pair', type=int, default=1, help='Number of parallel pools on each token pair')
+    parser.add_argument('--degree', type=float, default=4.0, help='Average number of neighbour tokens of each token')
+    parser.add_argument('--reserves', type=str, default='lognormal', choices=['lognormal', 'uniform'],
+                        help='Distribution of the value locked in each pool')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs on each market')
+    parser.add_argument('--no-memory', action='store_true', help='Do not measure the peak memory')
+    parser.add_argument('--output', type=str, default=None, help='Path of the JSON file with the results')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes, n_orders=args.orders, pools_per_pair=args.pools_per_pair, degree=args.degree,
+                             reserve_distribution=args.reserves, seed=args.seed, repeat=args.repeat,
+                             memory=not args.no_memory)
+
+    output = args.output or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results',
+                                         time.strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({'metadata': metadata(args), 'results': results}, f, indent=4)
+    print("Results written to " + output)
@@ -0,0 +1,71 @@
+import sys
+import os
+import argparse
+import json
+import subprocess
+import numpy as np
+
+SRC = os.path.abspath(os.path.join(os.path.dirname(__file__), '../src'))
+
+# Modules the headless solver must not load: plotting, graphs, fetching, the service event loop
+# and the worker pools are loaded on demand
+LAZY_MODULES = ['matplotlib', 'networkx', 'requests', 'asyncio', 'concurrent.futures.process', 'concurrent.futures.thread']
+
+PROBE = """
+import sys
+import json
+import time
+sys.path.insert(0, {src!r})
+start = time.perf_counter()
+import mev_project_interface
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'loaded': [name for name in {lazy!r} if name in sys.modules]}}))
+"""
+
+def measure_startup(repeat=5):
+    """
+    Measures the cold start of the headless solver (src/mev_solve.py): the time to import
+    mev_project_interface in a new interpreter, and the lazy modules it loads.
+
+    Parameters:
+    -----------
+    repeat : int, optional
+        The number of interpreters started. Default is 5.
+
+    Returns:
+    --------
+    dict
+        The 'min', 'p50' and 'max' seconds of the import and the 'loaded' lazy modules.
+    """
+    samples = []
+    loaded = set()
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', PROBE.format(src=SRC, lazy=LAZY_MODULES)],
+                                capture_output=True, text=True, check=True).stdout
+        probe = json.loads(output.strip().splitlines()[-1])
+        samples.append(probe['seconds'])
+        loaded.update(probe['loaded'])
+    return {
+        'min': float(np.min(samples)),
+        'p50': float(np.percentile(samples, 50)),
+        'max': float(np.max(samples)),
+        'loaded': sorted(loaded)
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Checks the cold start time and the imports of the headless solver.')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of interpreters started')
+    parser.add_argument('--budget', type=float, default=1.0, help='Maximum median import time in seconds')
+    args = parser.parse_args()
+
+    startup = measure_startup(args.repeat)
+    print(f"Cold start: p50 {startup['p50']:.3f}s, min {startup['min']:.3f}s, max {startup['max']:.3f}s (budget {args.budget:.3f}s)")
+
+    failed = False
+    if startup['loaded']:
+        print("Modules that should be loaded on demand: " + ", ".join(startup['loaded']))
+        failed = True
+    if startup['p50'] > args.budget:
+        print("The cold start exceeds the budget.")
+        failed = True
+    sys.exit(1 if failed else 0)
@@ -5,5 +5,20 @@ __author__ = 'Luca Nicoli'
 # Import submodules
 from .order import order
 from .venue import venue
+from .venue_view import venue_view
 from .market import market
+from .curves import make_curve, register_curve
+from .market_snapshot import market_snapshot
 from .agent import agent
+from .path_engine import path_engine
+from .water_filling import water_filling, solver_result
+from .dual_decomposition import dual_decomposition
+from .strategy_cache import strategy_cache
+from .solution_memory import solution_memory
+from .amount import parse_amount, parse_amounts, format_amount, format_amounts, to_raw, to_float
+from .batch_auction import batch_auction
+from .parallel_scheduler import parallel_scheduler
+from .replay_runner import replay_runner
+from .venue_fetcher import venue_fetcher
+from .arbitrage_scanner import arbitrage_scanner
+from .instrumentation import instrumentation, instruments, null_sink, log_sink, json_lines_sink, memory_sink
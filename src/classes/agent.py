@@ -1,10 +1,14 @@
-import networkx as nx
-from matplotlib import pyplot as plt
-import sys
-from scipy.optimize import minimize, Bounds, differential_evolution, NonlinearConstraint
+import heapq
+import itertools
+from scipy.optimize import minimize, Bounds, differential_evolution, NonlinearConstraint, approx_fprime
 import copy
 import numpy as np
 import json
+from .path_engine import path_engine
+from .water_filling import water_filling
+from .dual_decomposition import dual_decomposition
+from .amount import format_amount, to_raw, to_float
+from .instrumentation import instruments
 
 class agent:
     """
@@ -16,15 +20,42 @@ class agent:
     order : order
         An order object to store the current order information.
     venues : list
-        A list containing venue instances.
+        A list containing the venue instances of the market read by the agent.
+    market : market
+        The market, or market snapshot, read by the agent. It is never modified by the agent.
+    reserve_overlay : dict
+        The exact reserves changed by the trades of the agent and not yet committed, by reserve slot.
+        Copy-on-write: the reserves of the market are read where the overlay has no entry.
+    trades : dict
+        The exact amounts exchanged in each venue by the last order, by venue name.
     strategy : nx.DiGraph
-        A directed graph to store the paths from sell_token to buy_token, called strategy.
+        A directed graph of the paths from sell_token to buy_token, called strategy, built on demand
+        from self.paths (e.g. for plotting).
     paths : list
-        A list of the paths from sell_token to buy_token.
+        A list of the routes from sell_token to buy_token, each a list of edges visiting one venue,
+        the best marginal rate at zero size first.
+    max_routes : int
+        The maximum number of routes of the strategy. Default is 32.
+    pruned : list
+        The routes removed by prune_routes() before the last optimization, with the reason of the pruning.
+    virtual_pools : list
+        The (R_in, R_out) liquidities of the virtual constant product pool equivalent to each path.
+    engine : path_engine
+        The compiled evaluation engine of the paths, used in the optimization.
+    solution_memory : solution_memory
+        The last optimal allocations of the token pairs, shared by the agents to warm start SLSQP, or None.
+    strategy_cache : strategy_cache
+        The cache of the compiled strategies of the token pairs, shared by the agents, or None.
+    token_paths : list
+        The simple paths of tokens from sell_token to buy_token found in the market.
+    flow_edges : list
+        The directed venue uses of the flow formulation, one edge per venue and direction.
+    result : object
+        The outcome of the last optimization (status, message, number of iterations ...).
 
     Methods:
     --------
-    __init__():
+    __init__(strategy_cache=None, solution_memory=None):
         Constructs all the necessary attributes for the agent object.
 
     read_order(Order):
@@ -33,42 +64,94 @@ class agent:
     print_order():
         Prints the current order information.
 
-    read_market(market, verbose=True):
+    read_market(market, verbose=False):
         Evaluates paths in the market connecting sell_token with buy_token of the current order.
         Identifies the venues to visit and the sell and buy tokens for each venue.
-        Calls make_strategy() to create the strategy graph and the paths the agent needs to follow.
+        Calls make_strategy() to create the paths the agent needs to follow,
+        and compiles the paths into the evaluation engine.
 
-    make_strategy(path, market, verbose=False):
-        Given a path in the market, identifies the venues to visit and the sell and buy tokens for each venue.
-        Constructs the strategy graph (tokens as nodes and venues as edges) and creates the self.paths list.
+    make_strategy(path, market, verbose=False, max_routes=None):
+        Given a path in the market, adds its best routes to the strategy.
+
+    expand_routes(path, market):
+        Generates lazily the routes along a path, one venue per hop, the best marginal rate at zero size first.
+
+    add_route(route, market, verbose=False):
+        Adds a route to the self.paths list, caching the virtual pool equivalent to the route in self.virtual_pools.
+
+    generate_strategy():
+        Generates the strategy graph (tokens as nodes and venues as edges) from self.paths.
 
     plot_strategy():
         Plots the strategy graph using matplotlib.
 
-    propagate_along(path, initial_sell_coin_amount):
+    propagate_along(path, initial_sell_coin_amount, virtual_pool=None):
         Propagates an initial amount of coins sold through the chain of venues stored in path,
         outputting the amount of coins bought at the end of the path.
 
-    optimize_strategy():
+    paths_share_venues():
+        Checks whether some venue is visited by more than one path.
+
+    prune_routes(verbose=False):
+        Removes the routes that cannot receive flow, below the limit rate or dominated by another route.
+
+    optimize_strategy(analytic_gradient=True, check_gradient=False, solver='auto', verbose=False, prune=True, formulation='path'):
         Optimizes the strategy to maximize the order surplus by defining a surplus function to be maximized,
-        setting constraints, and using the SLSQP method to find the optimal solution.
+        setting constraints, and using either the closed-form water filling allocator or the SLSQP method
+        to find the optimal solution.
+
+    flow_network():
+        Collects the directed venue uses of all the paths of tokens, the edges of the flow formulation.
+
+    optimize_flows(polish='auto', verbose=False):
+        Maximizes the order surplus with one flow per directed venue use, by dual decomposition.
 
     update_venues(optimal_coins_sell):
-        Updates the venues' reserves based on the optimal coins to sell along each path.
+        Records the trades and the new reserves of the venues in the overlay of the agent.
+
+    update_flows(optimal_flows):
+        Records the trades of the flows of the venues in the overlay of the agent.
+
+    commit(Market=None):
+        Applies the trades recorded in the overlay to the reserves of the market.
+
+    results():
+        Returns the result of the surplus maximization as a dictionary.
 
     print_results(file=None):
         Prints the result of the surplus maximization, either to the console or to a specified file.
     """
 
 
-    def __init__(self):
+    def __init__(self, strategy_cache=None, solution_memory=None):
         """
         Constructs all the necessary attributes for the agent object.
+
+        Parameters:
+        -----------
+        strategy_cache : strategy_cache, optional
+            The cache of the compiled strategies, shared by the agents solving orders for the same
+            token pairs. Default is None, the strategy is built for every order.
+        solution_memory : solution_memory, optional
+            The last optimal allocations of the token pairs, shared by the agents solving orders for the
+            same token pairs, to warm start SLSQP. Default is None, SLSQP starts from zero.
         """
         self.order = None
         self.venues = None
-        self.strategy = None
+        self.market = None
+        self.reserve_overlay = {}
+        self.trades = {}
+        self._strategy = None
         self.paths = None
+        self.max_routes = 32
+        self.pruned = []
+        self.virtual_pools = None
+        self.engine = None
+        self.strategy_cache = strategy_cache
+        self.solution_memory = solution_memory
+        self.token_paths = []
+        self.flow_edges = None
+        self.result = None
 
     def read_order(self, Order):
         """
@@ -91,25 +174,33 @@ class agent:
         else:
             print("No order found.")
 
-    def read_market(self, market, verbose = True):
+    def read_market(self, market, verbose = False):
         """
         Evaluates paths in the market connecting sell_token with buy_token of the current order.
         Identifies the venues to visit and the sell and buy tokens for each venue.
-        Calling agent.make_strategy() this method also creates the strategy graph and the 
-        paths the agent needs to follow.
+        Calling agent.make_strategy() this method also creates the paths the agent needs to follow,
+        from which the strategy graph is generated on demand.
 
         This method performs the following steps:
         1. Checks if there is an existing order. If not, prints a message and returns.
         2. Initializes `sell_token` and `buy_token` from the current order.
-        3. Copies the market venues to the agent's venues.
-        4. Attempts to find all simple paths from `sell_token` to `buy_token` in the market graph:
+        3. Reads the market venues, resets `self.paths`, `self.virtual_pools` and `self.trades`, and
+           the reserve overlay if the market is not the one read by the previous order.
+        4. Gets the simple paths from `sell_token` to `buy_token` from the path index of the market
+           (market.find_paths()), bounded by market.max_hops and computed only once per token pair:
            - If paths are found:
-             a. Initializes the strategy graph (`self.strategy`) as a directed graph.
-             b. Initializes `self.paths` as an empty list.
-             c. Prints the paths if `verbose` is `True`.
-             d. Iterates over each path, printing the path and calling `self.make_strategy` to create and store strategy information.
+             a. Prints the paths if `verbose` is `True`.
+             b. Generates lazily the routes of all the paths, i.e. one venue per hop when several venues
+                swap the same tokens (`self.expand_routes`), merged in decreasing marginal rate at zero size.
+             c. Adds the best `self.max_routes` routes to `self.paths` (`self.add_route`).
+             d. Compiles `self.paths` into the vectorized evaluation engine (`self.engine`).
+             If the agent has a strategy cache holding the token pair for the topology of the market (and,
+             when the pair has more than max_routes routes, for the same reserves), steps b. to d. are replaced
+             by the routes and the engine of the cache, the engine being evaluated with the current reserves
+             and the edges of the routes copied with the current liquidities (see classes.strategy_cache).
            - If no paths are found, prints a message indicating so.
-        5. Catches `nx.NetworkXNoPath` exception and prints a message if no paths are found.
+        5. Records the 'find_paths' and 'make_strategy' spans and the 'paths' and 'hops' counters
+           in the instrumentation (see classes.instrumentation), silent by default.
 
         Note:
             - Paths connecting token A to B are a list of token names e.g. [A, C, D, B]
@@ -117,9 +208,9 @@ class agent:
         Parameters:
         -----------
         market : Market
-            The market object containing the graph of tokens and venues.
+            The market object containing the graph of tokens and venues, or a snapshot of it.
         verbose: bool
-            Print additional information
+            Print additional information. Default is False.
         """
         if not self.order:
             print("No order to evaluate.")
@@ -127,53 +218,69 @@ class agent:
 
         sell_token = self.order.sell_token
         buy_token =  self.order.buy_token
-        self.venues = copy.copy(market.venues)
-        try:
-            # Gett all simple paths from initial sell_token to final buy_token
-            paths = list(nx.all_simple_paths(market.graph, source=sell_token, target=buy_token))
-            if paths:
-                # Initialize the strategy graph
-                self.strategy = nx.DiGraph()
-                self.paths = []
+        if market is not self.market:
+            self.reserve_overlay = {}
+        self.venues = market.venues
+        self.market = market
+        self.trades = {}
+        self.paths = []
+        self._strategy = None
+        self.virtual_pools = []
+        self.flow_edges = None
+        # Get the simple paths from initial sell_token to final buy_token
+        with instruments.span('find_paths', order=self.order.order_number):
+            paths = market.find_paths(sell_token, buy_token)
+        self.token_paths = paths
+        if paths:
+            with instruments.span('make_strategy', order=self.order.order_number):
                 if verbose:
                     print(f"Paths from {sell_token} to {buy_token} for order {self.order.order_number}:")
-                for path in paths:
-                    if verbose:
+                    for path in paths:
                         print(" -> ".join(path))
-                    
-                    # Make the strategy graph and store the strategy information
-                    self.make_strategy(path, market, verbose = verbose)
-            else:
-                print(f"No paths found from {sell_token} to {buy_token} for order {self.order['order_number']}.")
-        except nx.NetworkXNoPath:
-            print(f"No paths found from {sell_token} to {buy_token} for order {self.order['order_number']}.")
 
-    def make_strategy(self, path, market, verbose=False):
+                entry = None
+                if self.strategy_cache is not None:
+                    entry = self.strategy_cache.get(market, sell_token, buy_token, self.max_routes,
+                                                    None if self.reserve_overlay else market.reserve_version)
+                if entry is not None:
+                    # Compiled strategy of the pair, evaluated with the current reserves, best marginal rate first
+                    engine = entry['engine'].with_reserves(self._reserves())
+                    order = np.argsort(-(engine.reserve_out / engine.reserve_in), kind='stable')
+                    self.engine = engine.take(order)
+                    # Copies of the cached edges, with the liquidities of the current reserves
+                    self.paths = [[dict(edge_data, liquidity_sell_token=float(self.engine.liquidity_sell_token[i, hop]),
+                                        liquidity_buy_token=float(self.engine.liquidity_buy_token[i, hop]))
+                                   for hop, edge_data in enumerate(entry['paths'][path])]
+                                  for i, path in enumerate(order)]
+                    self.virtual_pools = list(zip(self.engine.reserve_in, self.engine.reserve_out))
+                else:
+                    # Routes of all the paths, the best marginal rate at zero size first, up to max_routes
+                    routes = heapq.merge(*(self.expand_routes(path, market) for path in paths), key=lambda candidate: -candidate[0])
+                    for rate, route in itertools.islice(routes, self.max_routes):
+                        # Store the strategy information
+                        self.add_route(route, market, verbose = verbose)
+
+                    # Compile the paths into arrays for the vectorized evaluation
+                    self.engine = path_engine(self.paths, self.virtual_pools)
+                    if self.strategy_cache is not None:
+                        complete = next(routes, None) is None
+                        self.strategy_cache.put(market, sell_token, buy_token, self.max_routes,
+                                                list(self.paths), self.engine, complete=complete)
+            instruments.count('paths', len(self.paths), order=self.order.order_number)
+            instruments.count('hops', int(self.engine.n_hops.sum()), order=self.order.order_number)
+        else:
+            instruments.count('paths', 0, order=self.order.order_number)
+            print(f"No paths found from {sell_token} to {buy_token} for order {self.order.order_number}.")
+
+    def make_strategy(self, path, market, verbose=False, max_routes=None):
         """
         Given a path in the market, which is a collection of token names identifying the nodes that lead from
         A -> .. -> B,  (A = token sold by user, B = final token bought by user) it identifies the venues to 
         visit and the sell and buy tokens for each venue.
-        It constructs the strategy graph (tokens as nodes and venues as edges). The strategy graph is a 
-        directed sub-graph of the market graph containing only the nodes and edges needed to fulfill the user order.
-        Moreover it creates the self.paths list. This list contains for a specific A -> .. -> B set of connected nodes,
-        the venues that need to be visited.
-
-        This method performs the following steps:
-        1. Initializes a split variable to handle multigraphs.
-        2. Iterates over each pair of consecutive tokens in the path.
-        3. Checks if there is an edge between the token pair in the market graph.
-        4. Gathers edge data from the market graph, including venues and liquidity information, and defines the price function
-        5. Constructs or updates the strategy graph:
-           - Gathers relevant information for each venue in the edge.
-           - Prints information if `verbose` is `True`.
-           - Updates the strategy graph, handling multigraphs by appending new variables if an edge already exists.
-        6. Checks if the multigraph is too complex and exits if it is.
-        7. Stores paths in self.paths. These are the edges, i.e. venues, that are visited along a specific coin path (A -> C -> B)
+        When several venues swap the same pair of tokens, every combination of one venue per hop is a
+        different route: the routes are generated lazily, the best marginal rate at zero size first
+        (expand_routes()), and the best max_routes of them are added to the strategy (add_route()).
 
-        Note:
-            -Each edge of the strategy graph will be associated to a sell_token and to a buy_token uniquely defined 
-             from the directionality of the graph. This allows to assign to each edge the proper price_function.
-        
         Parameters:
         -----------
         path : list
@@ -182,66 +289,160 @@ class agent:
             The market object containing the graph of tokens and venues.
         verbose: bool
             Prints additional information
+        max_routes : int, optional
+            The maximum number of routes added for the path. Default is self.max_routes.
         """
-        split = 1
+        for rate, route in itertools.islice(self.expand_routes(path, market), max_routes or self.max_routes):
+            self.add_route(route, market, verbose=verbose)
+
+    def expand_routes(self, path, market):
+        """
+        Generates lazily the routes along a path of tokens, the best marginal rate at zero size first.
+
+        A route visits one venue per hop of the path. Its marginal rate at zero size is the product of
+        the marginal rates of its venues, L_buy/L_sell for fee-less constant product venues, so the routes are the cross product of the venues of each
+        hop, ranked by a product of per-hop rates. The venues of each hop are sorted by rate and the
+        cross product is explored best first with a heap, starting from the best venue of every hop:
+        generating the k best routes costs O(k hops log k), whatever the size of the cross product.
+
+        Parameters:
+        -----------
+        path : list
+            The list of tokens representing the path.
+        market : Market
+            The market object containing the graph of tokens and venues.
+
+        Yields:
+        -------
+        tuple
+            The marginal rate at zero size of the route, and the route, a list of one
+            (venue, slot_sell_token, slot_buy_token, liquidity_sell_token, liquidity_buy_token) tuple per hop.
+        """
+        hops = []
         for i in range(len(path) - 1): # Go through the path
-            token1 = path[i]
-            token2 = path[i + 1]
-            if market.graph.has_edge(token1, token2):
-                # gather edge data information from the market graph
-                edge_data = market.graph[token1][token2]
-                venues = edge_data['venues']
-                for ven_indx, venue in enumerate(venues):
-                    # Gather information from the venues in that edge
-                    sell_token_number = edge_data['tokens'][ven_indx].index(token1) + 1
-                    buy_token_number = edge_data['tokens'][ven_indx].index(token2) + 1
-                    liquidity_sell_token = edge_data['liquidity_token' + str(sell_token_number)][ven_indx]
-                    liquidity_buy_token = edge_data['liquidity_token' + str(buy_token_number)][ven_indx]
-
-                    if verbose:
-                        print(f"Venue: {venue}, Sell Token: {token1}, Buy Token: {token2}, Liquidity: {liquidity_sell_token} {token1}, {liquidity_buy_token} {token2}")
-
-                    # Construct strategy graph, assign the price_function, and all the data needed for the trade in each edge
-                    if self.strategy.has_edge(token1,token2): # Multigraph, update appending the new variables
-                        self.strategy[token1][token2]['venue'].append(venue)
-                        self.strategy[token1][token2]['price_function'].append(market.price_function)
-                        self.strategy[token1][token2]['liquidity_sell_token'].append(liquidity_sell_token)
-                        self.strategy[token1][token2]['liquidity_buy_token'].append(liquidity_buy_token)
-                        split += 1 #variable needed to construct split paths for multigraphs
-                    else:
-                        self.strategy.add_edge(token1, token2, sell_token=token1, buy_token=token2, venue=[venue], price_function=[market.price_function],
-                                               liquidity_sell_token=[liquidity_sell_token], 
-                                               liquidity_buy_token=[liquidity_buy_token])
-
-        # Approximation. If the multigraph is too complex I exit.
-        if (split > 2 and len(path) > 2) : # I have more than 2 splitting and a more than 2 tokens. Of course it is an approximation to make the code work in the third exercise.
-            print('**********************')
-            print('ERROR: the market multigraph is too complex.')
-            sys.exit()
-
-        # Store the paths where the agent will have to propagate
-        edges =[[] for i in range(split)]
-        for path_indx in range(split):
-            for i in range(len(path)-1):
-                if(len(self.strategy[path[i]][path[i+1]]['venue']) > 1): #is a multigraph, split the path
-                    # Copy the values of the specific path and flatten them out
-                    edge_to_append = self.strategy[path[i]][path[i+1]].copy()
-                    edge_to_append['venue'] = edge_to_append['venue'][path_indx]
-                    edge_to_append['price_function'] = edge_to_append['price_function'][path_indx]
-                    edge_to_append['liquidity_sell_token'] = edge_to_append['liquidity_sell_token'][path_indx]
-                    edge_to_append['liquidity_buy_token']  = edge_to_append['liquidity_buy_token'][path_indx]
-                    edges[path_indx].append(edge_to_append) 
-                else:
-                    edge_to_append = self.strategy.edges[path[i], path[i+1]].copy()
-                    edge_to_append['venue'] = edge_to_append['venue'][0]
-                    edge_to_append['price_function'] = edge_to_append['price_function'][0]
-                    edge_to_append['liquidity_sell_token'] = edge_to_append['liquidity_sell_token'][0]
-                    edge_to_append['liquidity_buy_token']  = edge_to_append['liquidity_buy_token'][0]
-                    edges[path_indx].append(edge_to_append) 
-
-        # Create the paths as a list of edges with the specific information
-        for edge in edges:
-            self.paths.append(edge)
+            # Gather the venues of this edge and the reserve slots of the two tokens from the market arrays
+            candidates = []
+            for venue, slot_sell_token, slot_buy_token in market.pools_between(path[i], path[i + 1]):
+                liquidity_sell_token = market.reserves[slot_sell_token]
+                liquidity_buy_token = market.reserves[slot_buy_token]
+                if slot_sell_token in self.reserve_overlay or slot_buy_token in self.reserve_overlay:
+                    liquidity_sell_token = to_float(self._raw_reserve(slot_sell_token))
+                    liquidity_buy_token = to_float(self._raw_reserve(slot_buy_token))
+                price_function = market.curve_pair(venue, path[i], path[i + 1])
+                candidates.append((float(price_function.marginal_rate(liquidity_sell_token, liquidity_buy_token)),
+                                   (venue, slot_sell_token, slot_buy_token, liquidity_sell_token, liquidity_buy_token)))
+            if not candidates:
+                return
+            # Stable sort, parallel venues with the same rate keep their order in the market
+            candidates.sort(key=lambda candidate: -candidate[0])
+            hops.append(candidates)
+
+        def rate(indices):
+            return float(np.prod([hops[hop][index][0] for hop, index in enumerate(indices)]))
+
+        start = (0,) * len(hops)
+        heap = [(-rate(start), start)]
+        seen = {start}
+        while heap:
+            minus_rate, indices = heapq.heappop(heap)
+            yield -minus_rate, [hops[hop][index][1] for hop, index in enumerate(indices)]
+            for hop in range(len(hops)):
+                if indices[hop] + 1 < len(hops[hop]):
+                    successor = indices[:hop] + (indices[hop] + 1,) + indices[hop + 1:]
+                    if successor not in seen:
+                        seen.add(successor)
+                        heapq.heappush(heap, (-rate(successor), successor))
+
+    def add_route(self, route, market, verbose=False):
+        """
+        Adds a route to the strategy: stores it in self.paths as the list of the edges it visits, each
+        with a single venue, and collapses it into its equivalent
+        virtual constant product pool, cached in self.virtual_pools, so that the optimization evaluates
+        a route in O(1) instead of O(hops). The price_function of each edge is the curve of its venue in
+        the direction of the trade (market.curve_pair()), resolved here once for all the evaluations.
+
+        Note:
+            -Each edge will be associated to a sell_token and to a buy_token uniquely defined from the
+             directionality of the route. This allows to assign to each edge the proper price_function.
+            -The strategy graph is not built here but on demand (see generate_strategy()).
+
+        Parameters:
+        -----------
+        route : list
+            One (venue, slot_sell_token, slot_buy_token, liquidity_sell_token, liquidity_buy_token) tuple per hop,
+            see expand_routes().
+        market : Market
+            The market object containing the graph of tokens and venues.
+        verbose: bool
+            Prints additional information
+        """
+        edges = []
+        for venue, slot_sell_token, slot_buy_token, liquidity_sell_token, liquidity_buy_token in route:
+            token1 = market.tokens[market.reserve_tokens[slot_sell_token]]
+            token2 = market.tokens[market.reserve_tokens[slot_buy_token]]
+            price_function = market.curve_pair(venue, token1, token2)
+            if verbose:
+                print(f"Venue: {venue}, Sell Token: {token1}, Buy Token: {token2}, Liquidity: {liquidity_sell_token} {token1}, {liquidity_buy_token} {token2}")
+
+            # The edge of the path, with the price_function and all the data needed for the trade
+            edges.append({'sell_token': token1, 'buy_token': token2, 'venue': venue, 'price_function': price_function,
+                          'liquidity_sell_token': liquidity_sell_token, 'liquidity_buy_token': liquidity_buy_token,
+                          'slot_sell_token': slot_sell_token, 'slot_buy_token': slot_buy_token})
+
+        self.paths.append(edges)
+        self.virtual_pools.append(self._virtual_pool(edges))
+        self._strategy = None
+
+    def _virtual_pool(self, edges):
+        """
+        Returns the virtual pool of a route: the equivalent constant product pool if all its venues are
+        constant product venues, their fees scaling the sell liquidities, otherwise (1, marginal rate at
+        zero size), which only ranks the route (see classes.path_engine).
+        """
+        reserve_factors = [edge_data['price_function'].reserve_factor for edge_data in edges]
+        if None in reserve_factors:
+            rate = np.prod([edge_data['price_function'].marginal_rate(edge_data['liquidity_sell_token'], edge_data['liquidity_buy_token'])
+                            for edge_data in edges])
+            return 1.0, float(rate)
+        return self.market.virtual_pool([edge_data['liquidity_sell_token'] * reserve_factor
+                                         for edge_data, reserve_factor in zip(edges, reserve_factors)],
+                                        [edge_data['liquidity_buy_token'] for edge_data in edges])
+
+    @property
+    def strategy(self):
+        """
+        The strategy graph of the paths, generated on the first access after the paths change.
+        """
+        if self._strategy is None and self.paths:
+            self._strategy = self.generate_strategy()
+        return self._strategy
+
+    def generate_strategy(self):
+        """
+        Generates the strategy graph from self.paths: tokens as nodes and one edge per pair of tokens
+        swapped by the routes, holding the list of the venues used by the routes for the swap.
+        networkx is imported here, so that solving orders does not load it.
+
+        Returns:
+        --------
+        nx.DiGraph
+            The strategy graph.
+        """
+        import networkx as nx
+
+        strategy = nx.DiGraph()
+        for path in self.paths:
+            for edge in path:
+                token1, token2 = edge['sell_token'], edge['buy_token']
+                if not strategy.has_edge(token1, token2):
+                    strategy.add_edge(token1, token2, sell_token=token1, buy_token=token2, venue=[], price_function=[],
+                                      liquidity_sell_token=[], liquidity_buy_token=[], slot_sell_token=[], slot_buy_token=[])
+                edge_data = strategy[token1][token2]
+                if edge['venue'] not in edge_data['venue']: # Multigraph, update appending the new variables
+                    for key in ('venue', 'price_function', 'liquidity_sell_token', 'liquidity_buy_token',
+                                'slot_sell_token', 'slot_buy_token'):
+                        edge_data[key].append(edge[key])
+        return strategy
 
     def plot_strategy(self):
         """
@@ -251,6 +452,9 @@ class agent:
             print("No strategy to plot.")
             return
 
+        import networkx as nx
+        from matplotlib import pyplot as plt
+
         pos = nx.spring_layout(self.strategy)  # positions for all nodes
         plt.figure(figsize=(10, 8))
 
@@ -265,10 +469,12 @@ class agent:
         plt.show()
 
 
-    def propagate_along(self, path, initial_sell_coin_amount):
+    def propagate_along(self, path, initial_sell_coin_amount, virtual_pool=None):
         """
         This function propagates an initial amount of coins sold through the chain of venues stored in path,
         outputting the amount of coins bought at the end of path.
+        If the virtual pool of the path is given, the whole path is evaluated with a single swap,
+        otherwise the amount is propagated hop by hop.
 
         Parameters:
         -----------
@@ -276,19 +482,122 @@ class agent:
             The list of edges of the strategy graph representing the path alogn which we propagate
         initial_sell_coin_amount : float
             The initial amount of coins to sell at the beginning of the path
+        virtual_pool : tuple, optional
+            The (R_in, R_out) virtual pool equivalent to the path, e.g. from self.virtual_pools, for
+            paths of constant product venues only
 
         Returns:
         --------
         float
             The final value after propagation (i.e. the amount of buy_coin of the order bought along that path)
         """
+        if virtual_pool is not None:
+            return self.market.price_function(initial_sell_coin_amount, virtual_pool[0], virtual_pool[1])
+
         current_value = initial_sell_coin_amount
         for edge_data in path:
             # Call price function of this venue for the specific liquidities
             current_value = edge_data['price_function'](current_value, edge_data['liquidity_sell_token'], edge_data['liquidity_buy_token'])
         return current_value
 
-    def optimize_strategy(self):
+    def paths_share_venues(self):
+        """
+        Checks whether some venue is visited by more than one path of the strategy. If not, the paths
+        are independent parallel routes and the surplus maximization has a closed-form solution.
+
+        Returns:
+        --------
+        bool
+            True if at least one venue appears in more than one path.
+        """
+        visited = set()
+        for path in self.paths:
+            path_venues = {edge_data['venue'] for edge_data in path}
+            if visited & path_venues:
+                return True
+            visited |= path_venues
+        return False
+
+    def prune_routes(self, verbose=False):
+        """
+        Removes from the strategy the routes that cannot receive any flow, before the optimization.
+
+        Each route is a virtual constant product pool (R_in, R_out): the amount bought is
+        b(a) = R_out a/(R_in + a), with marginal rate R_out/R_in at zero size, decreasing with a.
+        A route is pruned if:
+        - 'below_limit_rate': its marginal rate at zero size does not exceed the limit rate of the
+          order, limit_buy_amount/limit_sell_amount, so selling along it never increases the surplus.
+        - 'dominated': its marginal rate at zero size does not exceed the marginal rate of another
+          route when the whole limit_sell_amount is sold along that route. Over the whole feasible
+          range of sizes the other route is then always a better use of the next coin.
+        The route with the best marginal rate is never pruned.
+
+        Note:
+            - The rules are exact for independent routes and a partial fill order. Fill-or-kill
+              orders, a binding limit buy amount and routes sharing venues can make a pruned route
+              useful: optimize_strategy() therefore checks the KKT conditions of the solution
+              against the pruned routes and solves again with all of them if they are violated.
+
+        Parameters:
+        -----------
+        verbose : bool, optional
+            Prints the pruned routes. Default is False.
+
+        Returns:
+        --------
+        list
+            The pruned routes, each a dictionary with its 'venues', marginal 'rate' at zero size
+            and the 'reason' of the pruning. Also stored in self.pruned.
+        """
+        rates = self.engine.reserve_out / self.engine.reserve_in
+        limit_rate = self.order.limit_buy_amount / self.order.limit_sell_amount
+        # Marginal rate of each route after selling the whole limit sell amount along it
+        saturated = self.engine.reserve_out * self.engine.reserve_in / (self.engine.reserve_in + self.order.limit_sell_amount)**2
+        best = int(np.argmax(rates))
+
+        keep = []
+        self.pruned = []
+        for i, path in enumerate(self.paths):
+            reason = None
+            if i != best:
+                if rates[i] <= limit_rate:
+                    reason = 'below_limit_rate'
+                elif rates[i] <= np.max(np.delete(saturated, i)):
+                    reason = 'dominated'
+            if reason is None:
+                keep.append(i)
+            else:
+                self.pruned.append({'venues': [edge_data['venue'] for edge_data in path], 'rate': float(rates[i]), 'reason': reason})
+
+        if self.pruned:
+            self._unpruned = (self.paths, self.virtual_pools, self.engine)
+            self.paths = [self.paths[i] for i in keep]
+            self._strategy = None
+            self.virtual_pools = [self.virtual_pools[i] for i in keep]
+            self.engine = self.engine.take(keep)
+        instruments.count('pruned_routes', len(self.pruned), order=self.order.order_number)
+        if verbose:
+            for route in self.pruned:
+                print(f"Pruned route {' -> '.join(route['venues'])} ({route['reason']}, marginal rate {route['rate']:.9g})")
+        return self.pruned
+
+    def _pruning_is_optimal(self, result):
+        """
+        Checks the KKT conditions of a solution found without the pruned routes: no pruned route may
+        have a marginal rate at zero size above the marginal rate of the routes receiving flow,
+        which all share the same marginal rate at the optimum.
+        """
+        if int(result.status) != 0:
+            return False
+        flowing = np.asarray(result.x) > self.order.limit_sell_amount * 1e-9
+        if flowing.any():
+            threshold = np.min(self.engine.gradient(result.x)[flowing])
+        else:
+            threshold = self.order.limit_buy_amount / self.order.limit_sell_amount
+        return all(route['rate'] <= threshold * (1 + 1e-9) for route in self.pruned)
+
+    def optimize_strategy(self, analytic_gradient=True, check_gradient=False, solver='auto', verbose=False, prune=True,
+                          formulation='path'):
         """
         Optimizes the strategy to maximize the order surplus
 
@@ -296,37 +605,84 @@ class agent:
         1. Calculates the worst acceptable exchange rate based on the order's limit sell and buy amounts.
         2. Defines a surplus function to be maximized:
             - The surplus is a function of the coins sold and bought through each path.
-            - Along each path the amount of coins bnought is obtained with the propagate_along() function.
+            - Along each path the amount of coins bought is obtained with the compiled engine, which
+              propagates all the paths at once.
         3. Define Constraints:
            - Defines constraints to ensure the total sell amount does not exceed the limit sell amount and the total buy amount meets or exceeds the limit buy amount.
            - If the order allows partial fills, it sets an inequality constraint for the sell amount; otherwise, it sets an equality constraint for a fill-or-kill order.
+        4. Define Gradients:
+           - If `analytic_gradient` is `True`, the exact gradients of the surplus and of the constraints are
+             obtained from the chained derivatives of the swaps (engine.gradient()).
+             Otherwise SLSQP falls back to finite differences.
+           - If `check_gradient` is `True`, the analytic gradients are compared against finite differences.
+        5. Prune Routes:
+           - If `prune` is `True`, removes the routes below the limit rate of the order or dominated by another
+             route (prune_routes()), so that the optimization has fewer variables. The rules hold for
+             constant product venues only, the routes are not pruned if they visit other curves.
         6. Run Optimization:
-           - Uses the SLSQP method to minimize the negative surplus (maximize surplus) within the specified bounds and constraints.
+           - If the paths do not share venues, only visit constant product venues, and `solver` is 'auto' or
+             'water_filling', the exact KKT solution is computed in closed form by water filling over the virtual
+             pools of the paths.
+           - Otherwise uses the SLSQP method to minimize the negative surplus (maximize surplus) within the specified bounds and constraints.
+             If the agent has a solution memory holding the pair, SLSQP starts from the last optimal allocation of the
+             pair rescaled to the limit sell amount of the order, and from zero again if it fails; the iterations of
+             both runs are counted.
+           - If routes were pruned and one of them has a marginal rate at zero size above the marginal rate of
+             the solution (KKT conditions), or the solver failed, solves again with all the routes.
         7. Extract and Compute Results:
-           - Extracts the optimal sell amounts and computes the resulting buy amounts.
+           - Extracts the optimal sell amounts and computes the resulting buy amounts, and stores them in the
+             solution memory of the agent, if any, when the solver converged.
            - Computes the coin conservation error to check for discrepancies.
-           - Prints optimization results and detailed information for each path.
+           - Prints optimization results and detailed information for each path if `verbose` is `True`.
+           - Records the 'optimizer' span and the 'nit', 'nfev', 'njev', 'status' and 'conservation_error'
+             counters, and the 'warm_start' and 'warm_start_fallback' counters, in the instrumentation
+             (see classes.instrumentation), silent by default.
         8. Update Order and Venues Information:
            - Updates the order with the executed sell and buy amounts.
            - Updates the venues with the optimal sell amounts.
+
+        Parameters:
+        -----------
+        analytic_gradient : bool, optional
+            Pass the exact gradients of the surplus and of the constraints to the solver. Default is True.
+        check_gradient : bool, optional
+            Prints the largest deviation between analytic and finite difference gradients. Default is False.
+        solver : str, optional
+            The solver to use. Default is 'auto'.
+            Supported values:
+            - 'auto', 'water_filling': water filling when the paths do not share venues and only visit constant
+              product venues, SLSQP otherwise.
+            - 'slsqp': always use SLSQP.
+        verbose : bool, optional
+            Prints the outcome of the optimization and of each path. Default is False.
+        prune : bool, optional
+            Removes the routes that cannot receive flow before the optimization (prune_routes()). Default is True.
+        formulation : str, optional
+            The formulation of the problem. Default is 'path'.
+            Supported values:
+            - 'path': one variable per route of the strategy, as described above.
+            - 'flow': one variable per directed venue use, solved by dual decomposition (optimize_flows()).
+              The other parameters are then ignored, except `verbose`.
         
         Returns:
         --------
         tuple
-            The optimal sell amounts and the resulting buy amounts.
+            The optimal sell amounts and the resulting buy amounts. With the flow formulation, the amounts
+            sold to the venues of the sell token and bought from the venues of the buy token.
         """
+        if formulation == 'flow':
+            return self.optimize_flows(verbose=verbose)
+        if formulation != 'path':
+            raise ValueError(f"Unsupported formulation: {formulation}")
         
         # Compute the worst exchange rate acceptable
         exch_rate = self.order.limit_sell_amount/self.order.limit_buy_amount
 
         # Define the surplus function to be maximized
         def surplus(x):
-            total_b = [0.0]*len(self.paths)
-            # Propagate along each path the initial amount
-            for i, path in enumerate(self.paths):
-                total_b[i] += self.propagate_along(path, x[i])
-            a = sum(x)
-            b = sum(total_b)
+            # Propagate along all the paths the initial amounts at once
+            a = np.sum(x)
+            b = self.engine.total_bought(x)
             return -(b - a / exch_rate) # Minimize -surplus
 
         # Constrain on the amount sold
@@ -335,34 +691,43 @@ class agent:
 
         # Constrain on the amount bought
         def constraint_buy(x):
-            total_b = 0
-            for i, path in enumerate(self.paths):
-                total_b += self.propagate_along(path, x[i])
+            total_b = self.engine.total_bought(x)
             return (total_b - self.order.limit_buy_amount)
+
+        # Exact gradients, chaining the derivatives of the swaps along each path
+        def surplus_gradient(x):
+            return -(self.engine.gradient(x) - 1.0 / exch_rate)
+
+        def constraint_sell_gradient(x):
+            return -np.ones(len(x))
+
+        def constraint_buy_gradient(x):
+            return self.engine.gradient(x).reshape(1, -1)
         
-        # Check if continuity is preserved. Sum up swap errors obtained in each venue visited
+        # Check if continuity is preserved. Sum up the exact swap errors of the venues of each path, in 10^-18 units
         def coin_conservation(x,print_=False):
             error = 0
             for i,path in enumerate(self.paths):
                 sell_amount = x[i]
-                for index, edge_data in enumerate(path):
-                    string = 'with ' + str(sell_amount) +  ' buy '
+                string = 'with ' + format_amount(sell_amount) +  ' buy '
+                for edge in path:
+                    liquidity_sell_token = self._raw_reserve(edge['slot_sell_token'])
+                    liquidity_buy_token = self._raw_reserve(edge['slot_buy_token'])
 
-                    # Compute amount bought in this edge with this amount of coins sold
-                    buy_amount = edge_data['price_function'](sell_amount, edge_data['liquidity_sell_token'], edge_data['liquidity_buy_token'],what_='buy')
-                    string += str(buy_amount)
+                    # Compute amount bought in the venue with this amount of coins sold
+                    buy_amount = edge['price_function'](sell_amount, liquidity_sell_token, liquidity_buy_token, what_='buy', exact=True)
 
                     # What is the amount sold corresponding to this amount bought
-                    inverse_buy = edge_data['price_function'](buy_amount, edge_data['liquidity_sell_token'], edge_data['liquidity_buy_token'], what_='sell')
-                    
-                    # Updates conservation error
-                    error += abs(sell_amount - inverse_buy)
+                    inverse_buy = edge['price_function'](buy_amount, liquidity_sell_token, liquidity_buy_token, what_='sell', exact=True)
 
+                    # Updates conservation error, i.e. the rounding kept by the venue
+                    error += sell_amount - inverse_buy
                     sell_amount = buy_amount
-                    string += ' inverse ' + str(inverse_buy)
-                    if print_:
-                        print(string)
-            return error
+                string += format_amount(sell_amount)
+
+                if print_:
+                    print(string)
+            return to_float(error)
 
         
         # Set the constraint dictionary according to the order
@@ -370,86 +735,302 @@ class agent:
             constraints = [{'type': 'ineq', 'fun': constraint_sell}]  # total_sold <= s_lim
         else: #Fly-or-kill
             constraints = [{'type': 'eq', 'fun': constraint_sell}]   # total_sold  = s_lim
-        nlc2 = NonlinearConstraint(constraint_buy, 0, np.inf)
+        if analytic_gradient:
+            constraints[0]['jac'] = constraint_sell_gradient
+            nlc2 = NonlinearConstraint(constraint_buy, 0, np.inf, jac=constraint_buy_gradient)
+        else:
+            nlc2 = NonlinearConstraint(constraint_buy, 0, np.inf)
         constraints.append(nlc2)
 
-        print(" ")
-        print("MEV Agent ready to maximize the surplus .. or at least trying :)")
-
-        # Initial guesses for sell amount through each path
-        initial_guess = [0.0] * len(self.paths)
-
-        # Bounds for the sell amount through each path
-        bounds = Bounds([0.0] * len(self.paths), [self.order.limit_sell_amount] * len(self.paths))
+        if verbose:
+            print(" ")
+            print("MEV Agent ready to maximize the surplus .. or at least trying :)")
+
+        # Drop the routes that cannot receive flow
+        self.pruned = []
+        if prune and len(self.paths) > 1 and self.engine.constant_product.all():
+            self.prune_routes(verbose=verbose)
+
+        # Compare analytic and finite difference gradients at a feasible interior point
+        if check_gradient:
+            x_check = np.full(len(self.paths), self.order.limit_sell_amount / len(self.paths))
+            error_surplus = np.max(np.abs(surplus_gradient(x_check) - approx_fprime(x_check, surplus)))
+            error_buy = np.max(np.abs(constraint_buy_gradient(x_check) - approx_fprime(x_check, constraint_buy)))
+            print("Gradient check (max deviation from finite differences):")
+            print("  surplus:        {:.7e}".format(error_surplus))
+            print("  constraint_buy: {:.7e}".format(error_buy))
 
         # Maximize the surplus
-        result = minimize(surplus, initial_guess, method='SLSQP', bounds=bounds, constraints=constraints)
+        if solver not in ('auto', 'water_filling', 'slsqp'):
+            raise ValueError(f"Unsupported solver: {solver}")
+        order_number = self.order.order_number
+        while True:
+            # Initial guesses for sell amount through each path
+            initial_guess = [0.0] * len(self.paths)
+
+            # Bounds for the sell amount through each path
+            bounds = Bounds([0.0] * len(self.paths), [self.order.limit_sell_amount] * len(self.paths))
+
+            with instruments.span('optimizer', order=order_number):
+                if solver != 'slsqp' and self.engine.constant_product.all() and not self.paths_share_venues():
+                    result = water_filling(self.engine.reserve_in, self.engine.reserve_out, self.order.limit_sell_amount,
+                                           self.order.limit_buy_amount, partial_fill=self.order.partial_fill)
+                else:
+                    if solver == 'water_filling' and verbose:
+                        print("The paths share venues or visit other curves than constant product, falling back to SLSQP.")
+                    jac = surplus_gradient if analytic_gradient else None
+                    # Warm start from the last optimal allocation of the pair, rescaled to the limit sell amount
+                    warm_start = None
+                    if self.solution_memory is not None:
+                        warm_start = self.solution_memory.initial_guess(self.order.sell_token, self.order.buy_token,
+                                                                        self.paths, self.order.limit_sell_amount)
+                    if warm_start is not None:
+                        instruments.count('warm_start', 1, order=order_number)
+                        result = minimize(surplus, warm_start, method='SLSQP', jac=jac, bounds=bounds, constraints=constraints)
+                        if int(result.status) != 0:
+                            # Cold start, counting the iterations of both runs
+                            if verbose:
+                                print("The warm start failed, solving again from zero.")
+                            self.solution_memory.record_fallback()
+                            instruments.count('warm_start_fallback', 1, order=order_number)
+                            warm_result = result
+                            result = minimize(surplus, initial_guess, method='SLSQP', jac=jac, bounds=bounds, constraints=constraints)
+                            result.nit += warm_result.nit
+                            result.nfev += warm_result.nfev
+                            result.njev += warm_result.njev
+                    else:
+                        result = minimize(surplus, initial_guess, method='SLSQP', jac=jac, bounds=bounds, constraints=constraints)
+
+            # A pruned route could improve the solution: solve again with all the routes
+            if not self.pruned or self._pruning_is_optimal(result):
+                break
+            if verbose:
+                print("The pruned routes violate the optimality conditions, solving again with all the routes.")
+            instruments.count('pruning_rejected', 1, order=order_number)
+            self.paths, self.virtual_pools, self.engine = self._unpruned
+            self._strategy = None
+            self.pruned = []
+        instruments.count('nit', int(result.nit), order=order_number)
+        instruments.count('nfev', int(result.nfev), order=order_number)
+        instruments.count('njev', int(result.njev), order=order_number)
+        instruments.count('status', int(result.status), order=order_number)
 
 
         # Extract the optimal values
+        self.result = result
         optimal_coins_sell = result.x
+        if self.solution_memory is not None and int(result.status) == 0:
+            self.solution_memory.remember(self.order.sell_token, self.order.buy_token, self.paths, optimal_coins_sell,
+                                          self.order.limit_sell_amount)
 
         # Compute the resulting values along the paths
-        optimal_coins_buy = [self.propagate_along(self.paths[i], optimal_coins_sell[i]) for i in range(len(self.paths))]
-        
-        # Compute the coin conservation error
-        error = coin_conservation(optimal_coins_sell)
+        optimal_coins_buy = list(self.engine.propagate(optimal_coins_sell))
 
         total_sell = sum(optimal_coins_sell)
         total_buy = sum(optimal_coins_buy)
 
-        print(" ")
-        print("Status:", result.status)
-        if int(result.status) != 0:
-            print('****** ERROR ******    :( ')
-        print("Message:", result.message)
-        print("Number of Iterations:", result.nit)
-        print("Number of Function Evaluations:", result.nfev)
-        print("Number of Gradient Evaluations:", result.njev)
-        print(" ")
-
-        # Print global information
-        print(" ")
-        print("The resulting total value sold   (via all paths) is: {:.18f}".format(total_sell))
-        print("The resulting total value bought (via all paths) is: {:.18f}".format(total_buy))
-        print("The resulting gamma is: {:.18f}".format(total_buy - total_sell/exch_rate))
-        print("Total coin conservation error: {:.7e}".format(error))
-        print(" ")
-
-        # Print path specific information
-        for i, val in enumerate(optimal_coins_sell):
-            path = self.paths[i]
-            vertices = [path[0]['sell_token']]
-            venues = []
-            for edge in path:
-                vertices.append(edge['buy_token'])
-                venues.append(edge['venue'])
-            path_str = " -> ".join(venues)
-            string_sell = f"The resulting total value sold via   {path_str} is: {val:.18f}"
-            string_buy  = f"The resulting total value bought via {path_str} is: {optimal_coins_buy[i]:.18f}"
-            print(string_sell)
-            print(string_buy)
+        if verbose or instruments.enabled:
+            # Compute the coin conservation error
+            error = coin_conservation(self._raw_allocation(optimal_coins_sell))
+            instruments.count('conservation_error', float(error), order=order_number)
+
+        if verbose:
+            print(" ")
+            print("Status:", result.status)
+            if int(result.status) != 0:
+                print('****** ERROR ******    :( ')
+            print("Message:", result.message)
+            print("Number of Iterations:", result.nit)
+            print("Number of Function Evaluations:", result.nfev)
+            print("Number of Gradient Evaluations:", result.njev)
             print(" ")
 
-        # Update order information
-        self.order.ex_sell_amount = total_sell
-        self.order.ex_buy_amount = total_buy
+            # Print global information
+            print(" ")
+            print("The resulting total value sold   (via all paths) is: {:.18f}".format(total_sell))
+            print("The resulting total value bought (via all paths) is: {:.18f}".format(total_buy))
+            print("The resulting gamma is: {:.18f}".format(total_buy - total_sell/exch_rate))
+            print("Total coin conservation error: {:.7e}".format(error))
+            print(" ")
 
-        # Update venues information
-        self.update_venues(optimal_coins_sell)
+            # Print path specific information
+            for i, val in enumerate(optimal_coins_sell):
+                path = self.paths[i]
+                vertices = [path[0]['sell_token']]
+                venues = []
+                for edge in path:
+                    vertices.append(edge['buy_token'])
+                    venues.append(edge['venue'])
+                path_str = " -> ".join(venues)
+                string_sell = f"The resulting total value sold via   {path_str} is: {val:.18f}"
+                string_buy  = f"The resulting total value bought via {path_str} is: {optimal_coins_buy[i]:.18f}"
+                print(string_sell)
+                print(string_buy)
+                print(" ")
+
+        # Update venues information, and the order with the exact amounts settled
+        with instruments.span('update_venues', order=order_number):
+            self.order.raw_ex_sell_amount, self.order.raw_ex_buy_amount = self.update_venues(optimal_coins_sell)
+
+        return optimal_coins_sell, optimal_coins_buy
+
+    def flow_network(self):
+        """
+        Collects the edges of the flow formulation: every venue swapping two consecutive tokens of a
+        path of tokens from sell_token to buy_token, once per direction, whatever the number of paths
+        and routes visiting it. Unlike the routes of the strategy, the edges are not limited by max_routes.
+
+        Returns:
+        --------
+        list
+            The edges, in the format of the edges of self.paths, also stored in self.flow_edges.
+        """
+        market = self.market
+        self.flow_edges = []
+        visited = set()
+        for path in self.token_paths:
+            for i in range(len(path) - 1):
+                for venue, slot_sell_token, slot_buy_token in market.pools_between(path[i], path[i + 1]):
+                    if (slot_sell_token, slot_buy_token) in visited:
+                        continue
+                    visited.add((slot_sell_token, slot_buy_token))
+                    liquidity_sell_token = market.reserves[slot_sell_token]
+                    liquidity_buy_token = market.reserves[slot_buy_token]
+                    if slot_sell_token in self.reserve_overlay or slot_buy_token in self.reserve_overlay:
+                        liquidity_sell_token = to_float(self._raw_reserve(slot_sell_token))
+                        liquidity_buy_token = to_float(self._raw_reserve(slot_buy_token))
+                    self.flow_edges.append({'sell_token': path[i], 'buy_token': path[i + 1], 'venue': venue,
+                                            'price_function': market.curve_pair(venue, path[i], path[i + 1]),
+                                            'liquidity_sell_token': liquidity_sell_token,
+                                            'liquidity_buy_token': liquidity_buy_token,
+                                            'slot_sell_token': slot_sell_token, 'slot_buy_token': slot_buy_token})
+        return self.flow_edges
+
+    def optimize_flows(self, polish='auto', verbose=False):
+        """
+        Optimizes the order surplus with one flow variable per directed venue use, instead of one per route.
+
+        The size of the problem is linear in the number of venues reached by the order, while the number of
+        routes can grow with the product of the venues of each hop, and venues visited by several paths are
+        modelled exactly: the trades of all the paths through a venue are one flow, so the price impact
+        they cause to each other is part of the problem. The problem is solved by dual decomposition over
+        the token prices (see classes.dual_decomposition), and the flows are settled by update_flows().
+
+        Note:
+            - A venue visited in both directions by the paths has one flow per direction, each computed
+              against the current reserves of the venue.
+            - Only constant product venues are supported, with their fees: the closed-form arbitrage of
+              the venues does not hold for the other curves.
+
+        Parameters:
+        -----------
+        polish : bool or str, optional
+            Refines the flows recovered from the dual problem with SLSQP: always if True, never if False,
+            and only if they violate the constraints of the primal problem if 'auto'. Default is 'auto'.
+        verbose : bool, optional
+            Prints the outcome of the optimization and the flow of each venue. Default is False.
+
+        Returns:
+        --------
+        tuple
+            The amounts sold to the venues of the sell token and bought from the venues of the buy token.
+
+        Raises:
+        -------
+        ValueError
+            If a venue reached by the order is not a constant product venue.
+        """
+        if self.flow_edges is None:
+            self.flow_network()
+        edges = self.flow_edges
+        order_number = self.order.order_number
+        exch_rate = self.order.limit_sell_amount/self.order.limit_buy_amount
+
+        token_index = {}
+        for edge in edges:
+            token_index.setdefault(edge['sell_token'], len(token_index))
+            token_index.setdefault(edge['buy_token'], len(token_index))
+        reserve_factors = [edge['price_function'].reserve_factor for edge in edges]
+        if None in reserve_factors:
+            raise ValueError("The flow formulation only supports constant product venues, use the path formulation.")
+        # Fee-less constant product pools equivalent to the venues
+        reserve_in = np.array([edge['liquidity_sell_token'] * reserve_factor for edge, reserve_factor in zip(edges, reserve_factors)],
+                              dtype=float)
+        reserve_out = np.array([edge['liquidity_buy_token'] for edge in edges], dtype=float)
+
+        with instruments.span('optimizer', order=order_number):
+            result = dual_decomposition([token_index[edge['sell_token']] for edge in edges],
+                                        [token_index[edge['buy_token']] for edge in edges],
+                                        reserve_in, reserve_out, len(token_index),
+                                        token_index[self.order.sell_token], token_index[self.order.buy_token],
+                                        self.order.limit_sell_amount, self.order.limit_buy_amount,
+                                        partial_fill=self.order.partial_fill, polish=polish)
+        instruments.count('nit', int(result.nit), order=order_number)
+        instruments.count('nfev', int(result.nfev), order=order_number)
+        instruments.count('njev', int(result.njev), order=order_number)
+        instruments.count('status', int(result.status), order=order_number)
+
+        self.result = result
+        optimal_flows = result.x
+        bought_flows = reserve_out * optimal_flows / (reserve_in + optimal_flows)
+        optimal_coins_sell = [optimal_flows[i] for i, edge in enumerate(edges) if edge['sell_token'] == self.order.sell_token]
+        optimal_coins_buy = [bought_flows[i] for i, edge in enumerate(edges) if edge['buy_token'] == self.order.buy_token]
+        total_sell = sum(optimal_coins_sell)
+        total_buy = sum(optimal_coins_buy)
+
+        if verbose or instruments.enabled:
+            # Rounding kept by the venues with the exact flows, in 10^-18 units
+            error = 0
+            for edge, flow in zip(edges, optimal_flows):
+                sell_amount = to_raw(max(0.0, float(flow)))
+                liquidity_sell_token = self._raw_reserve(edge['slot_sell_token'])
+                liquidity_buy_token = self._raw_reserve(edge['slot_buy_token'])
+                buy_amount = edge['price_function'](sell_amount, liquidity_sell_token, liquidity_buy_token, what_='buy', exact=True)
+                error += sell_amount - edge['price_function'](buy_amount, liquidity_sell_token, liquidity_buy_token, what_='sell', exact=True)
+            error = to_float(error)
+            instruments.count('conservation_error', float(error), order=order_number)
+
+        if verbose:
+            print(" ")
+            print("Status:", result.status)
+            if int(result.status) != 0:
+                print('****** ERROR ******    :( ')
+            print("Message:", result.message)
+            print("Number of Iterations:", result.nit)
+            print("Number of Function Evaluations:", result.nfev)
+            print("Number of Gradient Evaluations:", result.njev)
+            print(" ")
+            print("The resulting total value sold   (via all venues) is: {:.18f}".format(total_sell))
+            print("The resulting total value bought (via all venues) is: {:.18f}".format(total_buy))
+            print("The resulting gamma is: {:.18f}".format(total_buy - total_sell/exch_rate))
+            print("Total coin conservation error: {:.7e}".format(error))
+            print(" ")
+            for edge, flow, bought in zip(edges, optimal_flows, bought_flows):
+                if flow > 0:
+                    print(f"{edge['venue']}: sold {flow:.18f} {edge['sell_token']}, bought {bought:.18f} {edge['buy_token']}")
+            print(" ")
+
+        # Update venues information, and the order with the exact amounts settled
+        with instruments.span('update_venues', order=order_number):
+            self.order.raw_ex_sell_amount, self.order.raw_ex_buy_amount = self.update_flows(optimal_flows)
 
         return optimal_coins_sell, optimal_coins_buy
         
     def update_venues(self, optimal_coins_sell):
         """
-        Updates the venues' reserves based on the optimal coins to sell along each path.
-        This method iterates through each path and updates the reserves of the venues involved 
+        Records the trades of the agent based on the optimal coins to sell along each path.
+        This method iterates through each path and computes the new reserves of the venues involved 
         in the transactions. It calculates the new reserves after selling a specified amount of 
         coins and propagates the outcome of each transaction through the path.
 
         Note:
-            - The values bought in each venue are not stored in memory, thus in this procedure
-              we have to iterate along each path.
+            - The settlement is exact: the amounts sold along each path are converted to integers
+              of 10^-18 units, and each hop is swapped with the exact price function, rounding
+              as on-chain AMMs do. Paths visiting the same venue see the reserves left by the
+              previous ones, as they would on-chain.
+            - The market is not modified: the new reserves are kept in the overlay of the agent,
+              so that many agents can read the same market or snapshot, and are written back
+              to the market by agent.commit().
 
         Parameters:
         -----------
@@ -459,74 +1040,273 @@ class agent:
 
         Updates:
         --------
-        - The `reserves` attribute of each `venue` object in `self.venues` is updated with 
-          the new reserves after the transactions.
-        - Adds 'ex_sell_amount' and 'ex_buy_amount' keys to the `reserves` dictionary of the 
-          respective venues to reflect the external sell and buy amounts for each transaction.
+        - The `reserve_overlay` attribute, with the new reserves of the venues after the transactions.
+        - The `trades` attribute, with the 'sell_token', 'buy_token', 'ex_sell_amount' and 'ex_buy_amount'
+          of each venue, reflecting the external sell and buy amounts for each transaction.
+
+        Returns:
+        --------
+        tuple
+            The exact total amounts sold and bought by the order, in 10^-18 units.
         """
+        raw_coins_sell = self._raw_allocation(optimal_coins_sell)
+        total_sold = 0
+        total_bought = 0
+
         # Cycle over paths 
         for i,path in enumerate(self.paths):
-            current_value = optimal_coins_sell[i]
+            current_value = int(raw_coins_sell[i])
+            total_sold += current_value
             # Get venues in the paths
             for edge_data in path:
                 # Select the correct venue that we are meeting in this edge of the path
-                venue_name = edge_data['venue']
-                for v,venue in enumerate(self.venues):
-                    if venue.name == venue_name:
-                        break
+                trade = self.trades.setdefault(edge_data['venue'], {'ex_buy_amount': 0, 'ex_sell_amount': 0})
+                slot_sell = edge_data['slot_sell_token']
+                slot_buy = edge_data['slot_buy_token']
+                liquidity_sell_token = self._raw_reserve(slot_sell)
+                liquidity_buy_token = self._raw_reserve(slot_buy)
+
+                # Outcome of transaction, rounded as on-chain
+                bought = edge_data['price_function'](current_value, liquidity_sell_token, liquidity_buy_token, what_='buy', exact=True)
 
                 # Update venue information
-                venue.reserves[edge_data['sell_token']] += current_value
-                venue.reserves['ex_buy_amount'] = current_value
+                self.reserve_overlay[slot_sell] = liquidity_sell_token + current_value
+                self.reserve_overlay[slot_buy] = liquidity_buy_token - bought
+                trade['ex_buy_amount'] += current_value
+                trade['ex_sell_amount'] += bought
+                trade['sell_token'] = edge_data['buy_token']
+                trade['buy_token'] = edge_data['sell_token']
+                current_value = bought
+            total_bought += current_value
+
+        return total_sold, total_bought
+
+    def update_flows(self, optimal_flows):
+        """
+        Records the trades of the agent based on the optimal flow of each edge of the flow formulation
+        (self.flow_edges), see optimize_flows().
 
-                # Propagate and get outcome of transaction
-                current_value = edge_data['price_function'](current_value, edge_data['liquidity_sell_token'], edge_data['liquidity_buy_token'])
+        Each token spends exactly the amount it receives from the venues, split among the venues it is
+        sold to in proportion to their flows, and each venue is swapped once with the exact price function.
+        When the flows go around a cycle of tokens the amount spent by a token depends on what it receives
+        back, so the amounts are the fixed point of the settlement, reached from below: at every step a
+        token spends at most what it receives, so the agent never spends coins it does not hold. The amount
+        sold by the order is rounded as in update_venues().
 
-                # Update venue information
-                venue.reserves[edge_data['buy_token']] -= current_value
-                venue.reserves['ex_sell_amount'] = current_value
-                venue.reserves['sell_token'] = edge_data['buy_token']
-                venue.reserves['buy_token'] = edge_data['sell_token']
+        Parameters:
+        -----------
+        optimal_flows : list
+            The amount of coins sold to the venue of each edge of self.flow_edges.
 
-    def print_results(self, file=None):
+        Updates:
+        --------
+        - The `reserve_overlay` attribute, with the new reserves of the venues after the transactions.
+        - The `trades` attribute, as update_venues().
+
+        Returns:
+        --------
+        tuple
+            The exact total amounts sold and bought by the order, in 10^-18 units.
         """
-        Prints the result of the surplus maximization
+        sell_token = self.order.sell_token
+        buy_token = self.order.buy_token
+        raw_flows = [to_raw(max(0.0, float(flow))) for flow in optimal_flows]
+        leaving = {}
+        for i, edge in enumerate(self.flow_edges):
+            if raw_flows[i] > 0 and edge['sell_token'] != buy_token:
+                leaving.setdefault(edge['sell_token'], []).append(i)
+
+        total_sold = sum(raw_flows[i] for i in leaving.get(sell_token, []))
+        limit = self.order.raw_limit_sell_amount
+        if total_sold > 0 and (total_sold > limit or not self.order.partial_fill):
+            total_sold = limit
+
+        # Amount spent by each token, the fixed point of spending what is received
+        spent = {token: 0 for token in leaving}
+        spent[sell_token] = total_sold
+        for _ in range(100):
+            received = self._settle_flows(raw_flows, leaving, spent)
+            updated = {token: received.get(token, 0) for token in leaving}
+            updated[sell_token] = total_sold
+            if updated == spent:
+                break
+            spent = updated
+
+        received = self._settle_flows(raw_flows, leaving, spent, record=True)
+        return total_sold, received.get(buy_token, 0)
+
+    def _settle_flows(self, raw_flows, leaving, spent, record=False):
+        """
+        Swaps the amount spent by each token in the venues it is sold to, split in proportion to their
+        flows, and returns the exact amount received by each token. The trades and the new reserves are
+        recorded only if record is True.
+        """
+        reserves = {}
+        received = {}
+        for token, indices in leaving.items():
+            amount = spent.get(token, 0)
+            total_flow = sum(raw_flows[i] for i in indices)
+            amounts = [amount * raw_flows[i] // total_flow for i in indices]
+            amounts[int(np.argmax(amounts))] += amount - sum(amounts)
+            for i, current_value in zip(indices, amounts):
+                edge_data = self.flow_edges[i]
+                slot_sell = edge_data['slot_sell_token']
+                slot_buy = edge_data['slot_buy_token']
+                liquidity_sell_token = reserves.get(slot_sell, self._raw_reserve(slot_sell))
+                liquidity_buy_token = reserves.get(slot_buy, self._raw_reserve(slot_buy))
+                bought = edge_data['price_function'](current_value, liquidity_sell_token, liquidity_buy_token, what_='buy', exact=True)
+                reserves[slot_sell] = liquidity_sell_token + current_value
+                reserves[slot_buy] = liquidity_buy_token - bought
+                received[edge_data['buy_token']] = received.get(edge_data['buy_token'], 0) + bought
+                if record:
+                    trade = self.trades.setdefault(edge_data['venue'], {'ex_buy_amount': 0, 'ex_sell_amount': 0})
+                    trade['ex_buy_amount'] += current_value
+                    trade['ex_sell_amount'] += bought
+                    trade['sell_token'] = edge_data['buy_token']
+                    trade['buy_token'] = edge_data['sell_token']
+        if record:
+            self.reserve_overlay.update(reserves)
+        return received
+
+    def _raw_reserve(self, slot):
+        """
+        Returns the exact reserve of a slot, from the overlay if the agent traded on it.
+        """
+        if slot in self.reserve_overlay:
+            return self.reserve_overlay[slot]
+        return self.market.raw_reserve(slot)
 
-        This method collects the data from the venues and orders, formats it into a JSON-like
-        structure, and then either prints it to the console or writes it to a specified file.
+    def _reserves(self):
+        """
+        Returns the liquidity of each reserve slot of the market, with the trades of the overlay.
+        """
+        reserves = self.market.reserves
+        if self.reserve_overlay:
+            reserves = reserves.copy()
+            for slot, amount in self.reserve_overlay.items():
+                reserves[slot] = to_float(amount)
+        return reserves
+
+    def _raw_allocation(self, coins_sell):
+        """
+        Converts the amounts sold along each path to exact amounts. The rounding error is moved
+        to the largest amount, so that the total never exceeds the limit sell amount and
+        equals it for fill-or-kill orders.
+        """
+        raw_coins_sell = [to_raw(max(0.0, float(value))) for value in coins_sell]
+        total = sum(raw_coins_sell)
+        limit = self.order.raw_limit_sell_amount
+        if total > 0 and (total > limit or not self.order.partial_fill):
+            raw_coins_sell[int(np.argmax(raw_coins_sell))] += limit - total
+        return raw_coins_sell
+
+    def commit(self, Market=None):
+        """
+        Applies the trades recorded in the reserve overlay to the reserves of the market,
+        and empties the overlay.
+
+        Note:
+            - The trades are applied as changes of the reserves with respect to the market read
+              by the agent. They are only valid for the reserves the order was solved against:
+              agents that solved against the same snapshot must not all commit, since each of them
+              may take the same liquidity. Solve and commit the orders one after the other against
+              the market instead, or solve again the orders whose venues were changed by a commit.
+
+        Raises:
+        -------
+        ValueError
+            If a trade would leave a negative reserve in the market, which is not changed.
 
         Parameters:
         -----------
-        file : str, optional
-            The file path where the output should be written. If None, the output is printed to the console.
+        Market : market, optional
+            The market to update. Default is the market read by the agent, or the market
+            the snapshot read by the agent was taken from.
+
+        Returns:
+        --------
+        set
+            The names of the venues whose reserves changed.
+        """
+        if Market is None:
+            Market = getattr(self.market, 'source', self.market)
+        with instruments.span('commit', order=self.order.order_number):
+            updates = []
+            for slot, amount in self.reserve_overlay.items():
+                venue_id = np.searchsorted(self.market.reserve_indptr, slot, side='right') - 1
+                venue_name = self.market.venue_names[venue_id]
+                token = self.market.tokens[self.market.reserve_tokens[slot]]
+                new_amount = Market.raw_reserve(Market.reserve_slot(venue_name, token)) + amount - self.market.raw_reserve(slot)
+                if new_amount < 0:
+                    raise ValueError(f"Committing order {self.order.order_number} would leave a negative {token} reserve in "
+                                     f"{venue_name}: the reserves changed since it was solved.")
+                updates.append((venue_name, token, new_amount))
+            self.reserve_overlay = {}
+            return Market.apply_reserve_updates(updates, raw=True)
+
+    def results(self):
+        """
+        Returns the result of the surplus maximization, with the venues on the paths of the order.
 
+        Returns:
+        --------
+        dict
+            The 'venues' section, with the amounts exchanged in each venue on the paths of the order,
+            zero for the venues not traded, and the 'orders' section, with the limits and the executed
+            amounts of the order.
         """
+        # Direction of the venues on the paths, for the venues without trades
+        untraded = {}
+        for path in self.token_paths:
+            for sell_token, buy_token in zip(path[:-1], path[1:]):
+                for venue_name, _, _ in self.market.pools_between(sell_token, buy_token):
+                    untraded.setdefault(venue_name, {'sell_token': buy_token, 'buy_token': sell_token,
+                                                     'ex_buy_amount': 0, 'ex_sell_amount': 0})
+
         venues_data = {}
         for venue in self.venues:
+            trade = self.trades.get(venue.name) or untraded.get(venue.name)
+            if trade is None:
+                continue
             venues_data[venue.name] = {
-                "sell_token": venue.reserves['sell_token'],
-                "buy_token": venue.reserves['buy_token'],
-                "ex_buy_amount":  f"{venue.reserves['ex_buy_amount']:.18f}".replace(".","_"),
-                "ex_sell_amount": f"{venue.reserves['ex_sell_amount']:.18f}".replace(".","_"),
+                "sell_token": trade['sell_token'],
+                "buy_token": trade['buy_token'],
+                "ex_buy_amount":  format_amount(trade['ex_buy_amount']),
+                "ex_sell_amount": format_amount(trade['ex_sell_amount']),
             }
 
         order_data = {
             self.order.order_number: {
                 "partial_fill": self.order.partial_fill,
-                "buy_amount": f"{self.order.limit_buy_amount:.18f}".replace(".","_"),
-                "sell_amount": f"{self.order.limit_sell_amount:.18f}".replace(".", "_"),
+                "buy_amount": format_amount(self.order.raw_limit_buy_amount),
+                "sell_amount": format_amount(self.order.raw_limit_sell_amount),
                 "buy_token": self.order.buy_token,
                 "sell_token": self.order.sell_token,
-                "ex_buy_amount":  f"{self.order.ex_buy_amount:.18f}".replace(".","_"),
-                "ex_sell_amount": f"{self.order.ex_sell_amount:.18f}".replace(".","_")
+                "ex_buy_amount":  format_amount(self.order.raw_ex_buy_amount),
+                "ex_sell_amount": format_amount(self.order.raw_ex_sell_amount)
             }
         }
 
-        output_data = {
+        return {
             "venues": venues_data,
             "orders": order_data
         }
 
+    def print_results(self, file=None):
+        """
+        Prints the result of the surplus maximization
+
+        This method collects the data from the venues and orders (agent.results()), formats it into a JSON-like
+        structure, and then either prints it to the console or writes it to a specified file.
+
+        Parameters:
+        -----------
+        file : str, optional
+            The file path where the output should be written. If None, the output is printed to the console.
+
+        """
+        output_data = self.results()
+
         output = json.dumps(output_data, indent=4)
       
         if file:
@@ -537,5 +1317,3 @@ class agent:
                
 
               
-
-
@@ -0,0 +1,136 @@
+import numpy as np
+
+# Token amounts are fixed point numbers with 18 decimals, stored as integers of 10^-18 units
+DECIMALS = 18
+SCALE = 10**DECIMALS
+
+def parse_amount(text):
+    """
+    Parses an amount in the underscore format of the JSON files, e.g. "2394046_000000000000000000",
+    into an exact integer number of 10^-18 units. Digits beyond the 18th decimal are truncated.
+
+    Parameters:
+    -----------
+    text : str, int or float
+        The amount, with '_' or '.' as decimal separator. Numbers are converted with to_raw().
+
+    Returns:
+    --------
+    int
+        The amount in 10^-18 units.
+    """
+    if not isinstance(text, str):
+        return to_raw(text)
+    if (len(text) > DECIMALS + 1 and text[-DECIMALS - 1] == '_' and text[-DECIMALS:].isdigit() and
+            text[:-DECIMALS - 1].lstrip('+-').isdigit()):
+        # Canonical format, a single '_' before exactly 18 decimals, which int() reads as a digit separator
+        try:
+            return int(text)
+        except ValueError:
+            pass
+    text = text.strip()
+    sign = -1 if text.startswith('-') else 1
+    whole, _, fraction = text.lstrip('+-').replace('.', '_').partition('_')
+    fraction = fraction.replace('_', '')
+    return sign * (int(whole or '0') * SCALE + int((fraction + '0' * DECIMALS)[:DECIMALS]))
+
+def parse_amounts(texts):
+    """
+    Parses many amounts in the underscore format at once, see parse_amount().
+
+    Note:
+        - Amounts in the canonical format, digits and a single '_' followed by exactly 18 decimals,
+          are read directly by int(), which accepts '_' as digit separator. This is several times
+          faster than splitting the whole and fractional parts with NumPy string operations, which loop in Python
+          over the elements anyway.
+
+    Parameters:
+    -----------
+    texts : list
+        The amounts, as strings or numbers. Numbers are converted with to_raw().
+
+    Returns:
+    --------
+    np.ndarray
+        The amounts in 10^-18 units, an array of Python integers (dtype=object).
+    """
+    texts = list(texts)
+    raw = np.empty(len(texts), dtype=object)
+    raw[:] = [parse_amount(text) for text in texts]
+    return raw
+
+def format_amount(raw):
+    """
+    Formats an amount in 10^-18 units in the underscore format, e.g. "2394046_000000000000000000".
+
+    Parameters:
+    -----------
+    raw : int
+        The amount in 10^-18 units.
+
+    Returns:
+    --------
+    str
+        The amount with exactly 18 decimals.
+    """
+    raw = int(raw)
+    sign = '-' if raw < 0 else ''
+    whole, fraction = divmod(abs(raw), SCALE)
+    return f"{sign}{whole}_{fraction:0{DECIMALS}d}"
+
+def format_amounts(raws):
+    """
+    Formats many amounts in 10^-18 units at once, see format_amount().
+
+    Parameters:
+    -----------
+    raws : array_like
+        The non negative amounts in 10^-18 units.
+
+    Returns:
+    --------
+    np.ndarray
+        The formatted amounts.
+    """
+    raws = np.asarray(raws, dtype=object)
+    whole = (raws // SCALE).astype(str)
+    fraction = np.char.zfill((raws % SCALE).astype(str), DECIMALS)
+    return np.char.add(np.char.add(whole, '_'), fraction)
+
+def to_raw(value):
+    """
+    Converts an amount in tokens to 10^-18 units.
+
+    Parameters:
+    -----------
+    value : int, float or str
+        The amount in tokens. Strings are parsed with parse_amount().
+
+    Returns:
+    --------
+    int
+        The amount in 10^-18 units, rounded to the nearest unit for floats.
+    """
+    if isinstance(value, str):
+        return parse_amount(value)
+    if isinstance(value, (int, np.integer)):
+        return int(value) * SCALE
+    return int(round(float(value) * SCALE))
+
+def to_float(raw):
+    """
+    Converts an amount in 10^-18 units to a float number of tokens, correctly rounded.
+
+    Parameters:
+    -----------
+    raw : int or array_like
+        The amount, or the amounts, in 10^-18 units.
+
+    Returns:
+    --------
+    float or np.ndarray
+        The amount in tokens.
+    """
+    if isinstance(raw, np.ndarray):
+        return (raw.astype(object) / SCALE).astype(np.float64)
+    return np.float64(int(raw) / SCALE)
@@ -0,0 +1,382 @@
+import numpy as np
+from scipy.optimize import minimize_scalar
+from .amount import to_raw, to_float, format_amount
+
+class arbitrage_scanner:
+    """
+    A class to find the profitable cycles (A -> ... -> A) of a market.
+
+    Each adjacency entry of the market, i.e. a venue swapping a token for a neighbour token,
+    is weighted with minus the logarithm of its marginal rate at zero size, [B]/[A] for a fee-less
+    constant product venue, or given by the curve of the venue (see curves.py). A cycle
+    whose marginal rates multiply to more than one is a negative cycle of these weights, and is
+    detected with a vectorized Bellman-Ford over the CSR adjacency. Each cycle of constant product
+    venues is then collapsed into its virtual constant product pool (R_in, R_out) (market.virtual_pool())
+    and sized optimally: the profit b(a) - a = R_out a/(R_in + a) - a is maximal for a* = sqrt(R_in R_out) - R_in.
+    The cycles visiting other curves are sized numerically, the profit being concave. The exact outcome of
+    the trade is computed hop by hop with the curves of the venues (market.curve_pair(), exact=True).
+
+    The scan is incremental: after reserve updates only the cycles touching the changed venues
+    are sized again, and new cycles are searched in the neighbourhood of the changed venues
+    only, since every token of a cycle of length L through a venue is at most L // 2 hops away
+    from the tokens of the venue.
+
+    Note:
+        - Only cycles visiting at most max_cycle_length venues, each at most once, are reported.
+        - Bellman-Ford detects negative cycles, it does not enumerate them: the cycles through
+          the entries of the cycles it detects are enumerated, so a full scan and an incremental
+          scan find the same cycles, up to max_cycles.
+        - The profit of a cycle is in units of its first token.
+
+    Attributes:
+    -----------
+    market : market
+        The market to scan.
+    max_cycle_length : int
+        The maximum number of venues visited by a cycle.
+    min_profit : float
+        The minimum profit of a reported cycle, in tokens.
+    max_cycles : int
+        The maximum number of cycles detected by one scan.
+    cycles : dict
+        The profitable cycles found so far, keyed by their adjacency entries.
+    version : tuple
+        The (topology_version, reserve_version) of the market at the last scan.
+
+    Methods:
+    --------
+    scan(changed_venues=None):
+        Finds the profitable cycles, incrementally if the changed venues are given.
+    opportunities():
+        Returns the profitable cycles, the most profitable first.
+    print_cycles():
+        Prints the profitable cycles.
+    """
+
+    # Minimum decrease of the log weights considered an improvement
+    tolerance = 1e-12
+
+    def __init__(self, Market, max_cycle_length=4, min_profit=0.0, max_cycles=1000):
+        """
+        Constructs all the necessary attributes for the arbitrage_scanner object.
+
+        Parameters:
+        -----------
+        Market : market
+            The market to scan.
+        max_cycle_length : int, optional
+            The maximum number of venues visited by a cycle. Default is 4.
+        min_profit : float, optional
+            The minimum profit of a reported cycle, in tokens. Default is 0.
+        max_cycles : int, optional
+            The maximum number of cycles detected by one scan. Default is 1000.
+        """
+        self.market = Market
+        self.max_cycle_length = max_cycle_length
+        self.min_profit = min_profit
+        self.max_cycles = max_cycles
+        self.cycles = {}
+        self.version = None
+        self._curved = []
+        self._curved_version = None
+
+    def scan(self, changed_venues=None):
+        """
+        Finds the profitable cycles of the market.
+
+        This method performs the following steps:
+        1. Computes the log weights of all the adjacency entries from the current reserves.
+        2. If changed_venues is None, or venues were added or removed since the last scan,
+           searches the negative cycles of the whole market.
+        3. Otherwise sizes again the known cycles visiting a changed venue, dropping those no
+           longer profitable, and searches the negative cycles among the tokens at most
+           max_cycle_length // 2 hops away from the tokens of the changed venues.
+        4. Sizes each new cycle optimally and keeps it if its exact profit exceeds min_profit.
+
+        Parameters:
+        -----------
+        changed_venues : set, optional
+            The names of the venues whose reserves changed since the last scan, e.g. as returned
+            by market.apply_reserve_updates(). Default is None, a full scan.
+
+        Returns:
+        --------
+        list
+            The profitable cycles, the most profitable first (see opportunities()).
+        """
+        Market = self.market
+        n_entries = len(Market.adjacency_tokens)
+        self._sources = np.repeat(np.arange(len(Market.tokens), dtype=np.int32), np.diff(Market.adjacency_indptr))
+        weights = (np.log(Market.reserves[Market.adjacency_slot_sell]) -
+                   np.log(Market.reserves[Market.adjacency_slot_buy])) if n_entries else np.zeros(0)
+        # Entries of the venues with fees or other curves
+        for entry, price_function in self._curved_entries():
+            weights[entry] = -np.log(price_function.marginal_rate(Market.reserves[Market.adjacency_slot_sell[entry]],
+                                                                  Market.reserves[Market.adjacency_slot_buy[entry]]))
+
+        if changed_venues is None or self.version is None or self.version[0] != Market.topology_version:
+            self.cycles = {}
+            entries = np.arange(n_entries)
+        else:
+            changed_ids = {Market.venue_index[venue_name] for venue_name in changed_venues if venue_name in Market.venue_index}
+            for key, cycle in list(self.cycles.items()):
+                if not cycle['venue_ids'].isdisjoint(changed_ids):
+                    sized = self._size(key)
+                    if sized is None:
+                        del self.cycles[key]
+                    else:
+                        self.cycles[key] = sized
+            neighbourhood = np.zeros(len(Market.tokens), dtype=bool)
+            neighbourhood[self._neighbourhood(changed_ids, self.max_cycle_length // 2)] = True
+            entries = np.nonzero(neighbourhood[self._sources] & neighbourhood[Market.adjacency_tokens])[0]
+
+        for cycle in self._find_cycles(weights, entries):
+            key = self._canonical(cycle)
+            if len(key) > self.max_cycle_length or weights[list(key)].sum() >= -self.tolerance:
+                continue
+            venue_ids = [int(Market.adjacency_venues[entry]) for entry in key]
+            if len(set(venue_ids)) < len(venue_ids):
+                continue
+            sized = self._size(key)
+            if sized is not None:
+                self.cycles[key] = sized
+
+        self.version = (Market.topology_version, Market.reserve_version)
+        return self.opportunities()
+
+    def _price_function(self, entry):
+        """
+        Returns the curve of the venue of an adjacency entry, in the direction of the entry.
+        """
+        Market = self.market
+        return Market.curve_pair(Market.venue_names[Market.adjacency_venues[entry]],
+                                 Market.tokens[self._sources[entry]], Market.tokens[Market.adjacency_tokens[entry]])
+
+    def _curved_entries(self):
+        """
+        Returns the (entry, curve) of the adjacency entries whose venue is not a fee-less constant product
+        venue, computed once per topology of the market.
+        """
+        Market = self.market
+        if self._curved_version != Market.topology_version:
+            curved_venues = [venue_id for venue_id, Curve in enumerate(Market.venue_curves)
+                             if Curve.name != 'constant_product' or Curve.fee != 0.0]
+            entries = np.nonzero(np.isin(Market.adjacency_venues, curved_venues))[0]
+            self._curved = [(int(entry), self._price_function(entry)) for entry in entries]
+            self._curved_version = Market.topology_version
+        return self._curved
+
+    def _neighbourhood(self, venue_ids, radius):
+        """
+        Returns the ids of the tokens at most radius hops away from the tokens of some venues.
+        """
+        Market = self.market
+        visited = {int(Market.reserve_tokens[slot]) for venue_id in venue_ids
+                   for slot in range(Market.reserve_indptr[venue_id], Market.reserve_indptr[venue_id + 1])}
+        frontier = list(visited)
+        for _ in range(radius):
+            frontier = [neighbour for token in frontier for neighbour in Market._neighbours(token) if neighbour not in visited]
+            visited.update(frontier)
+        return list(visited)
+
+    def _find_cycles(self, weights, entries):
+        """
+        Returns the negative cycles of at most max_cycle_length entries among some adjacency entries,
+        as lists of entries. Each Bellman-Ford run detects some negative cycles: all the cycles through
+        their entries are enumerated (_cycles_through()), then the cycles through the entries of the
+        cycles enumerated, until no entry is new. These entries are removed and the search is repeated,
+        until no negative cycle is left or max_cycles cycles are found. A negative cycle either remains
+        among the entries left, or goes through a removed entry and was enumerated, so every negative
+        cycle is found, whichever cycles Bellman-Ford detects first.
+        """
+        cycles = {}
+        remaining = entries
+        searched = np.zeros(len(weights), dtype=bool)
+        while len(remaining) and len(cycles) < self.max_cycles:
+            found = self._bellman_ford(weights, remaining)
+            if not found:
+                break
+            through = np.unique([entry for cycle in found for entry in cycle])
+            while len(through):
+                searched[through] = True
+                enumerated = self._cycles_through(weights, entries, through)
+                for cycle in enumerated:
+                    cycles.setdefault(self._canonical(cycle), cycle)
+                through = np.unique([entry for cycle in enumerated for entry in cycle]).astype(int)
+                through = through[~searched[through]]
+            remaining = remaining[~searched[remaining]]
+        return list(cycles.values())[:self.max_cycles]
+
+    def _cycles_through(self, weights, entries, through):
+        """
+        Enumerates the negative cycles of at most max_cycle_length entries among some adjacency
+        entries going through one of the entries of through, each visiting a token at most once.
+        The cycles through an entry u -> v are the paths back from v to u, explored depth first: a
+        path is extended only if its weight, plus the lightest walk back to u with the hops left,
+        is negative. The lightest walks to u are computed once per token u, hop by hop over all the
+        entries, as a backward Bellman-Ford bounded by max_cycle_length.
+        """
+        Market = self.market
+        n_tokens = len(Market.tokens)
+        entries = entries[np.argsort(self._sources[entries], kind='stable')]
+        sources = self._sources[entries]
+        targets = Market.adjacency_tokens[entries]
+        entry_weights = weights[entries]
+        indptr = np.searchsorted(sources, np.arange(n_tokens + 1))
+        cycles = []
+        for start in np.unique(self._sources[through]).tolist():
+            # lightest[k][t]: the lightest walk of at most k entries from t to start
+            lightest = [np.full(n_tokens, np.inf)]
+            lightest[0][start] = 0.0
+            for _ in range(self.max_cycle_length - 1):
+                previous = lightest[-1]
+                current = previous.copy()
+                np.minimum.at(current, sources, entry_weights + previous[targets])
+                lightest.append(current)
+
+            for first in through[self._sources[through] == start].tolist():
+                stack = [([first], [start, int(Market.adjacency_tokens[first])], float(weights[first]))]
+                while stack:
+                    path, tokens, weight = stack.pop()
+                    token = tokens[-1]
+                    hops_left = self.max_cycle_length - len(path)
+                    for index in range(indptr[token], indptr[token + 1]):
+                        target = int(targets[index])
+                        total = weight + entry_weights[index]
+                        if target == start:
+                            if total < -self.tolerance:
+                                cycles.append(path + [int(entries[index])])
+                        elif hops_left > 1 and target not in tokens and total + lightest[hops_left - 1][target] < -self.tolerance:
+                            stack.append((path + [int(entries[index])], tokens + [target], total))
+        return cycles
+
+    def _bellman_ford(self, weights, entries):
+        """
+        Vectorized Bellman-Ford from a virtual source linked to every token with weight 0.
+        At each iteration every token takes the best improving entry as predecessor, and the
+        predecessor chains of the improved tokens are checked for cycles, which are negative.
+        Returns the cycles found at the first iteration where there are some, or an empty list
+        if the distances converge.
+        """
+        sources = self._sources[entries]
+        targets = self.market.adjacency_tokens[entries]
+        entry_weights = weights[entries]
+        distance = np.zeros(len(self.market.tokens))
+        predecessor = np.full(len(self.market.tokens), -1)
+        for _ in range(len(self.market.tokens)):
+            candidate = distance[sources] + entry_weights
+            improving = np.nonzero(candidate < distance[targets] - self.tolerance)[0]
+            if len(improving) == 0:
+                return []
+            # Best improving entry of each target token
+            order = improving[np.lexsort((candidate[improving], targets[improving]))]
+            best = order[np.r_[True, targets[order][1:] != targets[order][:-1]]]
+            distance[targets[best]] = candidate[best]
+            predecessor[targets[best]] = entries[best]
+            cycles = self._predecessor_cycles(predecessor, targets[best])
+            if cycles:
+                return cycles
+        return []
+
+    def _predecessor_cycles(self, predecessor, starts):
+        """
+        Returns the cycles of the predecessor graph reached from some tokens, each as the list
+        of its adjacency entries in the direction of the trades.
+        """
+        walked = {}
+        cycles = []
+        for start in starts.tolist():
+            token = start
+            walk = []
+            while token != -1 and token not in walked:
+                walked[token] = start
+                walk.append(token)
+                entry = predecessor[token]
+                token = int(self._sources[entry]) if entry != -1 else -1
+            if token != -1 and walked[token] == start:
+                cycle_tokens = walk[walk.index(token):]
+                cycles.append([int(predecessor[token]) for token in reversed(cycle_tokens)])
+        return cycles
+
+    def _canonical(self, cycle):
+        """
+        Returns the rotation of a cycle starting from its token with the smallest id, as a tuple.
+        """
+        first = int(np.argmin(self._sources[cycle]))
+        return tuple(cycle[first:] + cycle[:first])
+
+    def _size(self, key):
+        """
+        Sizes a cycle optimally, returning its description, or None if its exact profit does
+        not exceed min_profit.
+        """
+        Market = self.market
+        slots_sell = Market.adjacency_slot_sell[list(key)]
+        slots_buy = Market.adjacency_slot_buy[list(key)]
+        price_functions = [self._price_function(entry) for entry in key]
+        reserve_factors = [price_function.reserve_factor for price_function in price_functions]
+        if None in reserve_factors:
+            # Concave profit of the hops, maximized numerically up to the sell liquidity of the first venue
+            def loss(amount):
+                for price_function, slot_sell, slot_buy in zip(price_functions, slots_sell, slots_buy):
+                    amount = price_function(amount, Market.reserves[slot_sell], Market.reserves[slot_buy])
+                return -amount
+            rate = float(np.prod([price_function.marginal_rate(Market.reserves[slot_sell], Market.reserves[slot_buy])
+                                  for price_function, slot_sell, slot_buy in zip(price_functions, slots_sell, slots_buy)]))
+            if rate <= 1.0:
+                return None
+            optimum = minimize_scalar(lambda amount: loss(amount) + amount, bounds=(0.0, Market.reserves[slots_sell[0]]),
+                                      method='bounded')
+            amount_in = to_raw(optimum.x)
+        else:
+            reserve_in, reserve_out = Market.virtual_pool(Market.reserves[slots_sell] * np.array(reserve_factors),
+                                                          Market.reserves[slots_buy])
+            if reserve_out <= reserve_in:
+                return None
+            rate = float(reserve_out / reserve_in)
+            amount_in = to_raw(np.sqrt(reserve_in * reserve_out) - reserve_in)
+
+        # Exact outcome, hop by hop
+        amount = amount_in
+        for price_function, slot_sell, slot_buy in zip(price_functions, slots_sell, slots_buy):
+            amount = price_function(amount, Market.raw_reserve(slot_sell), Market.raw_reserve(slot_buy),
+                                    what_='buy', exact=True)
+        profit = amount - amount_in
+        if profit <= 0 or to_float(profit) < self.min_profit:
+            return None
+
+        tokens = [Market.tokens[self._sources[entry]] for entry in key]
+        return {
+            'tokens': tokens + [tokens[0]],
+            'venues': [Market.venue_names[Market.adjacency_venues[entry]] for entry in key],
+            'venue_ids': {int(Market.adjacency_venues[entry]) for entry in key},
+            'rate': rate,
+            'amount_in': amount_in,
+            'amount_out': amount,
+            'profit': profit
+        }
+
+    def opportunities(self):
+        """
+        Returns the profitable cycles, the most profitable first.
+
+        Returns:
+        --------
+        list
+            One dictionary per cycle, with the 'tokens' visited (the first token repeated at
+            the end), the 'venues', the marginal 'rate' of the cycle at zero size, and the exact
+            optimal 'amount_in', 'amount_out' and 'profit' in 10^-18 units of the first token.
+        """
+        return sorted(self.cycles.values(), key=lambda cycle: to_float(cycle['profit']), reverse=True)
+
+    def print_cycles(self):
+        """
+        Prints the profitable cycles, the most profitable first.
+        """
+        cycles = self.opportunities()
+        if not cycles:
+            print("No profitable cycles found.")
+        for cycle in cycles:
+            print(" -> ".join(cycle['tokens']) + " via " + ", ".join(cycle['venues']))
+            print(f"  rate: {cycle['rate']:.9f}  sell: {format_amount(cycle['amount_in'])} {cycle['tokens'][0]}"
+                  f"  profit: {format_amount(cycle['profit'])} {cycle['tokens'][0]}")
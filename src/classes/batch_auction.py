@@ -0,0 +1,336 @@
+import numpy as np
+import json
+from fractions import Fraction
+from .order import order
+from .venue import venue
+from .market import market
+from .agent import agent
+from .amount import format_amount
+
+class batch_auction:
+    """
+    A class to represent a batch auction, solving several orders jointly against the
+    shared reserves of the venues.
+
+    Opposing orders on the same token pair (A -> B and B -> A) are first netted against
+    each other at a uniform clearing price (coincidence of wants), without touching any
+    venue. Only the residual amounts are then routed through the venues. The residuals of
+    the orders with the same direction are aggregated into one order, solved with a single
+    optimization, and the fill is split pro rata. The fills are exact integers of 10^-18
+    units: the matched amounts and the exact amounts exchanged in the venues are split
+    with integer divisions, the last order of a split receiving the rounding remainder. Different token pairs are solved one
+    after the other against the reserves left by the previous ones, so each of them sees
+    the price impact of the others.
+
+    Note:
+        - Fill-or-kill orders that cannot be completely filled are excluded, one at a time,
+          and the batch is solved again without them.
+
+    Attributes:
+    -----------
+    orders : list
+        A list containing order instances.
+    venues : list
+        A list containing venue instances, with the reserves before the batch.
+    fills : dict
+        The exact amounts, in 10^-18 units, sold and bought by each order via coincidence of
+        wants ('cow_sell', 'cow_buy') and via the venues ('amm_sell', 'amm_buy'), keyed by order_number.
+    venue_trades : dict
+        The amounts exchanged in each venue, keyed by (venue, sell_token, buy_token) where
+        sell_token is the token sold by the venue.
+    excluded : list
+        The order numbers of the fill-or-kill orders that could not be filled.
+    settled_venues : list
+        A list containing venue instances, with the reserves after the batch.
+
+    Methods:
+    --------
+    solve(verbose=False):
+        Solves the batch.
+    results():
+        Returns the result of the batch in the format of agent.print_results().
+    print_results(file=None):
+        Prints the result of the batch, either to the console or to a specified file.
+    """
+
+    # Relative tolerance on the filled amounts
+    tolerance = 1e-9
+
+    def __init__(self, orders, venues=None):
+        """
+        Constructs all the necessary attributes for the batch_auction object.
+
+        Parameters:
+        -----------
+        orders : list
+            A list containing order instances.
+        venues : list, optional
+            A list containing venue instances. Without venues only coincidences of wants are matched.
+        """
+        self.orders = orders
+        self.venues = venues if venues is not None else []
+        self.fills = None
+        self.venue_trades = None
+        self.excluded = None
+        self.settled_venues = None
+
+    def solve(self, verbose=False):
+        """
+        Solves the batch.
+
+        This method performs the following steps:
+        1. Nets opposing orders against each other (coincidence of wants).
+        2. Routes the residual amounts through the venues, one aggregated order per direction.
+        3. If a fill-or-kill order is not completely filled, excludes the one with the largest
+           unfilled fraction and solves the batch again.
+
+        Parameters:
+        -----------
+        verbose : bool, optional
+            Prints additional information. Default is False.
+        """
+        excluded = []
+        while True:
+            active = [Order for Order in self.orders if Order.order_number not in excluded]
+            fills = {Order.order_number: {'cow_sell': 0, 'cow_buy': 0, 'amm_sell': 0, 'amm_buy': 0}
+                     for Order in self.orders}
+            trades = {}
+            Market = market(self._copy_venues(self.venues)) if self.venues else None
+
+            self._match_coincidences(active, Market, fills, verbose)
+            self._route_residuals(active, Market, fills, trades, verbose)
+
+            unfilled = []
+            for Order in active:
+                sold = fills[Order.order_number]['cow_sell'] + fills[Order.order_number]['amm_sell']
+                if not Order.partial_fill and sold < Order.raw_limit_sell_amount * (1 - self.tolerance):
+                    unfilled.append((1 - sold / Order.raw_limit_sell_amount, Order.order_number))
+            if not unfilled:
+                break
+            worst = max(unfilled)[1]
+            if verbose:
+                print(f"Order {worst} cannot be filled, solving the batch without it.")
+            excluded.append(worst)
+
+        self.fills = fills
+        self.venue_trades = trades
+        self.excluded = excluded
+        self.settled_venues = self._copy_venues(Market.venues) if Market else []
+
+    def _match_coincidences(self, active, Market, fills, verbose):
+        """
+        Nets opposing orders on the same token pair at a uniform clearing price.
+        The clearing price is the mid of the marginal prices of the best routes in the two
+        directions, if the venues connect the tokens, otherwise the price clearing both sides
+        completely. It is clipped to the range allowed by the limit prices of the matched orders.
+        The prices are exact fractions and the matched amounts are rounded down to 10^-18 units.
+        """
+        pairs = {}
+        for Order in active:
+            pair = tuple(sorted((Order.sell_token, Order.buy_token)))
+            side = 0 if Order.sell_token == pair[0] else 1
+            pairs.setdefault(pair, ([], []))[side].append(Order)
+
+        for (token_x, token_y), (x_side, y_side) in pairs.items():
+            x_side = list(x_side)
+            y_side = list(y_side)
+            reference = self._reference_price(token_x, token_y, Market)
+
+            # Drop the most demanding orders until the limit prices of the two sides overlap
+            while x_side and y_side:
+                sell_x = sum(Order.raw_limit_sell_amount for Order in x_side)
+                sell_y = sum(Order.raw_limit_sell_amount for Order in y_side)
+                # Price in token_y per token_x: x orders need at least lo, y orders at most hi
+                lo = max(self._limit_price(Order) for Order in x_side)
+                hi = min(1 / self._limit_price(Order) for Order in y_side)
+                if lo <= hi:
+                    break
+                if sell_x * lo > sell_y:
+                    x_side.remove(max(x_side, key=self._limit_price))
+                else:
+                    y_side.remove(max(y_side, key=self._limit_price))
+            if not x_side or not y_side:
+                continue
+
+            price = Fraction(reference) if reference is not None else Fraction(sell_y, sell_x)
+            price = min(max(price, lo), hi)
+            matched_x = min(sell_x, int(sell_y / price))
+            matched_y = int(matched_x * price)
+
+            x_weights = [Order.raw_limit_sell_amount for Order in x_side]
+            y_weights = [Order.raw_limit_sell_amount for Order in y_side]
+            for Order, cow_sell, cow_buy in zip(x_side, self._pro_rata(matched_x, x_weights), self._pro_rata(matched_y, x_weights)):
+                fills[Order.order_number]['cow_sell'] = cow_sell
+                fills[Order.order_number]['cow_buy'] = cow_buy
+            for Order, cow_sell, cow_buy in zip(y_side, self._pro_rata(matched_y, y_weights), self._pro_rata(matched_x, y_weights)):
+                fills[Order.order_number]['cow_sell'] = cow_sell
+                fills[Order.order_number]['cow_buy'] = cow_buy
+
+            if verbose:
+                print(f"Coincidence of wants {token_x} <-> {token_y}: {format_amount(matched_x)} {token_x} "
+                      f"for {format_amount(matched_y)} {token_y}")
+
+    @staticmethod
+    def _limit_price(Order):
+        """
+        Returns the exact limit price of an order, in buy tokens per sell token.
+        """
+        return Fraction(Order.raw_limit_buy_amount, Order.raw_limit_sell_amount)
+
+    @staticmethod
+    def _pro_rata(amount, weights):
+        """
+        Splits an exact amount in proportion to the weights, rounding down, the last share
+        receiving the rounding remainder so that the shares add up to the amount.
+        """
+        total = sum(weights)
+        shares = [amount * weight // total for weight in weights[:-1]]
+        return shares + [amount - sum(shares)]
+
+    @staticmethod
+    def _reference_price(token_x, token_y, Market):
+        """
+        Returns the price of token_x in token_y, as the geometric mid of the marginal prices
+        at zero size of the best routes token_x -> token_y and token_y -> token_x, or None
+        if the tokens are not connected by the venues.
+        """
+        if Market is None or not Market.find_paths(token_x, token_y):
+            return None
+        best_rates = []
+        for sell_token, buy_token in ((token_x, token_y), (token_y, token_x)):
+            Agent = agent()
+            Agent.read_order(order(sell_token=sell_token, buy_token=buy_token))
+            Agent.read_market(Market, verbose=False)
+            best_rates.append(float(np.max(Agent.engine.reserve_out / Agent.engine.reserve_in)))
+        return np.sqrt(best_rates[0] / best_rates[1])
+
+    def _route_residuals(self, active, Market, fills, trades, verbose):
+        """
+        Routes the residual amounts through the venues. The residuals with the same direction
+        are aggregated into one order and solved with one optimization. Members whose limit
+        price is not met by the average price of the fill are removed and the group is solved again.
+        The same market is used by all the groups, the trades of an accepted fill being committed
+        to its reserves, while a rejected fill is simply discarded with its agent.
+        """
+        groups = {}
+        for Order in active:
+            if Order.raw_limit_sell_amount - fills[Order.order_number]['cow_sell'] > Order.raw_limit_sell_amount * self.tolerance:
+                groups.setdefault((Order.sell_token, Order.buy_token, Order.partial_fill), []).append(Order)
+
+        for (sell_token, buy_token, partial_fill), members in groups.items():
+            while members:
+                remaining = [Order.raw_limit_sell_amount - fills[Order.order_number]['cow_sell'] for Order in members]
+                missing = [max(0, Order.raw_limit_buy_amount - fills[Order.order_number]['cow_buy']) for Order in members]
+                total_sell = sum(remaining)
+
+                Aggregated = order(order_number=f"{sell_token}->{buy_token}", sell_token=sell_token,
+                                   buy_token=buy_token, partial_fill=partial_fill)
+                Aggregated.raw_limit_sell_amount = total_sell
+                # A positive limit buy amount keeps the exchange rate of the agent finite
+                Aggregated.raw_limit_buy_amount = max(sum(missing), int(total_sell * self.tolerance), 1)
+
+                if Market is None or not Market.find_paths(sell_token, buy_token):
+                    break
+                Agent = agent()
+                Agent.read_order(Aggregated)
+                Agent.read_market(Market, verbose=verbose)
+                Agent.optimize_strategy(verbose=verbose)
+                if int(Agent.result.status) != 0:
+                    break
+
+                # Split the exact fill pro rata and check the limit of each member
+                member_sold = self._pro_rata(Agent.order.raw_ex_sell_amount, remaining)
+                member_bought = self._pro_rata(Agent.order.raw_ex_buy_amount, remaining)
+                violating = [Order for i, Order in enumerate(members)
+                             if member_bought[i] < missing[i] * (1 - self.tolerance)]
+                if violating:
+                    members = [Order for Order in members if Order not in violating]
+                    continue
+
+                for i, Order in enumerate(members):
+                    fills[Order.order_number]['amm_sell'] = member_sold[i]
+                    fills[Order.order_number]['amm_buy'] = member_bought[i]
+                Agent.commit()
+                self._record_trades(Agent, trades)
+                break
+
+    @staticmethod
+    def _record_trades(Agent, trades):
+        """
+        Accumulates the exact amounts exchanged in each venue visited by the agent.
+        """
+        for venue_name, trade in Agent.trades.items():
+            key = (venue_name, trade['sell_token'], trade['buy_token'])
+            total = trades.setdefault(key, {'ex_buy_amount': 0, 'ex_sell_amount': 0})
+            total['ex_buy_amount'] += trade['ex_buy_amount']
+            total['ex_sell_amount'] += trade['ex_sell_amount']
+
+    def _copy_venues(self, venues):
+        """
+        Returns fresh venue instances holding a copy of the reserves of the venues.
+        """
+        return [venue(Venue.name, dict(Venue.reserves), dict(Venue.raw_reserves), Venue.curve) for Venue in venues]
+
+    def results(self):
+        """
+        Returns the result of the batch, with the executed amounts of each order.
+
+        Returns:
+        --------
+        dict
+            The 'venues' and 'orders' sections, in the format of agent.print_results(),
+            with an additional 'status' for each order: 'filled', 'partially_filled' or 'unfilled'.
+        """
+        venues_data = {}
+        for (venue_name, sell_token, buy_token), trade in self.venue_trades.items():
+            name = venue_name if venue_name not in venues_data else f"{venue_name}:{buy_token}->{sell_token}"
+            venues_data[name] = {
+                "sell_token": sell_token,
+                "buy_token": buy_token,
+                "ex_buy_amount":  format_amount(trade['ex_buy_amount']),
+                "ex_sell_amount": format_amount(trade['ex_sell_amount']),
+            }
+
+        orders_data = {}
+        for Order in self.orders:
+            fill = self.fills[Order.order_number]
+            ex_sell_amount = fill['cow_sell'] + fill['amm_sell']
+            ex_buy_amount = fill['cow_buy'] + fill['amm_buy']
+            if ex_sell_amount >= Order.raw_limit_sell_amount * (1 - self.tolerance):
+                status = "filled"
+            elif ex_sell_amount > 0:
+                status = "partially_filled"
+            else:
+                status = "unfilled"
+            orders_data[Order.order_number] = {
+                "partial_fill": Order.partial_fill,
+                "buy_amount": format_amount(Order.raw_limit_buy_amount),
+                "sell_amount": format_amount(Order.raw_limit_sell_amount),
+                "buy_token": Order.buy_token,
+                "sell_token": Order.sell_token,
+                "ex_buy_amount":  format_amount(ex_buy_amount),
+                "ex_sell_amount": format_amount(ex_sell_amount),
+                "status": status
+            }
+
+        return {
+            "venues": venues_data,
+            "orders": orders_data
+        }
+
+    def print_results(self, file=None):
+        """
+        Prints the result of the batch
+
+        Parameters:
+        -----------
+        file : str, optional
+            The file path where the output should be written. If None, the output is printed to the console.
+        """
+        output = json.dumps(self.results(), indent=4)
+
+        if file:
+            with open(file, 'w') as f:
+                f.write(output)
+        else:
+            print(output)
@@ -0,0 +1,428 @@
+import numpy as np
+from decimal import Decimal, localcontext
+
+# Fees are applied in exact mode as integers of 10^-6, as on-chain pools do with basis points
+FEE_SCALE = 10**6
+
+class curve_pair:
+    """
+    A class to represent the curve of a venue in one direction, from the token sold to the venue to
+    the token bought from it, with the parameters of the pair resolved once, e.g. the weights of the
+    two tokens. It is the price_function stored in the edges of the strategy: calling it dispatches
+    directly to the kernels of the curve, without comparing the type of the venue at every call.
+
+    Attributes:
+    -----------
+    curve : curve
+        The curve of the venue.
+    params : tuple
+        The parameters of the kernels for this direction, see curve.parameters().
+    reserve_factor : float or None
+        If the curve is a constant product curve in this direction, the factor of the sell reserve of
+        the equivalent fee-less constant product pool, 1/(1 - fee), otherwise None.
+
+    Methods:
+    --------
+    __call__(coin_amount, liquidity_sell_token, liquidity_buy_token, what_='buy', exact=False):
+        Same signature as market.price_function().
+    derivative(coin_amount, liquidity_sell_token, liquidity_buy_token):
+        The marginal rate after selling coin_amount.
+    marginal_rate(liquidity_sell_token, liquidity_buy_token):
+        The marginal rate at zero size.
+    """
+
+    __slots__ = ('curve', 'params', 'reserve_factor', '_buy', '_sell', '_exact_buy', '_exact_sell', '_derivative')
+
+    def __init__(self, Curve, params, reserve_factor=None):
+        self.curve = Curve
+        self.params = params
+        self.reserve_factor = reserve_factor
+        kernels = type(Curve)
+        self._buy = kernels.buy
+        self._sell = kernels.sell
+        self._exact_buy = kernels.exact_buy
+        self._exact_sell = kernels.exact_sell
+        self._derivative = kernels.derivative
+
+    def __call__(self, coin_amount, liquidity_sell_token, liquidity_buy_token, what_='buy', exact=False):
+        """
+        Returns the amount bought for coin_amount sold (what_='buy'), or the amount to sell to buy
+        coin_amount (what_='sell'), exactly in 10^-18 units rounded in favour of the pool if exact is True.
+        """
+        if exact:
+            if what_ == 'buy':
+                return self._exact_buy(coin_amount, liquidity_sell_token, liquidity_buy_token, *self.params)
+            return self._exact_sell(coin_amount, liquidity_sell_token, liquidity_buy_token, *self.params)
+        if what_ == 'buy':
+            return self._buy(coin_amount, liquidity_sell_token, liquidity_buy_token, *self.params)
+        return self._sell(coin_amount, liquidity_sell_token, liquidity_buy_token, *self.params)
+
+    def derivative(self, coin_amount, liquidity_sell_token, liquidity_buy_token):
+        return self._derivative(coin_amount, liquidity_sell_token, liquidity_buy_token, *self.params)
+
+    def marginal_rate(self, liquidity_sell_token, liquidity_buy_token):
+        if self.reserve_factor is not None:
+            return liquidity_buy_token / (liquidity_sell_token * self.reserve_factor)
+        return self._derivative(0.0, liquidity_sell_token, liquidity_buy_token, *self.params)
+
+class curve:
+    """
+    Base class of the AMM curves of the registry.
+
+    Each curve provides vectorized float kernels, buy(a, R_in, R_out, *params), sell(b, R_in, R_out, *params)
+    (the inverse, the amount to sell to buy b) and derivative(a, R_in, R_out, *params) (the marginal rate
+    db/da), which accept numpy arrays, and the exact integer kernels exact_buy and exact_sell, in 10^-18
+    units, rounding in favour of the pool. The parameters of a direction of a venue are given by
+    parameters(token_in, token_out), the fee first. For an amount bought the pool cannot pay, exact_sell
+    raises a ValueError, there being no integer inf as returned by the float sell kernel of constant_sum.
+
+    Attributes:
+    -----------
+    name : str
+        The name of the curve in the registry and in the JSON files.
+    fee : float
+        The fee kept by the pool, as a fraction of the amount sold, e.g. 0.003.
+
+    Methods:
+    --------
+    pair(token_in, token_out):
+        Returns the curve_pair of a direction of the venue.
+    parameters(token_in, token_out):
+        Returns the parameters of the kernels for a direction of the venue.
+    constant_product_factor(token_in, token_out):
+        The factor of the sell reserve of the equivalent constant product pool, or None.
+    to_json():
+        Returns the description of the curve in the JSON files.
+    """
+
+    name = None
+
+    def __init__(self, fee=0.0):
+        self.fee = float(fee)
+
+    def pair(self, token_in, token_out):
+        return curve_pair(self, self.parameters(token_in, token_out), self.constant_product_factor(token_in, token_out))
+
+    def parameters(self, token_in, token_out):
+        return (self.fee,)
+
+    def constant_product_factor(self, token_in, token_out):
+        return None
+
+    def to_json(self):
+        return {'type': self.name, 'fee': self.fee}
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{key}={value!r}' for key, value in self.to_json().items() if key != 'type')})"
+
+def _fee_units(fee):
+    return int(round(fee * FEE_SCALE))
+
+class constant_product(curve):
+    """
+    The constant product curve x * y = k (Uniswap V2), with the fee taken on the amount sold:
+    b = R_out γa/(R_in + γa), with γ = 1 - fee. This is a fee-less constant product pool with
+    the sell reserve R_in/γ, so chains of these pools collapse into virtual pools.
+    """
+
+    name = 'constant_product'
+
+    def constant_product_factor(self, token_in, token_out):
+        return 1.0 / (1.0 - self.fee)
+
+    @staticmethod
+    def buy(a, reserve_in, reserve_out, fee):
+        a = a * (1.0 - fee)
+        return reserve_out * (a / (reserve_in + a))
+
+    @staticmethod
+    def sell(b, reserve_in, reserve_out, fee):
+        return -reserve_in * (-b / (reserve_out - b)) / (1.0 - fee)
+
+    @staticmethod
+    def derivative(a, reserve_in, reserve_out, fee):
+        gamma = 1.0 - fee
+        return gamma * reserve_in * reserve_out / (reserve_in + gamma * a)**2
+
+    @staticmethod
+    def exact_buy(a, reserve_in, reserve_out, fee):
+        if fee == 0.0:
+            return (reserve_out * a) // (reserve_in + a)
+        a = a * (FEE_SCALE - _fee_units(fee))
+        return (reserve_out * a) // (reserve_in * FEE_SCALE + a)
+
+    @staticmethod
+    def exact_sell(b, reserve_in, reserve_out, fee):
+        if b >= reserve_out:
+            raise ValueError(f"Cannot buy {b} from a reserve of {reserve_out}")
+        if fee == 0.0:
+            return -((-reserve_in * b) // (reserve_out - b))
+        return -((-reserve_in * b * FEE_SCALE) // ((reserve_out - b) * (FEE_SCALE - _fee_units(fee))))
+
+class constant_sum(curve):
+    """
+    The constant sum curve x + y = k: one token for one token, less the fee, up to the reserve
+    of the token bought.
+    """
+
+    name = 'constant_sum'
+
+    @staticmethod
+    def buy(a, reserve_in, reserve_out, fee):
+        return np.minimum(a * (1.0 - fee), reserve_out)
+
+    @staticmethod
+    def sell(b, reserve_in, reserve_out, fee):
+        return np.where(b <= reserve_out, b / (1.0 - fee), np.inf)
+
+    @staticmethod
+    def derivative(a, reserve_in, reserve_out, fee):
+        return np.where(a * (1.0 - fee) < reserve_out, 1.0 - fee, 0.0)
+
+    @staticmethod
+    def exact_buy(a, reserve_in, reserve_out, fee):
+        return min(a * (FEE_SCALE - _fee_units(fee)) // FEE_SCALE, reserve_out)
+
+    @staticmethod
+    def exact_sell(b, reserve_in, reserve_out, fee):
+        if b > reserve_out:
+            raise ValueError(f"Cannot buy {b} from a reserve of {reserve_out}")
+        return -((-b * FEE_SCALE) // (FEE_SCALE - _fee_units(fee)))
+
+class stableswap(curve):
+    """
+    The StableSwap curve of Curve pools with two tokens, A n^n (x + y) + D = A D n^n + D^(n+1)/(n^n x y)
+    with n = 2, flat around x = y and constant product like far from it. The fee is taken on the
+    amount bought. The invariant D and the new reserve of the token bought are found by Newton's method,
+    in floats for the vectorized kernels and in integers, as the pools do, for the exact kernels.
+
+    Attributes:
+    -----------
+    amplification : float
+        The amplification coefficient A.
+    """
+
+    name = 'stableswap'
+    iterations = 255
+
+    def __init__(self, amplification=100.0, fee=0.0):
+        super().__init__(fee)
+        self.amplification = float(amplification)
+
+    def parameters(self, token_in, token_out):
+        return (self.fee, self.amplification)
+
+    def to_json(self):
+        return {'type': self.name, 'fee': self.fee, 'amplification': self.amplification}
+
+    @classmethod
+    def _invariant(cls, x, y, amplification):
+        # Newton's method for D, vectorized
+        x, y, amplification = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float),
+                                                  np.asarray(amplification, dtype=float))
+        ann = 4.0 * amplification
+        total = x + y
+        invariant = total.copy()
+        for _ in range(cls.iterations):
+            product = invariant**3 / (4.0 * x * y)
+            previous = invariant
+            invariant = (ann * total + 2.0 * product) * invariant / ((ann - 1.0) * invariant + 3.0 * product)
+            if np.all(np.abs(invariant - previous) <= 1e-15 * np.abs(invariant)):
+                break
+        return invariant
+
+    @classmethod
+    def _other_reserve(cls, x, invariant, amplification):
+        # Newton's method for the reserve y keeping D, given the other reserve x
+        ann = 4.0 * amplification
+        c = invariant**3 / (4.0 * x * ann)
+        b = x + invariant / ann
+        y = np.array(invariant, dtype=float)
+        for _ in range(cls.iterations):
+            previous = y
+            y = (y * y + c) / (2.0 * y + b - invariant)
+            if np.all(np.abs(y - previous) <= 1e-15 * np.abs(y)):
+                break
+        return y
+
+    @classmethod
+    def buy(cls, a, reserve_in, reserve_out, fee, amplification):
+        invariant = cls._invariant(reserve_in, reserve_out, amplification)
+        y = cls._other_reserve(reserve_in + a, invariant, amplification)
+        return np.maximum(reserve_out - y, 0.0) * (1.0 - fee)
+
+    @classmethod
+    def sell(cls, b, reserve_in, reserve_out, fee, amplification):
+        invariant = cls._invariant(reserve_in, reserve_out, amplification)
+        x = cls._other_reserve(reserve_out - b / (1.0 - fee), invariant, amplification)
+        return x - reserve_in
+
+    @classmethod
+    def derivative(cls, a, reserve_in, reserve_out, fee, amplification):
+        invariant = cls._invariant(reserve_in, reserve_out, amplification)
+        x = reserve_in + a
+        y = cls._other_reserve(x, invariant, amplification)
+        # Implicit differentiation of the invariant: -dy/dx = F_x/F_y
+        cube = invariant**3 / 4.0
+        return (1.0 - fee) * (4.0 * amplification + cube / (x * x * y)) / (4.0 * amplification + cube / (x * y * y))
+
+    @classmethod
+    def _exact_invariant(cls, x, y, amplification):
+        ann = 4 * int(amplification)
+        total = x + y
+        if total == 0:
+            return 0
+        invariant = total
+        for _ in range(cls.iterations):
+            product = invariant * invariant // (2 * x) * invariant // (2 * y)
+            previous = invariant
+            invariant = (ann * total + 2 * product) * invariant // ((ann - 1) * invariant + 3 * product)
+            if abs(invariant - previous) <= 1:
+                break
+        return invariant
+
+    @classmethod
+    def _exact_other_reserve(cls, x, invariant, amplification):
+        ann = 4 * int(amplification)
+        c = invariant * invariant // (2 * x) * invariant // (2 * ann)
+        b = x + invariant // ann
+        y = invariant
+        for _ in range(cls.iterations):
+            previous = y
+            y = (y * y + c) // (2 * y + b - invariant)
+            if abs(y - previous) <= 1:
+                break
+        return y
+
+    @classmethod
+    def exact_buy(cls, a, reserve_in, reserve_out, fee, amplification):
+        if a == 0:
+            return 0
+        invariant = cls._exact_invariant(reserve_in, reserve_out, amplification)
+        bought = max(reserve_out - cls._exact_other_reserve(reserve_in + a, invariant, amplification) - 1, 0)
+        return bought - bought * _fee_units(fee) // FEE_SCALE - (1 if bought * _fee_units(fee) % FEE_SCALE else 0)
+
+    @classmethod
+    def exact_sell(cls, b, reserve_in, reserve_out, fee, amplification):
+        if b == 0:
+            return 0
+        before_fee = -((-b * FEE_SCALE) // (FEE_SCALE - _fee_units(fee)))
+        if before_fee + 1 >= reserve_out:
+            raise ValueError(f"Cannot buy {b} from a reserve of {reserve_out}")
+        invariant = cls._exact_invariant(reserve_in, reserve_out, amplification)
+        return cls._exact_other_reserve(reserve_out - before_fee - 1, invariant, amplification) - reserve_in + 1
+
+class weighted(curve):
+    """
+    The weighted constant product curve x^w_x * y^w_y = k (Balancer), with the fee taken on the
+    amount sold: b = R_out (1 - (R_in/(R_in + γa))^(w_in/w_out)), with γ = 1 - fee. With equal
+    weights this is the constant product curve. The exact kernels use 60 significant digits.
+
+    Attributes:
+    -----------
+    weights : dict
+        The weight of each token of the venue, equal weights for the tokens not listed.
+    """
+
+    name = 'weighted'
+
+    def __init__(self, weights=None, fee=0.0):
+        super().__init__(fee)
+        self.weights = {token: float(weight) for token, weight in (weights or {}).items()}
+
+    def parameters(self, token_in, token_out):
+        return (self.fee, self.weights.get(token_in, 1.0), self.weights.get(token_out, 1.0))
+
+    def constant_product_factor(self, token_in, token_out):
+        if self.weights.get(token_in, 1.0) == self.weights.get(token_out, 1.0):
+            return 1.0 / (1.0 - self.fee)
+        return None
+
+    def to_json(self):
+        return {'type': self.name, 'fee': self.fee, 'weights': self.weights}
+
+    @staticmethod
+    def buy(a, reserve_in, reserve_out, fee, weight_in, weight_out):
+        return reserve_out * -np.expm1((weight_in / weight_out) * np.log(reserve_in / (reserve_in + a * (1.0 - fee))))
+
+    @staticmethod
+    def sell(b, reserve_in, reserve_out, fee, weight_in, weight_out):
+        return reserve_in * np.expm1((weight_out / weight_in) * np.log(reserve_out / (reserve_out - b))) / (1.0 - fee)
+
+    @staticmethod
+    def derivative(a, reserve_in, reserve_out, fee, weight_in, weight_out):
+        gamma = 1.0 - fee
+        base = reserve_in + gamma * a
+        return gamma * reserve_out * (weight_in / weight_out) * (reserve_in / base)**(weight_in / weight_out) / base
+
+    @staticmethod
+    def exact_buy(a, reserve_in, reserve_out, fee, weight_in, weight_out):
+        with localcontext() as context:
+            context.prec = 60
+            a = Decimal(a) * (FEE_SCALE - _fee_units(fee)) / FEE_SCALE
+            ratio = (Decimal(reserve_in) / (Decimal(reserve_in) + a)) ** (Decimal(weight_in) / Decimal(weight_out))
+            return int((Decimal(reserve_out) * (1 - ratio)).to_integral_value(rounding='ROUND_FLOOR'))
+
+    @staticmethod
+    def exact_sell(b, reserve_in, reserve_out, fee, weight_in, weight_out):
+        if b >= reserve_out:
+            raise ValueError(f"Cannot buy {b} from a reserve of {reserve_out}")
+        with localcontext() as context:
+            context.prec = 60
+            ratio = (Decimal(reserve_out) / (Decimal(reserve_out) - Decimal(b))) ** (Decimal(weight_out) / Decimal(weight_in))
+            a = Decimal(reserve_in) * (ratio - 1) * FEE_SCALE / (FEE_SCALE - _fee_units(fee))
+            return int(a.to_integral_value(rounding='ROUND_CEILING'))
+
+# The registry of the curves, by name
+curves = {
+    'constant_product': constant_product,
+    'constant_sum': constant_sum,
+    'stableswap': stableswap,
+    'weighted': weighted
+}
+
+def register_curve(Curve):
+    """
+    Adds a curve class to the registry, under its name, so that venues can declare it in the JSON files.
+
+    Parameters:
+    -----------
+    Curve : type
+        A subclass of curve with a name and the buy, sell, derivative, exact_buy and exact_sell kernels.
+    """
+    curves[Curve.name] = Curve
+    return Curve
+
+# The curves are immutable, the venues without a curve entry share the same fee-less constant product
+_DEFAULT_CURVE = constant_product()
+
+def make_curve(data=None):
+    """
+    Creates the curve of a venue from the 'curve' entry of the venue in the JSON files.
+
+    Parameters:
+    -----------
+    data : str or dict, optional
+        The name of the curve, or a dictionary with its 'type' and its parameters, e.g.
+        {"type": "stableswap", "amplification": 200, "fee": 0.0004}. Default is None, a fee-less
+        constant product curve.
+
+    Returns:
+    --------
+    curve
+        The curve instance.
+
+    Raises:
+    -------
+    ValueError
+        If the curve is not in the registry.
+    """
+    if data is None:
+        return _DEFAULT_CURVE
+    if isinstance(data, str):
+        data = {'type': data}
+    parameters = dict(data)
+    name = parameters.pop('type', 'constant_product')
+    if name not in curves:
+        raise ValueError(f"Unsupported market type: {name}")
+    return curves[name](**parameters)
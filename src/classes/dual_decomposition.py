@@ -0,0 +1,212 @@
+import numpy as np
+from scipy.optimize import minimize, NonlinearConstraint
+from .water_filling import solver_result
+
+def dual_decomposition(edge_sell, edge_buy, reserve_in, reserve_out, n_tokens, sell_token, buy_token,
+                       limit_sell_amount, limit_buy_amount, partial_fill=False, polish='auto',
+                       tolerance=1e-6):
+    """
+    Surplus maximization over a network of constant product venues, with one flow variable per
+    directed venue use instead of one per path.
+
+    Each edge e sells a_e coins of its sell token to a venue and receives b_e = R_out a_e/(R_in + a_e)
+    coins of its buy token. The net amount of each token, sum(b_e) over the edges entering it minus
+    sum(a_e) over the edges leaving it, must be non negative for the intermediate tokens, equals minus
+    the amount sold for the sell token and the amount bought for the buy token. The problem is convex
+    and its size is linear in the number of venues, whatever the number of paths through them, and
+    venues visited by several paths are modelled exactly since each venue only has one flow.
+
+    Pricing the conservation constraints with token prices p, the Lagrangian decouples into one
+    arbitrage problem per venue, max_a p_out b(a) - p_in a, solved in closed form by
+    a = max(0, sqrt(R_in R_out p_out/p_in) - R_in) with value (sqrt(p_out R_out) - sqrt(p_in R_in))^2.
+    The dual function
+
+        g(p) = sum_e arbitrage_e(p) + limit_sell (p_sell - 1/exch_rate) + limit_buy (1 - p_buy)
+
+    is convex and smooth, with p_buy >= 1, p_sell >= 1/exch_rate for partial fill orders, and its
+    gradient is the net amount of each token left by the venue flows. It is minimized over the log
+    prices with L-BFGS-B, and the optimal prices give back the flows of the venues.
+
+    This method performs the following steps:
+    1. Initial prices: the best marginal rate at zero size from each token to the buy token. The
+       price of the sell token times limit_sell_amount bounds the amount bought.
+    2. Minimizes the dual function with L-BFGS-B and recovers the flows of the venues, which are
+       the result if they satisfy the constraints of the primal problem within the tolerance.
+       The dual is unbounded if the limit buy amount cannot be met: fill-or-kill orders, whose
+       surplus is the amount bought, and the orders whose limit buy amount exceeds the bound are
+       solved without it, and a partial fill order whose flows do not meet it is solved again without it.
+       If the largest amount bought is below the limit buy amount, its flows are returned with
+       status 2, as water_filling() does.
+    3. Otherwise, or if polish is True, the flows are refined with SLSQP on the primal problem, so
+       that the conservation constraints hold to the solver tolerance. The Jacobians of the net
+       amounts are filled from the token indices of the edges, only for the rows of each constraint.
+
+    Parameters:
+    -----------
+    edge_sell : array_like
+        The index of the token sold to the venue of each edge.
+    edge_buy : array_like
+        The index of the token bought from the venue of each edge.
+    reserve_in : array_like
+        The sell token liquidity of the venue of each edge.
+    reserve_out : array_like
+        The buy token liquidity of the venue of each edge.
+    n_tokens : int
+        The number of tokens, indexed from 0.
+    sell_token : int
+        The index of the token sold by the order.
+    buy_token : int
+        The index of the token bought by the order.
+    limit_sell_amount : float
+        The maximum amount of sell token of the order.
+    limit_buy_amount : float
+        The minimum amount of buy token of the order.
+    partial_fill : bool, optional
+        Whether partial filling of the order is allowed. Default is False (fill-or-kill).
+    polish : bool or str, optional
+        Refines the flows recovered from the dual with SLSQP: always if True, never if False, and
+        only if the flows violate the primal constraints by more than the tolerance if 'auto'.
+        Default is 'auto'.
+    tolerance : float, optional
+        The relative violation of the primal constraints accepted from the flows recovered from the
+        dual: relative to the limit amounts for the sell and buy tokens, and to the amount traded
+        through the token for the intermediate tokens. Default is 1e-6.
+
+    Returns:
+    --------
+    solver_result
+        The optimal amounts sold to the venue of each edge, with the status of SLSQP if polished,
+        otherwise 0 if the flows recovered from the dual are feasible, or the status of L-BFGS-B.
+        The status is 2 if the limit buy amount cannot be met, with the flows buying the most.
+    """
+    edge_sell = np.asarray(edge_sell, dtype=int)
+    edge_buy = np.asarray(edge_buy, dtype=int)
+    reserve_in = np.asarray(reserve_in, dtype=float)
+    reserve_out = np.asarray(reserve_out, dtype=float)
+    limit_rate = limit_buy_amount / limit_sell_amount
+
+    def flows(prices):
+        a = np.maximum(0.0, np.sqrt(reserve_in * reserve_out * prices[edge_buy] / prices[edge_sell]) - reserve_in)
+        return a, reserve_out * a / (reserve_in + a)
+
+    def net_amounts(a, b):
+        return np.bincount(edge_buy, b, n_tokens) - np.bincount(edge_sell, a, n_tokens)
+
+    def dual(log_prices, limit_buy_amount):
+        prices = np.exp(log_prices)
+        a, b = flows(prices)
+        value = (np.sum(prices[edge_buy] * b - prices[edge_sell] * a) +
+                 limit_sell_amount * (prices[sell_token] - limit_rate) + limit_buy_amount * (1.0 - prices[buy_token]))
+        gradient = net_amounts(a, b)
+        gradient[sell_token] += limit_sell_amount
+        gradient[buy_token] -= limit_buy_amount
+        return value, prices * gradient
+
+    # Initial prices, in buy token: the best marginal rate at zero size towards the buy token
+    rate_at_zero = reserve_out / reserve_in
+    prices = np.zeros(n_tokens)
+    prices[buy_token] = 1.0
+    for _ in range(n_tokens):
+        candidate = np.zeros(n_tokens)
+        np.maximum.at(candidate, edge_sell, rate_at_zero * prices[edge_buy])
+        candidate[buy_token] = 1.0
+        if np.array_equal(candidate, prices):
+            break
+        prices = np.maximum(prices, candidate)
+    prices[prices <= 0.0] = np.min(prices[prices > 0.0])
+
+    def minimize_dual(limit_buy_amount, partial_fill):
+        start = prices.copy()
+        bounds = [(None, None)] * n_tokens
+        bounds[buy_token] = (0.0, None)
+        if partial_fill:
+            start[sell_token] = max(start[sell_token], limit_rate)
+            bounds[sell_token] = (np.log(limit_rate), None)
+        # The line search backtracks from the trial prices whose exponential overflows
+        with np.errstate(over='ignore', divide='ignore', invalid='ignore'):
+            return minimize(dual, np.log(start), args=(limit_buy_amount,), method='L-BFGS-B', jac=True, bounds=bounds,
+                            options={'ftol': 0.0, 'gtol': 1e-10, 'maxiter': 1000})
+
+    def infeasible(dual_result):
+        return solver_result(flows(np.exp(dual_result.x))[0], 2,
+                             "The limit buy amount cannot be met with the available liquidity (dual decomposition)",
+                             nit=dual_result.nit, nfev=dual_result.nfev, njev=dual_result.nfev)
+
+    # The value in buy token of the coins held never increases through a venue, whose rate is at most its
+    # rate at zero size, so prices[sell_token] * limit_sell_amount bounds the amount bought
+    attainable = prices[sell_token] * limit_sell_amount >= limit_buy_amount * (1 - tolerance)
+    if partial_fill and attainable:
+        dual_result = minimize_dual(limit_buy_amount, True)
+    else:
+        # With the amount sold fixed the surplus is the amount bought, so the limit buy amount cannot bind:
+        # the dual without it is bounded, and the amount bought is compared with the limit afterwards
+        dual_result = minimize_dual(0.0, False)
+    x, b = flows(np.exp(dual_result.x))
+
+    # Primal feasibility of the recovered flows
+    intermediate = np.array([token for token in range(n_tokens) if token not in (sell_token, buy_token)], dtype=int)
+    net = net_amounts(x, b)
+    traded = np.bincount(edge_buy, b, n_tokens) + np.bincount(edge_sell, x, n_tokens)
+    unsold = limit_sell_amount + net[sell_token]
+    feasible = (unsold >= -tolerance * limit_sell_amount and (partial_fill or unsold <= tolerance * limit_sell_amount) and
+                net[buy_token] >= limit_buy_amount * (1 - tolerance) and
+                bool(np.all(net[intermediate] >= -tolerance * traded[intermediate])))
+    if not feasible and net[buy_token] < limit_buy_amount * (1 - tolerance):
+        if partial_fill and attainable:
+            # The dual of a partial fill order is unbounded if the limit buy amount cannot be met:
+            # the largest amount bought decides
+            dual_result = minimize_dual(0.0, False)
+            x, b = flows(np.exp(dual_result.x))
+            if net_amounts(x, b)[buy_token] < limit_buy_amount * (1 - tolerance):
+                return infeasible(dual_result)
+            dual_result = minimize_dual(limit_buy_amount, True)
+            x, b = flows(np.exp(dual_result.x))
+        else:
+            return infeasible(dual_result)
+    if polish is False or (polish == 'auto' and feasible):
+        return solver_result(x, 0 if feasible else int(dual_result.status),
+                             f"Dual decomposition{', feasible flows' if feasible else ''}: {dual_result.message}",
+                             nit=dual_result.nit, nfev=dual_result.nfev, njev=dual_result.nfev)
+
+    # Primal refinement of the recovered flows
+    edges = np.arange(len(edge_sell))
+
+    def bought(a):
+        return reserve_out * a / (reserve_in + a)
+
+    def derivative(a):
+        return reserve_in * reserve_out / (reserve_in + a)**2
+
+    def net_jacobian(a, tokens):
+        # Rows of the Jacobian of the net amounts of some tokens, filled from the edge index arrays:
+        # each edge enters one token and leaves one token
+        rows = np.full(n_tokens, -1)
+        rows[tokens] = np.arange(len(tokens))
+        jacobian = np.zeros((len(tokens), len(a)))
+        entering = rows[edge_buy] >= 0
+        jacobian[rows[edge_buy][entering], edges[entering]] = derivative(a)[entering]
+        leaving = rows[edge_sell] >= 0
+        jacobian[rows[edge_sell][leaving], edges[leaving]] -= 1.0
+        return jacobian
+
+    def surplus(a):
+        net = net_amounts(a, bought(a))
+        return -(net[buy_token] + net[sell_token] * limit_rate)
+
+    def surplus_gradient(a):
+        jacobian = net_jacobian(a, [buy_token, sell_token])
+        return -(jacobian[0] + jacobian[1] * limit_rate)
+
+    constraints = [{'type': 'ineq' if partial_fill else 'eq',
+                    'fun': lambda a: limit_sell_amount + net_amounts(a, bought(a))[sell_token],
+                    'jac': lambda a: net_jacobian(a, [sell_token])},
+                   NonlinearConstraint(lambda a: net_amounts(a, bought(a))[buy_token] - limit_buy_amount, 0, np.inf,
+                                       jac=lambda a: net_jacobian(a, [buy_token]))]
+    if len(intermediate):
+        constraints.append(NonlinearConstraint(lambda a: net_amounts(a, bought(a))[intermediate], 0, np.inf,
+                                               jac=lambda a: net_jacobian(a, intermediate)))
+    result = minimize(surplus, x, method='SLSQP', jac=surplus_gradient, bounds=[(0.0, None)] * len(x),
+                      constraints=constraints, options={'maxiter': 500})
+    return solver_result(np.maximum(result.x, 0.0), int(result.status), f"Dual decomposition, polished: {result.message}",
+                         nit=dual_result.nit + result.nit, nfev=dual_result.nfev + result.nfev,
+                         njev=dual_result.nfev + result.njev)
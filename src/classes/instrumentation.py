@@ -0,0 +1,212 @@
+import json
+import time
+import logging
+
+class null_sink:
+    """
+    A sink discarding every event. With this sink, the default one, the instrumentation is
+    disabled and spans and counters cost a single attribute check.
+    """
+
+    def emit(self, event):
+        pass
+
+class log_sink:
+    """
+    A sink writing each event as one line of a logger.
+
+    Attributes:
+    -----------
+    logger : logging.Logger
+        The logger receiving the events. Default is the 'mev_agent' logger.
+    level : int
+        The logging level of the events. Default is logging.INFO.
+    """
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger if logger is not None else logging.getLogger('mev_agent')
+        self.level = level
+
+    def emit(self, event):
+        tags = " ".join(f"{key}={value}" for key, value in event.items() if key not in ('event', 'name', 'value'))
+        self.logger.log(self.level, f"{event['event']} {event['name']} {event['value']:.9g} {tags}".rstrip())
+
+class json_lines_sink:
+    """
+    A sink writing each event as one JSON line, to aggregate them later.
+
+    Attributes:
+    -----------
+    file : file object
+        The stream receiving the events.
+    """
+
+    def __init__(self, file):
+        """
+        Parameters:
+        -----------
+        file : str or file object
+            The path of the file, opened in append mode, or an open stream.
+        """
+        self.file = open(file, 'a') if isinstance(file, str) else file
+
+    def emit(self, event):
+        self.file.write(json.dumps(event) + '\n')
+        self.file.flush()
+
+class memory_sink:
+    """
+    A sink keeping the events in memory, e.g. for tests or to aggregate a run in-process.
+
+    Attributes:
+    -----------
+    events : list
+        The events received, in order.
+
+    Methods:
+    --------
+    values(name):
+        Returns the values of the events with a given name.
+    summary():
+        Returns the number of events and the total value of each name.
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def emit(self, event):
+        self.events.append(event)
+
+    def values(self, name):
+        """
+        Returns the values (seconds for spans) of the events with a given name, in order.
+        """
+        return [event['value'] for event in self.events if event['name'] == name]
+
+    def summary(self):
+        """
+        Returns a dictionary with the number of events and the total value of each name.
+        """
+        summary = {}
+        for event in self.events:
+            entry = summary.setdefault(event['name'], {'event': event['event'], 'count': 0, 'total': 0.0})
+            entry['count'] += 1
+            entry['total'] += event['value']
+        return summary
+
+class _span:
+    """
+    Context manager timing a block of code and emitting its duration when the block ends.
+    """
+
+    def __init__(self, sink, name, tags):
+        self.sink = sink
+        self.name = name
+        self.tags = tags
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        event = {'event': 'span', 'name': self.name, 'value': time.perf_counter() - self.start}
+        event.update(self.tags)
+        self.sink.emit(event)
+        return False
+
+class _null_span:
+    """
+    Context manager doing nothing, shared by all the spans while the instrumentation is disabled.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_SPAN = _null_span()
+
+class instrumentation:
+    """
+    A class to record timing spans and counters of the solve path and send them to a sink.
+
+    Each event is a dictionary with the keys 'event' ('span' or 'counter'), 'name', 'value'
+    (seconds for spans) and the tags given when recording it, e.g. the order number.
+
+    Attributes:
+    -----------
+    sink : object
+        The object receiving the events through its emit(event) method.
+    enabled : bool
+        False with the null_sink: spans and counters are then not recorded at all.
+
+    Methods:
+    --------
+    set_sink(sink):
+        Sends the following events to sink, None for the null_sink.
+    span(name, **tags):
+        Returns a context manager timing the block of code it wraps.
+    count(name, value=1, **tags):
+        Records a counter.
+    """
+
+    def __init__(self, sink=None):
+        self.set_sink(sink)
+
+    def set_sink(self, sink):
+        """
+        Sends the following events to sink.
+
+        Parameters:
+        -----------
+        sink : object
+            Any object with an emit(event) method, e.g. log_sink, json_lines_sink or memory_sink.
+            None disables the instrumentation.
+
+        Returns:
+        --------
+        object
+            The previous sink.
+        """
+        previous = getattr(self, 'sink', None)
+        self.sink = sink if sink is not None else null_sink()
+        self.enabled = not isinstance(self.sink, null_sink)
+        return previous
+
+    def span(self, name, **tags):
+        """
+        Returns a context manager timing the block of code it wraps.
+
+        Parameters:
+        -----------
+        name : str
+            The name of the span, e.g. 'optimizer'.
+        **tags :
+            Additional keys of the event, e.g. order='0'.
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _span(self.sink, name, tags)
+
+    def count(self, name, value=1, **tags):
+        """
+        Records a counter.
+
+        Parameters:
+        -----------
+        name : str
+            The name of the counter, e.g. 'nfev'.
+        value : float, optional
+            The value of the counter. Default is 1.
+        **tags :
+            Additional keys of the event, e.g. order='0'.
+        """
+        if not self.enabled:
+            return
+        event = {'event': 'counter', 'name': name, 'value': value}
+        event.update(tags)
+        self.sink.emit(event)
+
+# The instrumentation shared by the whole package, silent by default
+instruments = instrumentation()
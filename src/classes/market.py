@@ -1,6 +1,8 @@
-import networkx as nx
+import numpy as np
 from .venue import venue
-from matplotlib import pyplot as plt
+from .venue_view import venue_views
+from .amount import SCALE, to_raw, to_float
+from .curves import make_curve
 import sys
 
 class market:
@@ -8,43 +10,198 @@ class market:
     A class to represent a market of trading venues as a non-directed multi-graph.
     The edges of this non-directed graph contain venues information, while the nodes
     are the coin pairs that can be swapped in such venues.
+
+    The market is stored as compact arrays: tokens and venues are interned to integer ids,
+    the reserves of all the venues are contiguous fixed-width arrays indexed by reserve slot,
+    and the graph is a CSR adjacency over token ids. The venues of the market are views over
+    these arrays, and the networkx graph is built only on demand (e.g. for plotting).
     
     Note:
         - This class is not developed to treat multi-assets liquidity pools!
 
     Attributes:
     -----------
-    venues : list
-        A list containing venue instances.
+    venues : venue_views
+        The venues of the market, a sequence of views over the reserve arrays (see venue_view.py).
     graph : networkx.Graph
-        A graph where each unique coin is a node and each reserve acts as an edge.
+        A graph where each unique coin is a node and each reserve acts as an edge, built on demand.
+    max_hops : int
+        The maximum number of venues visited by a path, None for no limit.
+    topology_version : int
+        A counter increased every time venues are added or removed.
+    reserve_version : int
+        A counter increased every time reserves are updated.
+    tokens : list
+        The token names, indexed by token id.
+    token_index : dict
+        The token id of each token name.
+    venue_names : list
+        The venue names, indexed by venue id.
+    venue_index : dict
+        The venue id of each venue name.
+    venue_curves : list
+        The AMM curve of each venue, indexed by venue id (see curves.py).
+    reserve_indptr : np.ndarray
+        The reserve slots of venue v are reserve_indptr[v]:reserve_indptr[v + 1], sorted by token id.
+    reserve_tokens : np.ndarray
+        The token id of each reserve slot.
+    reserves : np.ndarray
+        The liquidity of each reserve slot.
+    raw_whole : np.ndarray
+        The whole tokens of the exact liquidity of each reserve slot (int64).
+    raw_fraction : np.ndarray
+        The rest of the exact liquidity of each reserve slot, in 10^-18 units (int64): the exact
+        liquidity is raw_whole * 10^18 + raw_fraction, see raw_reserve().
+    adjacency_indptr : np.ndarray
+        The adjacency entries of token t are adjacency_indptr[t]:adjacency_indptr[t + 1], sorted by neighbour.
+    adjacency_tokens : np.ndarray
+        The neighbour token id of each adjacency entry.
+    adjacency_venues : np.ndarray
+        The venue id of each adjacency entry, parallel venues being consecutive entries.
+    adjacency_slot_sell : np.ndarray
+        The reserve slot of the token swapped away (the row token) in the venue of each adjacency entry.
+    adjacency_slot_buy : np.ndarray
+        The reserve slot of the neighbour token in the venue of each adjacency entry.
     
     Methods:
     --------
+    generate_arrays():
+        Generates the compact arrays from the venues.
     generate_graph():
-        Generates a graph from the venues.
+        Generates a networkx graph from the compact arrays.
+    add_venue(venue):
+        Adds a venue to the market.
+    add_venues(venues):
+        Adds several venues to the market at once.
+    remove_venue(venue_name):
+        Removes a venue from the market.
+    apply_reserve_updates(updates, raw=False):
+        Updates the reserves of the venues in place.
+    snapshot():
+        Returns an immutable, versioned snapshot of the market.
+    reserve_slot(venue_name, token):
+        Returns the reserve slot of a token in a venue.
+    raw_reserve(slot):
+        Returns the exact liquidity of a reserve slot.
+    pools_between(sell_token, buy_token):
+        Returns the venues swapping sell_token for buy_token with their reserve slots.
+    curve_pair(venue_name, sell_token, buy_token):
+        Returns the curve of a venue in the direction selling sell_token, resolved once.
+    find_paths(sell_token, buy_token, max_hops=None):
+        Returns the simple paths connecting two tokens, memoized in the path index.
     plot_graph(file, verbose):
         Prints the graph with matplotlib.
-    price_function(sell_amount, liquidity_sell_token, liquidity_buy_token, market_type):
+    price_function(sell_amount, liquidity_sell_token, liquidity_buy_token, market_type, what_, exact):
         Calculates the amount of tokens bought in a specific liquidity pool given sell amount.
+    virtual_pool(liquidity_sell_tokens, liquidity_buy_tokens):
+        Collapses a chain of constant product liquidity pools into one equivalent pool.
     """
 
-    def __init__(self, venues):
+    def __init__(self, venues, max_hops=4):
         """
         Constructs all the necessary attributes for the market object.
         
         Parameters:
         -----------
         venues : list
-            A list containing venue instances.
+            A list containing venue instances, replaced by views over the reserve arrays.
+        max_hops : int, optional
+            The maximum number of venues visited by a path, None for no limit. Default is 4.
         """
         self.venues = venues
-        self.graph = nx.Graph()
-        self.generate_graph()
+        self.max_hops = max_hops
+        self.topology_version = 0
+        self.reserve_version = 0
+        self._path_index = {}
+        self._graph = None
+        self.generate_arrays()
+
+    @property
+    def graph(self):
+        """
+        The networkx graph of the market, generated the first time it is requested.
+        """
+        if self._graph is None:
+            self.generate_graph()
+        return self._graph
+
+    def generate_arrays(self):
+        """
+        Generates the compact representation of the market from the market venues
+
+        This method performs the following steps:
+        1. Interns tokens and venues to integer ids, in order of appearance.
+        2. Stores the reserves of every venue in contiguous reserve slots sorted by token id,
+           both exact, split into whole tokens and fraction, and as floats.
+        3. Replaces the venues with views over the reserve arrays.
+        4. Creates one adjacency entry per venue and ordered pair of its tokens, in both
+           directions, and sorts them by token and neighbour into a CSR structure.
+           Parallel venues on the same token pair are consecutive entries -- multigraph
+        """
+        self.tokens = []
+        self.token_index = {}
+        self.venue_names = []
+        self.venue_index = {}
+        self.venue_curves = []
+        self._curve_pairs = {}
+        reserve_indptr = [0]
+        reserve_tokens = []
+        reserves = []
+        entries = []
+
+        for venue_id, venue in enumerate(self.venues):
+            self.venue_names.append(venue.name)
+            self.venue_index[venue.name] = venue_id
+            self.venue_curves.append(venue.curve)
+            first_slot = len(reserve_tokens)
+            raw_reserves = venue.raw_reserves
+            token_ids = []
+            for token in raw_reserves:
+                if token not in self.token_index:
+                    self.token_index[token] = len(self.tokens)
+                    self.tokens.append(token)
+                token_ids.append((self.token_index[token], token))
+            # Sorted by token id, so that reserve_slot() finds a slot by binary search
+            for token_id, token in sorted(token_ids):
+                reserve_tokens.append(token_id)
+                reserves.append(raw_reserves[token])
+            reserve_indptr.append(len(reserve_tokens))
+
+            # One entry for each direction of each token pair of the venue
+            for slot1 in range(first_slot, len(reserve_tokens)):
+                for slot2 in range(slot1 + 1, len(reserve_tokens)):
+                    entries.append((reserve_tokens[slot1], reserve_tokens[slot2], venue_id, slot1, slot2))
+                    entries.append((reserve_tokens[slot2], reserve_tokens[slot1], venue_id, slot2, slot1))
+
+        self.reserve_indptr = np.array(reserve_indptr, dtype=np.int32)
+        self.reserve_tokens = np.array(reserve_tokens, dtype=np.int32)
+        raw_reserves = np.empty(len(reserves), dtype=object)
+        raw_reserves[:] = reserves
+        self.reserves = to_float(raw_reserves)
+        self.raw_whole = np.array([amount // SCALE for amount in reserves], dtype=np.int64)
+        self.raw_fraction = np.array([amount % SCALE for amount in reserves], dtype=np.int64)
+        self.venues = self._venue_views()
+
+        entries = np.array(entries, dtype=np.int32).reshape(-1, 5)
+        # Stable sort by token and neighbour, parallel venues keep their order of appearance
+        order = np.lexsort((entries[:, 1], entries[:, 0]))
+        entries = entries[order]
+        self.adjacency_indptr = np.searchsorted(entries[:, 0], np.arange(len(self.tokens) + 1)).astype(np.int32)
+        self.adjacency_tokens = entries[:, 1].copy()
+        self.adjacency_venues = entries[:, 2].copy()
+        self.adjacency_slot_sell = entries[:, 3].copy()
+        self.adjacency_slot_buy = entries[:, 4].copy()
+
+    def _venue_views(self):
+        """
+        Returns the venues of the market as views over the reserve arrays, created when they are read.
+        """
+        return venue_views(self.venue_names, self.venue_curves, self.reserve_indptr,
+                           (self.tokens, self.reserve_tokens, self.reserves, self.raw_whole, self.raw_fraction))
 
     def generate_graph(self):
         """
-        Generates the market graph from the market venues and token pairs
+        Generates the networkx market graph from the compact arrays
 
         This method performs the following steps:
         1. Iterates over the venues to add tokens as nodes in the graph.
@@ -53,34 +210,341 @@ class market:
            with additional venue information -- multigraph
         4. If an edge does not exist, it creates a new edge with the venue's name and
            reserve information as attributes.
+
+        Returns:
+        --------
+        networkx.Graph
+            The market graph, also stored for the following requests.
         """
+        import networkx as nx
+
+        graph = nx.Graph()
+
         # Create nodes with the tokens
-        for venue in self.venues:
-            for token, amount in venue.reserves.items():
-                if token not in self.graph:
-                    self.graph.add_node(token)
+        graph.add_nodes_from(self.tokens)
 
         # Create edges with the venues in the market
-        for venue in self.venues:
-            tokens = list(venue.reserves.keys())
-            for i in range(len(tokens)):
-                for j in range(i + 1, len(tokens)):
-                    token1 = tokens[i]
-                    token2 = tokens[j]
+        for venue_id, venue_name in enumerate(self.venue_names):
+            first_slot, last_slot = self.reserve_indptr[venue_id], self.reserve_indptr[venue_id + 1]
+            for slot1 in range(first_slot, last_slot):
+                for slot2 in range(slot1 + 1, last_slot):
+                    token1 = self.tokens[self.reserve_tokens[slot1]]
+                    token2 = self.tokens[self.reserve_tokens[slot2]]
                     # Check if edge exists already
-                    if self.graph.has_edge(token1, token2):
+                    if graph.has_edge(token1, token2):
                         # If edge already exists, update the 'venues' attribute - multigraph
-                        self.graph[token1][token2]['venues'].append(venue.name)
-                        self.graph[token1][token2]['tokens'].append([token1,token2])
-                        self.graph[token1][token2]['liquidity_token1'].append(venue.reserves[token1])
-                        self.graph[token1][token2]['liquidity_token2'].append(venue.reserves[token2])
+                        graph[token1][token2]['venues'].append(venue_name)
+                        graph[token1][token2]['tokens'].append([token1,token2])
+                        graph[token1][token2]['liquidity_token1'].append(self.reserves[slot1])
+                        graph[token1][token2]['liquidity_token2'].append(self.reserves[slot2])
                     else:
                         # Otherwise, add a new edge with venue name as attribute
-                        self.graph.add_edge(token1, token2,
-                                            venues=[venue.name],
-                                            tokens=[[token1, token2]],
-                                            liquidity_token1=[venue.reserves[token1]],
-                                            liquidity_token2=[venue.reserves[token2]])
+                        graph.add_edge(token1, token2,
+                                       venues=[venue_name],
+                                       tokens=[[token1, token2]],
+                                       liquidity_token1=[self.reserves[slot1]],
+                                       liquidity_token2=[self.reserves[slot2]])
+        self._graph = graph
+        return graph
+
+    def add_venue(self, venue):
+        """
+        Adds a venue to the market, updating the arrays and invalidating the path index.
+
+        Parameters:
+        -----------
+        venue : venue
+            The venue instance to add.
+        """
+        self.add_venues([venue])
+
+    def add_venues(self, venues):
+        """
+        Adds several venues to the market, updating the arrays and invalidating the path index
+        only once.
+
+        Parameters:
+        -----------
+        venues : list
+            The venue instances to add.
+        """
+        self.venues = list(self.venues) + list(venues)
+        self._topology_changed()
+
+    def remove_venue(self, venue_name):
+        """
+        Removes a venue from the market, updating the arrays and invalidating the path index.
+
+        Parameters:
+        -----------
+        venue_name : str
+            The name of the venue to remove.
+        """
+        self.venues = [venue for venue in self.venues if venue.name != venue_name]
+        self._topology_changed()
+
+    def apply_reserve_updates(self, updates, raw=False):
+        """
+        Updates the reserves of the venues in place, without regenerating the market.
+        Each update costs O(1): the reserve slot is found with reserve_slot(), and the reserve
+        arrays, read by the venue views, and, if already generated, the liquidities stored
+        in the edges of the networkx graph are updated. The path index stays valid.
+        The batch is atomic: all the slots are resolved and all the amounts parsed before any
+        reserve is written, so an invalid update leaves the market and reserve_version untouched.
+
+        Parameters:
+        -----------
+        updates : list
+            A list of (venue_name, token, new_amount) tuples. new_amount is either a number
+            or a string in the underscore format of the JSON files (e.g. "10000_000000000000000000").
+        raw : bool, optional
+            The new amounts are exact integers of 10^-18 units. Default is False.
+
+        Returns:
+        --------
+        set
+            The names of the venues whose reserves changed.
+
+        Raises:
+        -------
+        KeyError
+            If a venue does not exist or does not hold the token.
+        ValueError
+            If an amount cannot be parsed.
+        """
+        # Resolve the slots and parse the amounts of the whole batch before writing any of them
+        resolved = {}
+        for venue_name, token, new_amount in updates:
+            raw_amount = int(new_amount) if raw else to_raw(new_amount)
+            resolved[self.reserve_slot(venue_name, token)] = (venue_name, token, raw_amount)
+        slots = np.fromiter(resolved, dtype=np.int64, count=len(resolved))
+        raw_amounts = [raw_amount for _, _, raw_amount in resolved.values()]
+        raw_whole = np.array([raw_amount // SCALE for raw_amount in raw_amounts], dtype=np.int64)
+        raw_fraction = np.array([raw_amount % SCALE for raw_amount in raw_amounts], dtype=np.int64)
+        reserves = np.array([to_float(raw_amount) for raw_amount in raw_amounts], dtype=float)
+
+        self.reserves[slots] = reserves
+        self.raw_whole[slots] = raw_whole
+        self.raw_fraction[slots] = raw_fraction
+        if self._graph is not None:
+            for (venue_name, token, _), new_amount in zip(resolved.values(), reserves):
+                self._update_graph_liquidity(venue_name, token, float(new_amount))
+        self.reserve_version += 1
+        return {venue_name for venue_name, _, _ in resolved.values()}
+
+    def snapshot(self):
+        """
+        Returns an immutable snapshot of the market, which agents can read concurrently
+        while the market keeps being updated. Only the reserves are copied, the topology
+        is shared with the market.
+
+        Returns:
+        --------
+        market_snapshot
+            The snapshot of the current state of the market.
+        """
+        from .market_snapshot import market_snapshot
+        return market_snapshot(self)
+
+    def reserve_slot(self, venue_name, token):
+        """
+        Returns the reserve slot of a token in a venue, by binary search over the token ids of
+        the slots of the venue.
+
+        Parameters:
+        -----------
+        venue_name : str
+            The name of the venue.
+        token : str
+            The token.
+
+        Returns:
+        --------
+        int
+            The reserve slot.
+
+        Raises:
+        -------
+        KeyError
+            If the venue does not exist or does not hold the token.
+        """
+        venue_id = self.venue_index[venue_name]
+        first_slot, last_slot = int(self.reserve_indptr[venue_id]), int(self.reserve_indptr[venue_id + 1])
+        if token in self.token_index:
+            token_id = self.token_index[token]
+            slot = first_slot + int(np.searchsorted(self.reserve_tokens[first_slot:last_slot], token_id))
+            if slot < last_slot and self.reserve_tokens[slot] == token_id:
+                return slot
+        raise KeyError((venue_name, token))
+
+    def raw_reserve(self, slot):
+        """
+        Returns the exact liquidity of a reserve slot.
+
+        Parameters:
+        -----------
+        slot : int
+            The reserve slot.
+
+        Returns:
+        --------
+        int
+            The liquidity in 10^-18 units.
+        """
+        return int(self.raw_whole[slot]) * SCALE + int(self.raw_fraction[slot])
+
+    def _update_graph_liquidity(self, venue_name, token, new_amount):
+        """
+        Updates the liquidity of a token of a venue in the edges of the networkx graph.
+        """
+        venue_id = self.venue_index[venue_name]
+        for slot in range(self.reserve_indptr[venue_id], self.reserve_indptr[venue_id + 1]):
+            other_token = self.tokens[self.reserve_tokens[slot]]
+            if other_token == token:
+                continue
+            edge_data = self._graph[token][other_token]
+            ven_indx = edge_data['venues'].index(venue_name)
+            token_number = edge_data['tokens'][ven_indx].index(token) + 1
+            edge_data['liquidity_token' + str(token_number)][ven_indx] = new_amount
+
+    def _topology_changed(self):
+        """
+        Regenerates the arrays and invalidates the path index and the networkx graph.
+        Reserve changes do not change the paths and keep the index valid.
+        """
+        self.generate_arrays()
+        self.topology_version += 1
+        self._path_index = {}
+        self._graph = None
+
+    def pools_between(self, sell_token, buy_token):
+        """
+        Returns the venues where sell_token can be swapped for buy_token, with the reserve
+        slots of the two tokens in each venue. The liquidities are self.reserves[slot].
+
+        Parameters:
+        -----------
+        sell_token : str
+            The token sold to the venues.
+        buy_token : str
+            The token bought from the venues.
+
+        Returns:
+        --------
+        list
+            A list of (venue_name, slot_sell_token, slot_buy_token) tuples, empty if there is no such venue.
+        """
+        if sell_token not in self.token_index or buy_token not in self.token_index:
+            return []
+        token1 = self.token_index[sell_token]
+        token2 = self.token_index[buy_token]
+        first, last = self.adjacency_indptr[token1], self.adjacency_indptr[token1 + 1]
+        row = self.adjacency_tokens[first:last]
+        start = first + np.searchsorted(row, token2, side='left')
+        stop = first + np.searchsorted(row, token2, side='right')
+        return [(self.venue_names[self.adjacency_venues[entry]], int(self.adjacency_slot_sell[entry]),
+                 int(self.adjacency_slot_buy[entry])) for entry in range(start, stop)]
+
+    def curve_pair(self, venue_name, sell_token, buy_token):
+        """
+        Returns the curve of a venue in the direction selling sell_token for buy_token, with the
+        parameters of the pair resolved once and memoized until the venues change. It is the
+        price_function of the edges of the strategies, see curves.curve_pair.
+
+        Parameters:
+        -----------
+        venue_name : str
+            The name of the venue.
+        sell_token : str
+            The token sold to the venue.
+        buy_token : str
+            The token bought from the venue.
+
+        Returns:
+        --------
+        curve_pair
+            The curve of the venue in this direction.
+        """
+        key = (venue_name, sell_token, buy_token)
+        pair = self._curve_pairs.get(key)
+        if pair is None:
+            pair = self.venue_curves[self.venue_index[venue_name]].pair(sell_token, buy_token)
+            self._curve_pairs[key] = pair
+        return pair
+
+    def find_paths(self, sell_token, buy_token, max_hops=None):
+        """
+        Returns the simple paths connecting sell_token with buy_token visiting at most max_hops
+        venues. The paths are computed lazily, the first time a pair is requested, with a
+        depth first search over the CSR adjacency, and memoized in the path index until
+        venues are added or removed.
+
+        Note:
+            - Paths connecting token A to B are a list of token names e.g. [A, C, D, B]
+
+        Parameters:
+        -----------
+        sell_token : str
+            The token sold, first node of the paths.
+        buy_token : str
+            The token bought, last node of the paths.
+        max_hops : int, optional
+            The maximum number of venues visited by a path. Default is self.max_hops.
+
+        Returns:
+        --------
+        list
+            The list of paths, empty if the tokens are not connected.
+        """
+        if max_hops is None:
+            max_hops = self.max_hops
+        key = (sell_token, buy_token, max_hops)
+        if key not in self._path_index:
+            self._path_index[key] = self._search_paths(sell_token, buy_token, max_hops)
+        return self._path_index[key]
+
+    def _search_paths(self, sell_token, buy_token, max_hops):
+        """
+        Depth first enumeration of the simple paths between two tokens over the CSR adjacency.
+        """
+        if sell_token not in self.token_index or buy_token not in self.token_index or sell_token == buy_token:
+            return []
+        source = self.token_index[sell_token]
+        target = self.token_index[buy_token]
+        if max_hops is None:
+            max_hops = len(self.tokens)
+
+        paths = []
+        path = [source]
+        on_path = {source}
+        # Each stack level holds the distinct neighbours still to visit from the last token of the path
+        stack = [iter(self._neighbours(source))]
+        while stack:
+            neighbour = next(stack[-1], None)
+            if neighbour is None:
+                stack.pop()
+                on_path.discard(path.pop())
+                continue
+            if neighbour in on_path:
+                continue
+            if neighbour == target:
+                paths.append([self.tokens[token] for token in path] + [buy_token])
+            elif len(path) < max_hops:
+                path.append(neighbour)
+                on_path.add(neighbour)
+                stack.append(iter(self._neighbours(neighbour)))
+        return paths
+
+    def _neighbours(self, token):
+        """
+        Returns the distinct neighbour token ids of a token id.
+        """
+        row = self.adjacency_tokens[self.adjacency_indptr[token]:self.adjacency_indptr[token + 1]]
+        if len(row) == 0:
+            return []
+        distinct = np.ones(len(row), dtype=bool)
+        distinct[1:] = row[1:] != row[:-1]
+        return row[distinct].tolist()
         
 
     def plot_graph(self, file=None, verbose=False):
@@ -94,6 +558,9 @@ class market:
         verbose : bool, optional
           If True, prints details about the graph nodes and edges. Default is False.
         """
+        import networkx as nx
+        from matplotlib import pyplot as plt
+
         pos = nx.spring_layout(self.graph)  # positions for all nodes
         plt.figure(figsize=(10, 8))
     
@@ -124,7 +591,7 @@ class market:
                 print(edge)
 
     @staticmethod
-    def price_function(coin_amount, liquidity_sell_token, liquidity_buy_token, market_type='constant_product', what_='buy'):
+    def price_function(coin_amount, liquidity_sell_token, liquidity_buy_token, market_type='constant_product', what_='buy', exact=False):
         """
         Calculate the amount of tokens bought in a specific liquidity pool given the sell amount, the type of
         Automated Market Maker (AMM) of the pool, and the initial liquidities of the buy and sell tokens.
@@ -133,7 +600,12 @@ class market:
             - The formula for bought b tokens of Bgiven the amount a of A tokens sold is
               b = [B]a/([A] + a), where [A], [B] are the liquidities of tokens A and B
               respectively.
-            - We are not considering any fee for the liquidity providers
+            - We are not considering any fee for the liquidity providers. The other market types are
+              evaluated with the fee-less curves of the registry (see curves.py); the strategies use the
+              curve declared by each venue instead, resolved once (curve_pair()).
+            - In exact mode the amounts and liquidities are integers of 10^-18 units and the
+              result is rounded in favour of the pool, as on-chain AMMs do: the amount bought
+              is rounded down, the amount to sell for a given amount bought is rounded up.
 
         Parameters
         ----------
@@ -147,15 +619,18 @@ class market:
             The type of AMM mechanism used by the liquidity pool. Default is 'constant_product'.
             Supported values:
             - 'constant_product': Uses the constant product formula (x * y = k) for price calculation.
+            - 'constant_sum', 'stableswap', 'weighted': the curves of the registry, with their default parameters.
         what_ : str, optional
             The type of operation performed by the AMM
             Supported values:
             - 'buy', 'sell' if AMM either is buying or selling
+        exact : bool, optional
+            Use exact integer arithmetic. Default is False.
 
         Returns
         -------
-        float
-            The calculated amount of buy tokens received for the given sell amount.
+        float or int
+            The calculated amount of buy tokens received for the given sell amount, an integer in exact mode.
 
         Raises
         ------
@@ -163,6 +638,11 @@ class market:
             If an unsupported market type is provided.
         """
         if market_type == 'constant_product':
+            if exact:
+                if what_ == 'buy':
+                    return (liquidity_buy_token * coin_amount) // (liquidity_sell_token + coin_amount)
+                if what_ == 'sell':
+                    return -((-liquidity_sell_token * coin_amount) // (liquidity_buy_token - coin_amount))
             if what_ == 'buy': 
                 buy_amount = liquidity_buy_token * (coin_amount/ (liquidity_sell_token + coin_amount))
                 return buy_amount
@@ -170,5 +650,38 @@ class market:
                 sell_amount = -liquidity_sell_token * (-coin_amount / (liquidity_buy_token - coin_amount))
                 return sell_amount
         else:
-            raise ValueError(f"Unsupported market type: {market_type}")
+            return make_curve(market_type).pair(None, None)(coin_amount, liquidity_sell_token, liquidity_buy_token,
+                                                             what_=what_, exact=exact)
+
+
+    @staticmethod
+    def virtual_pool(liquidity_sell_tokens, liquidity_buy_tokens):
+        """
+        Collapse a chain of constant product liquidity pools, visited one after the other, into
+        the equivalent virtual constant product pool (R_in, R_out).
 
+        Note:
+            - Composing b1 = [B1]a/([A1] + a) with b2 = [B2]b1/([A2] + b1) gives again
+              b2 = R_out a/(R_in + a), with R_in = [A1][A2]/([A2] + [B1]) and
+              R_out = [B1][B2]/([A2] + [B1]). Folding hop by hop, every path is exactly one pool.
+            - We are not considering any fee for the liquidity providers
+
+        Parameters
+        ----------
+        liquidity_sell_tokens : list
+            The liquidities of the sell token of each pool, in the order the pools are visited.
+        liquidity_buy_tokens : list
+            The liquidities of the buy token of each pool, in the order the pools are visited.
+
+        Returns
+        -------
+        tuple
+            The liquidities (R_in, R_out) of the equivalent virtual pool.
+        """
+        reserve_in = liquidity_sell_tokens[0]
+        reserve_out = liquidity_buy_tokens[0]
+        for liquidity_sell_token, liquidity_buy_token in zip(liquidity_sell_tokens[1:], liquidity_buy_tokens[1:]):
+            denominator = liquidity_sell_token + reserve_out
+            reserve_in = reserve_in * liquidity_sell_token / denominator
+            reserve_out = reserve_out * liquidity_buy_token / denominator
+        return reserve_in, reserve_out
@@ -0,0 +1,66 @@
+from .market import market
+
+class market_snapshot(market):
+    """
+    A class to represent an immutable, versioned view of a market.
+
+    The snapshot shares the topology of the market it was taken from (interned tokens and
+    venues, CSR reserve slots and adjacency, and path index), which is never modified in place,
+    and owns a read-only copy of the reserves. Later reserve updates, or venues added to
+    or removed from the market, do not affect the snapshot, so any number of agents can
+    read it concurrently. The trades of each agent are kept in a private overlay of the
+    agent and written back to the market with agent.commit().
+
+    Attributes:
+    -----------
+    source : market
+        The market the snapshot was taken from, where the trades are committed.
+    version : tuple
+        The (topology_version, reserve_version) of the market when the snapshot was taken.
+    venues : venue_views
+        The venues, a sequence of views over the reserves of the snapshot.
+    reserves : np.ndarray
+        The read-only liquidity of each reserve slot.
+    raw_whole, raw_fraction : np.ndarray
+        The read-only exact liquidity of each reserve slot, see market.raw_reserve().
+
+    Methods:
+    --------
+    add_venue(venue), add_venues(venues), remove_venue(venue_name), apply_reserve_updates(updates):
+        Raise a TypeError, a snapshot cannot be modified.
+    """
+
+    def __init__(self, Market):
+        """
+        Takes a snapshot of a market.
+
+        Parameters:
+        -----------
+        Market : market
+            The market to take the snapshot of.
+        """
+        # Share the topology: the market replaces these attributes, it never modifies them in place
+        self.__dict__.update(Market.__dict__)
+        self.source = Market
+        self.version = (Market.topology_version, Market.reserve_version)
+        self.reserves = Market.reserves.copy()
+        self.reserves.setflags(write=False)
+        self.raw_whole = Market.raw_whole.copy()
+        self.raw_whole.setflags(write=False)
+        self.raw_fraction = Market.raw_fraction.copy()
+        self.raw_fraction.setflags(write=False)
+        self.venues = self._venue_views()
+        # The networkx graph stores liquidities, it is generated again from the snapshot reserves
+        self._graph = None
+
+    def add_venue(self, venue):
+        raise TypeError("A market snapshot cannot be modified, add the venue to the market instead.")
+
+    def add_venues(self, venues):
+        raise TypeError("A market snapshot cannot be modified, add the venues to the market instead.")
+
+    def remove_venue(self, venue_name):
+        raise TypeError("A market snapshot cannot be modified, remove the venue from the market instead.")
+
+    def apply_reserve_updates(self, updates):
+        raise TypeError("A market snapshot cannot be modified, commit the trades to the market instead.")
@@ -1,6 +1,7 @@
 import json
 import numpy as np
 import copy
+from .amount import parse_amount, format_amount, to_float
 
 class order:
     """
@@ -14,17 +15,26 @@ class order:
         The token being sold in the order.
     buy_token : str
         The token being bought in the order.
-    limit_sell_amount : str
+    limit_sell_amount : float
         The maximum amount of the sell_token to sell.
-    limit_buy_amount : str
+    limit_buy_amount : float
         The minimum amount of the buy_token to buy.
     partial_fill : bool
         Whether partial filling of the order is allowed.
+    ex_sell_amount : float
+        The executed amount of the sell_token.
+    ex_buy_amount : float
+        The executed amount of the buy_token.
+    raw_limit_sell_amount, raw_limit_buy_amount, raw_ex_sell_amount, raw_ex_buy_amount : int
+        The exact amounts, as integers of 10^-18 units (see amount.py). The float amounts are
+        views of the exact ones: assigning a float, or a string in the underscore format,
+        to them sets the exact amount.
 
     Methods:
     --------
     from_json(order_number, data):
-        Creates an order instance from JSON data.
+        Creates an order instance from JSON data, either in the order schema or in the intent
+        schema of the batch files.
     print_info():
         Prints the order information in a JSON-like formatted string.
     """
@@ -33,17 +43,54 @@ class order:
         self.order_number = order_number
         self.sell_token = sell_token
         self.buy_token = buy_token
-        self.limit_sell_amount = np.float64(limit_sell_amount.replace("_", "."))
-        self.limit_buy_amount =  np.float64(limit_buy_amount.replace("_", "."))
+        self.limit_sell_amount = limit_sell_amount
+        self.limit_buy_amount =  limit_buy_amount
         self.partial_fill = partial_fill
         self.ex_sell_amount = ex_sell_amount
         self.ex_buy_amount = ex_buy_amount
 
+    @property
+    def limit_sell_amount(self):
+        return to_float(self.raw_limit_sell_amount)
+
+    @limit_sell_amount.setter
+    def limit_sell_amount(self, amount):
+        self.raw_limit_sell_amount = parse_amount(amount)
+
+    @property
+    def limit_buy_amount(self):
+        return to_float(self.raw_limit_buy_amount)
+
+    @limit_buy_amount.setter
+    def limit_buy_amount(self, amount):
+        self.raw_limit_buy_amount = parse_amount(amount)
+
+    @property
+    def ex_sell_amount(self):
+        return to_float(self.raw_ex_sell_amount)
+
+    @ex_sell_amount.setter
+    def ex_sell_amount(self, amount):
+        self.raw_ex_sell_amount = parse_amount(amount)
+
+    @property
+    def ex_buy_amount(self):
+        return to_float(self.raw_ex_buy_amount)
+
+    @ex_buy_amount.setter
+    def ex_buy_amount(self, amount):
+        self.raw_ex_buy_amount = parse_amount(amount)
+
     @staticmethod
     def from_json(order_number, data):
         """
         Constructs all the necessary attributes for the order object.
 
+        Note:
+            - Intents in the batch files use a different schema: 'source_token', 'destination_token',
+              'source_amount' and 'min_receive_amount' are read as sell_token, buy_token,
+              limit_sell_amount and limit_buy_amount respectively. Their amounts can be plain numbers.
+
         Parameters:
         -----------
         order_number : str
@@ -71,12 +118,12 @@ class order:
             Order.buy_token = None
 
         if 'limit_sell_amount' in data:
-            Order.limit_sell_amount = np.float64(data['limit_sell_amount'].replace("_", "."))
+            Order.limit_sell_amount = data['limit_sell_amount']
         else:
             Order.limit_sell_amount = 0.0
 
         if 'limit_buy_amount' in data:
-            Order.limit_buy_amount = np.float64(data['limit_buy_amount'].replace("_", "."))
+            Order.limit_buy_amount = data['limit_buy_amount']
         else:
             Order.limit_buy_amount = 0.0
 
@@ -86,18 +133,31 @@ class order:
             Order.partial_fill = False
 
         if 'sell_amount' in data:
-            Order.limit_sell_amount = np.float64(data['sell_amount'].replace("_","."))
+            Order.limit_sell_amount = data['sell_amount']
 
         if 'buy_amount' in data:
-            Order.limit_buy_amount = np.float64(data['buy_amount'].replace("_","."))
+            Order.limit_buy_amount = data['buy_amount']
+
+        # Intent schema of the batch files
+        if 'source_token' in data:
+            Order.sell_token = data['source_token']
+
+        if 'destination_token' in data:
+            Order.buy_token = data['destination_token']
+
+        if 'source_amount' in data:
+            Order.limit_sell_amount = data['source_amount']
+
+        if 'min_receive_amount' in data:
+            Order.limit_buy_amount = data['min_receive_amount']
 
         if 'ex_sell_amount' in data:
-            Order.ex_sell_amount = np.float64(data['ex_sell_amount'].replace("_","."))
+            Order.ex_sell_amount = data['ex_sell_amount']
         else:
             Order.ex_sell_amount = 0.0
 
         if 'ex_buy_amount' in data:
-            Order.ex_buy_amount = np.float64(data['ex_buy_amount'].replace("_","."))
+            Order.ex_buy_amount = data['ex_buy_amount']
         else:
             Order.ex_buy_amount = 0.0
 
@@ -113,13 +173,13 @@ class order:
         file : str, optional
             The file path where the output should be written. If None, prints to console.
         """
-        if self.ex_sell_amount == 0.0:
+        if self.raw_ex_sell_amount == 0:
             order_data = {
                 self.order_number: {
                     "sell_token": self.sell_token,
                     "buy_token": self.buy_token,
-                    "limit_sell_amount": f"{self.limit_sell_amount:.18f}".replace(".", "_"),
-                    "limit_buy_amount": f"{self.limit_buy_amount:.18f}".replace(".","_"),
+                    "limit_sell_amount": format_amount(self.raw_limit_sell_amount),
+                    "limit_buy_amount": format_amount(self.raw_limit_buy_amount),
                     "partial_fill": self.partial_fill
                 }
             }
@@ -128,11 +188,11 @@ class order:
                 self.order_number: {
                     "sell_token": self.sell_token,
                     "buy_token": self.buy_token,
-                    "limit_sell_amount": f"{self.limit_sell_amount:.18f}".replace(".", "_"),
-                    "limit_buy_amount": f"{self.limit_buy_amount:.18f}".replace(".","_"),
+                    "limit_sell_amount": format_amount(self.raw_limit_sell_amount),
+                    "limit_buy_amount": format_amount(self.raw_limit_buy_amount),
                     "partial_fill": self.partial_fill,
-                    "ex_sell_amount": f"{self.ex_sell_amount:.18f}".replace(".","_"),
-                    "ex_buy_amount":  f"{self.ex_buy_amount:.18f}".replace(".","_")
+                    "ex_sell_amount": format_amount(self.raw_ex_sell_amount),
+                    "ex_buy_amount":  format_amount(self.raw_ex_buy_amount)
                 }
             }
 
@@ -0,0 +1,275 @@
+import os
+import json
+from .venue import venue
+from .market import market
+from .agent import agent
+from .amount import format_amount, to_float
+
+def _solve_group(venues_slice, max_hops, orders, commit, verbose):
+    """
+    Solves a group of orders one after the other against a slice of the market, in a worker process.
+
+    Parameters:
+    -----------
+    venues_slice : list
+        The (venue_name, raw_reserves, curve) of the venues reached by the orders of the group.
+    max_hops : int
+        The maximum number of venues visited by a path, as in the market of the scheduler.
+    orders : list
+        The order instances of the group, in the order they are solved.
+    commit : bool
+        Applies the trades of each order to the reserves of the slice before solving the next one.
+    verbose : bool
+        Prints additional information.
+
+    Returns:
+    --------
+    tuple
+        The results of the orders, in the format of agent.results() with the 'status' and the
+        'message' of the solver, their exact trades (agent.trades), and the final raw reserves
+        of the venues of the slice.
+    """
+    Market = market([venue(venue_name, {token: to_float(amount) for token, amount in raw_reserves.items()}, raw_reserves, curve)
+                     for venue_name, raw_reserves, curve in venues_slice], max_hops=max_hops)
+    results = []
+    trades = []
+    for Order in orders:
+        Agent = agent()
+        Agent.read_order(Order)
+        if not Market.find_paths(Order.sell_token, Order.buy_token):
+            Agent.venues = Market.venues
+            result = Agent.results()
+            result['status'] = None
+            result['message'] = f"No paths found from {Order.sell_token} to {Order.buy_token}"
+            results.append(result)
+            trades.append({})
+            continue
+        Agent.read_market(Market, verbose=verbose)
+        Agent.optimize_strategy(verbose=verbose)
+        if commit:
+            Agent.commit()
+        result = Agent.results()
+        result['status'] = int(Agent.result.status)
+        result['message'] = str(Agent.result.message)
+        results.append(result)
+        trades.append(Agent.trades)
+    reserves = [(Venue.name, dict(Venue.raw_reserves)) for Venue in Market.venues]
+    return results, trades, reserves
+
+class parallel_scheduler:
+    """
+    A class to solve many orders in parallel, in a pool of worker processes.
+
+    Orders whose routes visit disjoint sets of venues do not interact, even when their trades
+    are committed one after the other. The orders are therefore partitioned into independent
+    groups, the connected components of the orders sharing a venue, and each group is solved
+    in a worker. A worker only receives the exact reserves and the curves of the venues its orders
+    can reach, not the market and its graph, and solves the orders of the group in their original order,
+    so the results are the same as solving all the orders one after the other in one process.
+    The results and the reserve updates are merged back in the order of the orders.
+
+    Attributes:
+    -----------
+    orders : list
+        A list containing order instances, in the order they would be solved serially.
+    market : market
+        The market the orders are solved against. Its reserves are updated by solve() if commit is True.
+    workers : int
+        The number of worker processes.
+    commit : bool
+        Applies the trades of each order to the reserves before solving the next ones.
+    groups : list
+        The independent groups, lists of indices in `orders`, sorted by their first order.
+    order_results : list
+        The result of each order, in the format of agent.results() with the 'status' and the
+        'message' of the solver.
+    venue_trades : dict
+        The exact amounts exchanged in each venue, keyed by (venue, sell_token, buy_token) where
+        sell_token is the token sold by the venue.
+
+    Methods:
+    --------
+    partition():
+        Partitions the orders into independent groups.
+    solve(verbose=False):
+        Solves the groups in the worker processes and merges their results.
+    results():
+        Returns the result of all the orders in the format of agent.print_results().
+    print_results(file=None):
+        Prints the result of all the orders, either to the console or to a specified file.
+    """
+
+    def __init__(self, orders, Market, workers=None, commit=True):
+        """
+        Constructs all the necessary attributes for the parallel_scheduler object.
+
+        Parameters:
+        -----------
+        orders : list
+            A list containing order instances.
+        Market : market
+            The market the orders are solved against.
+        workers : int, optional
+            The number of worker processes. Default is the number of CPUs.
+        commit : bool, optional
+            Applies the trades of each order to the reserves of the market. Default is True.
+        """
+        self.orders = orders
+        self.market = Market
+        self.workers = workers or os.cpu_count() or 1
+        self.commit = commit
+        self.groups = None
+        self.order_results = None
+        self.venue_trades = None
+
+    def _reached_venues(self, Order):
+        """
+        Returns the ids of the venues visited by the paths of an order.
+        """
+        venue_ids = set()
+        for path in self.market.find_paths(Order.sell_token, Order.buy_token):
+            for i in range(len(path) - 1):
+                for venue_name, _, _ in self.market.pools_between(path[i], path[i + 1]):
+                    venue_ids.add(self.market.venue_index[venue_name])
+        return venue_ids
+
+    def partition(self):
+        """
+        Partitions the orders into independent groups: two orders are in the same group if
+        their paths visit a common venue, directly or through other orders of the group.
+
+        Returns:
+        --------
+        list
+            The groups, lists of indices in `orders` in increasing order, sorted by their first order.
+        """
+        # Union-find over the orders, joined through the first order reaching each venue
+        parent = list(range(len(self.orders)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        self._venues = []
+        owner = {}
+        for i, Order in enumerate(self.orders):
+            venue_ids = self._reached_venues(Order)
+            self._venues.append(venue_ids)
+            for venue_id in venue_ids:
+                if venue_id in owner:
+                    root1, root2 = find(i), find(owner[venue_id])
+                    if root1 != root2:
+                        parent[max(root1, root2)] = min(root1, root2)
+                else:
+                    owner[venue_id] = i
+
+        groups = {}
+        for i in range(len(self.orders)):
+            groups.setdefault(find(i), []).append(i)
+        self.groups = [groups[root] for root in sorted(groups)]
+        return self.groups
+
+    def _market_slice(self, group):
+        """
+        Returns the exact reserves and the curves of the venues reached by a group, in the order of the market.
+        """
+        venue_ids = sorted(set().union(*(self._venues[i] for i in group)))
+        return [(self.market.venue_names[venue_id], dict(self.market.venues[venue_id].raw_reserves),
+                 self.market.venue_curves[venue_id]) for venue_id in venue_ids]
+
+    def solve(self, verbose=False):
+        """
+        Solves the orders.
+
+        This method performs the following steps:
+        1. Partitions the orders into independent groups (partition()).
+        2. Sends each group, with the slice of the market it reaches, to a worker process.
+           With one worker, or one group, the groups are solved in this process.
+        3. Merges the results of the groups in the order of the orders and, if commit is True,
+           applies the final reserves of each slice to the market.
+
+        Parameters:
+        -----------
+        verbose : bool, optional
+            Prints additional information. Default is False.
+        """
+        groups = self.partition()
+        tasks = [(self._market_slice(group), self.market.max_hops, [self.orders[i] for i in group], self.commit, verbose)
+                 for group in groups]
+        if verbose:
+            print(f"{len(self.orders)} orders in {len(groups)} independent groups, {self.workers} workers.")
+
+        if self.workers == 1 or len(tasks) <= 1:
+            outputs = [_solve_group(*task) for task in tasks]
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(tasks))) as executor:
+                outputs = list(executor.map(_solve_group, *zip(*tasks)))
+
+        self.order_results = [None] * len(self.orders)
+        self.venue_trades = {}
+        updates = []
+        for group, (results, trades, reserves) in zip(groups, outputs):
+            for i, result, order_trades in zip(group, results, trades):
+                self.order_results[i] = result
+                for venue_name, trade in order_trades.items():
+                    key = (venue_name, trade['sell_token'], trade['buy_token'])
+                    total = self.venue_trades.setdefault(key, {'ex_buy_amount': 0, 'ex_sell_amount': 0})
+                    total['ex_buy_amount'] += trade['ex_buy_amount']
+                    total['ex_sell_amount'] += trade['ex_sell_amount']
+            if self.commit:
+                updates.extend((venue_name, token, amount) for venue_name, raw_reserves in reserves
+                               for token, amount in raw_reserves.items()
+                               if amount != self.market.raw_reserve(self.market.reserve_slot(venue_name, token)))
+        if updates:
+            self.market.apply_reserve_updates(updates, raw=True)
+
+    def results(self):
+        """
+        Returns the result of all the orders.
+
+        Returns:
+        --------
+        dict
+            The 'venues' and 'orders' sections, in the format of agent.print_results(), with
+            the 'status' and the 'message' of the solver for each order.
+        """
+        venues_data = {}
+        for (venue_name, sell_token, buy_token), trade in self.venue_trades.items():
+            name = venue_name if venue_name not in venues_data else f"{venue_name}:{buy_token}->{sell_token}"
+            venues_data[name] = {
+                "sell_token": sell_token,
+                "buy_token": buy_token,
+                "ex_buy_amount":  format_amount(trade['ex_buy_amount']),
+                "ex_sell_amount": format_amount(trade['ex_sell_amount']),
+            }
+
+        orders_data = {}
+        for result in self.order_results:
+            for order_number, order_data in result['orders'].items():
+                orders_data[order_number] = dict(order_data, status=result['status'], message=result['message'])
+
+        return {
+            "venues": venues_data,
+            "orders": orders_data
+        }
+
+    def print_results(self, file=None):
+        """
+        Prints the result of all the orders
+
+        Parameters:
+        -----------
+        file : str, optional
+            The file path where the output should be written. If None, the output is printed to the console.
+        """
+        output = json.dumps(self.results(), indent=4)
+
+        if file:
+            with open(file, 'w') as f:
+                f.write(output)
+        else:
+            print(output)
@@ -0,0 +1,283 @@
+import copy
+import numpy as np
+
+class path_engine:
+    """
+    A class to represent a compiled evaluation engine for the paths of a strategy.
+    Each path (a list of edges of the strategy graph) whose venues are all constant product
+    venues is a chain of constant product swaps, which is exactly one virtual constant product
+    pool (R_in, R_out), the fee of a venue scaling its sell reserve by 1/(1 - fee). The engine
+    stores these pairs in arrays, so that all the paths, and many candidate allocations
+    at once, are evaluated in O(1) per path regardless of the number of hops.
+    The paths visiting other curves (see curves.py) are evaluated hop by hop: the curve of each
+    hop is resolved when the engine is compiled, and the hops are grouped by curve, so that each
+    vectorized kernel is called once per hop for all the paths using it.
+    The per-hop liquidities are kept in padded arrays, to evaluate these paths and to recover
+    the amounts exchanged at each hop for reporting and for updating the venues.
+
+    Note:
+        - Paths shorter than the longest one are padded with dummy hops. The padded
+          hops are masked out and leave the propagated amount untouched.
+        - The virtual pool of a path visiting other curves is not equivalent to the path: it is
+          (1, marginal rate at zero size), only used to rank the paths.
+
+    Attributes:
+    -----------
+    n_paths : int
+        The number of compiled paths.
+    n_hops : np.ndarray
+        The number of hops (venues) of each path, shape (n_paths,).
+    reserve_in : np.ndarray
+        The sell token liquidity of the virtual pool of each path, shape (n_paths,).
+    reserve_out : np.ndarray
+        The buy token liquidity of the virtual pool of each path, shape (n_paths,).
+    liquidity_sell_token : np.ndarray
+        The liquidity of the token sold at each hop, shape (n_paths, max_hops).
+    liquidity_buy_token : np.ndarray
+        The liquidity of the token bought at each hop, shape (n_paths, max_hops).
+    mask : np.ndarray
+        Boolean array flagging the real (non padded) hops, shape (n_paths, max_hops).
+    slot_sell_token : np.ndarray
+        The reserve slot of the token sold at each hop, shape (n_paths, max_hops).
+    slot_buy_token : np.ndarray
+        The reserve slot of the token bought at each hop, shape (n_paths, max_hops).
+    curves : np.ndarray
+        The curve of each hop (curves.curve_pair), None for the padded hops, shape (n_paths, max_hops).
+    reserve_factor : np.ndarray
+        The factor of the sell liquidity of the equivalent fee-less constant product pool of each hop,
+        1 for the padded hops and the other curves, shape (n_paths, max_hops).
+    constant_product : np.ndarray
+        Boolean array flagging the paths visiting constant product venues only, shape (n_paths,).
+
+    Methods:
+    --------
+    propagate(coins_sell):
+        Propagates the amounts sold along each path and returns the amounts bought.
+    total_bought(coins_sell):
+        Returns the total amount bought via all the paths.
+    gradient(coins_sell):
+        Returns the derivative of the amount bought along each path with respect to the amount sold.
+    with_reserves(reserves):
+        Returns a copy of the engine evaluated with the current reserves of the slots.
+    take(indices):
+        Returns the engine of some of the paths, in the given order.
+    """
+
+    def __init__(self, paths, virtual_pools):
+        """
+        Compiles the paths of a strategy into arrays.
+
+        Parameters:
+        -----------
+        paths : list
+            The list of paths, each one a list of edges of the strategy graph.
+        virtual_pools : list
+            The (R_in, R_out) virtual pool of each path, see market.virtual_pool().
+        """
+        self.n_paths = len(paths)
+        self.n_hops = np.array([len(path) for path in paths], dtype=int)
+        max_hops = int(self.n_hops.max()) if self.n_paths else 0
+
+        self.reserve_in = np.array([pool[0] for pool in virtual_pools], dtype=float)
+        self.reserve_out = np.array([pool[1] for pool in virtual_pools], dtype=float)
+
+        # Padded hops get unit liquidities, so that they never produce nan before being masked
+        self.liquidity_sell_token = np.ones((self.n_paths, max_hops))
+        self.liquidity_buy_token = np.ones((self.n_paths, max_hops))
+        self.mask = np.zeros((self.n_paths, max_hops), dtype=bool)
+        self.slot_sell_token = np.zeros((self.n_paths, max_hops), dtype=int)
+        self.slot_buy_token = np.zeros((self.n_paths, max_hops), dtype=int)
+        self.curves = np.full((self.n_paths, max_hops), None, dtype=object)
+        self.reserve_factor = np.ones((self.n_paths, max_hops))
+        self.constant_product = np.ones(self.n_paths, dtype=bool)
+        for i, path in enumerate(paths):
+            for hop, edge_data in enumerate(path):
+                self.liquidity_sell_token[i, hop] = edge_data['liquidity_sell_token']
+                self.liquidity_buy_token[i, hop] = edge_data['liquidity_buy_token']
+                self.slot_sell_token[i, hop] = edge_data['slot_sell_token']
+                self.slot_buy_token[i, hop] = edge_data['slot_buy_token']
+                self.mask[i, hop] = True
+                # The curve of the hop, resolved once for all the evaluations
+                self.curves[i, hop] = edge_data['price_function']
+                reserve_factor = getattr(edge_data['price_function'], 'reserve_factor', 1.0)
+                if reserve_factor is None:
+                    self.constant_product[i] = False
+                else:
+                    self.reserve_factor[i, hop] = reserve_factor
+        self._group_hops()
+
+    def _group_hops(self):
+        """
+        Groups the hops of the paths visiting other curves by curve type, hop by hop: each group is
+        the kernels of the curve, the positions of the paths among these paths, and the stacked
+        parameters of their hops.
+        """
+        self._curved = np.nonzero(~self.constant_product)[0]
+        self._groups = []
+        for hop in range(self.mask.shape[1]):
+            groups = {}
+            for position, i in enumerate(self._curved):
+                if self.mask[i, hop]:
+                    Curve = self.curves[i, hop].curve
+                    groups.setdefault(type(Curve), []).append((position, self.curves[i, hop].params))
+            self._groups.append([(kernels, np.array([position for position, _ in members], dtype=int),
+                                  tuple(np.array(param, dtype=float) for param in zip(*(params for _, params in members))))
+                                 for kernels, members in groups.items()])
+
+    def _walk(self, coins_sell):
+        """
+        Propagates hop by hop the amounts sold along the paths visiting other curves, shape
+        (..., len(self._curved)), returning the amounts entering each hop and the amount bought.
+        """
+        current_value = np.asarray(coins_sell, dtype=float)
+        amounts = [current_value]
+        for hop, groups in enumerate(self._groups):
+            current_value = current_value.copy()
+            for kernels, positions, params in groups:
+                rows = self._curved[positions]
+                current_value[..., positions] = kernels.buy(amounts[-1][..., positions], self.liquidity_sell_token[rows, hop],
+                                                            self.liquidity_buy_token[rows, hop], *params)
+            amounts.append(current_value)
+        return amounts
+
+    def _curved_pools(self):
+        """
+        Sets the virtual pools of the paths visiting other curves to (1, marginal rate at zero size).
+        """
+        rate = np.ones(len(self._curved))
+        for hop, groups in enumerate(self._groups):
+            for kernels, positions, params in groups:
+                rows = self._curved[positions]
+                rate[positions] *= kernels.derivative(0.0, self.liquidity_sell_token[rows, hop],
+                                                      self.liquidity_buy_token[rows, hop], *params)
+        self.reserve_in[self._curved] = 1.0
+        self.reserve_out[self._curved] = rate
+
+    def propagate(self, coins_sell):
+        """
+        Propagates the amounts of coins sold at the beginning of each path through
+        the virtual pool of the path, outputting the amounts bought at the end of each path.
+
+        Parameters:
+        -----------
+        coins_sell : array_like
+            The amounts sold along each path, shape (n_paths,), or a batch of
+            candidate allocations, shape (n_candidates, n_paths).
+
+        Returns:
+        --------
+        np.ndarray
+            The amounts bought along each path, with the same shape as coins_sell.
+        """
+        coins_sell = np.asarray(coins_sell, dtype=float)
+        # Constant product swap, b = R_out a/(R_in + a), applied to every path at once
+        coins_buy = self.reserve_out * (coins_sell / (self.reserve_in + coins_sell))
+        if len(self._curved):
+            coins_buy[..., self._curved] = self._walk(coins_sell[..., self._curved])[-1]
+        return coins_buy
+
+    def total_bought(self, coins_sell):
+        """
+        Returns the total amount of coins bought via all the paths.
+
+        Parameters:
+        -----------
+        coins_sell : array_like
+            The amounts sold along each path, shape (n_paths,) or (n_candidates, n_paths).
+
+        Returns:
+        --------
+        float or np.ndarray
+            The total amount bought, one value per candidate allocation.
+        """
+        return self.propagate(coins_sell).sum(axis=-1)
+
+    def gradient(self, coins_sell):
+        """
+        Returns the derivative of the amount bought along each path with respect to
+        the amount sold along the same path. Since each path only depends on its own
+        amount sold, this is the diagonal of the Jacobian of propagate().
+
+        Note:
+            - For a constant product pool d/da R_out a/(R_in + a) = R_in R_out/(R_in + a)^2.
+              On the virtual pool this equals the chain rule of the derivatives of the hops.
+            - For the paths visiting other curves the chain rule is applied hop by hop.
+
+        Parameters:
+        -----------
+        coins_sell : array_like
+            The amounts sold along each path, shape (n_paths,) or (n_candidates, n_paths).
+
+        Returns:
+        --------
+        np.ndarray
+            The derivatives along each path, with the same shape as coins_sell.
+        """
+        coins_sell = np.asarray(coins_sell, dtype=float)
+        derivative = self.reserve_in * self.reserve_out / (self.reserve_in + coins_sell)**2
+        if len(self._curved):
+            amounts = self._walk(coins_sell[..., self._curved])
+            chained = np.ones_like(amounts[0])
+            for hop, groups in enumerate(self._groups):
+                for kernels, positions, params in groups:
+                    rows = self._curved[positions]
+                    chained[..., positions] *= kernels.derivative(amounts[hop][..., positions], self.liquidity_sell_token[rows, hop],
+                                                                  self.liquidity_buy_token[rows, hop], *params)
+            derivative[..., self._curved] = chained
+        return derivative
+
+    def with_reserves(self, reserves):
+        """
+        Returns a copy of the engine evaluated with other reserves, read through the reserve
+        slots of the hops, e.g. after reserve updates. The virtual pools of all the paths are
+        folded hop by hop at once, as market.virtual_pool() does for one path, padded hops
+        leaving them untouched. The engine itself is not modified, so it can be shared.
+
+        Parameters:
+        -----------
+        reserves : np.ndarray
+            The liquidity of each reserve slot of the market, e.g. market.reserves.
+
+        Returns:
+        --------
+        path_engine
+            The engine of the same paths with the liquidities of the reserves.
+        """
+        engine = copy.copy(self)
+        engine.liquidity_sell_token = np.where(self.mask, reserves[self.slot_sell_token], 1.0)
+        engine.liquidity_buy_token = np.where(self.mask, reserves[self.slot_buy_token], 1.0)
+        reserve_in = engine.liquidity_sell_token[:, 0] * self.reserve_factor[:, 0]
+        reserve_out = engine.liquidity_buy_token[:, 0]
+        for hop in range(1, self.mask.shape[1]):
+            liquidity_sell = engine.liquidity_sell_token[:, hop] * self.reserve_factor[:, hop]
+            denominator = liquidity_sell + reserve_out
+            reserve_in, reserve_out = (np.where(self.mask[:, hop], reserve_in * liquidity_sell / denominator, reserve_in),
+                                       np.where(self.mask[:, hop], reserve_out * engine.liquidity_buy_token[:, hop] / denominator, reserve_out))
+        engine.reserve_in = np.array(reserve_in, dtype=float)
+        engine.reserve_out = np.array(reserve_out, dtype=float)
+        if len(self._curved):
+            engine._curved_pools()
+        return engine
+
+    def take(self, indices):
+        """
+        Returns the engine of some of the paths, in the given order, without compiling them again.
+
+        Parameters:
+        -----------
+        indices : array_like
+            The indices of the paths to keep.
+
+        Returns:
+        --------
+        path_engine
+            The engine of the selected paths.
+        """
+        indices = np.asarray(indices, dtype=int)
+        engine = copy.copy(self)
+        engine.n_paths = len(indices)
+        for name in ('n_hops', 'reserve_in', 'reserve_out', 'liquidity_sell_token', 'liquidity_buy_token',
+                     'mask', 'slot_sell_token', 'slot_buy_token', 'curves', 'reserve_factor', 'constant_product'):
+            setattr(engine, name, getattr(self, name)[indices])
+        engine._group_hops()
+        return engine
@@ -0,0 +1,288 @@
+import os
+import glob
+import json
+import time
+import itertools
+from collections import OrderedDict
+import numpy as np
+from .order import order
+from .venue import venue
+from .market import market
+from .agent import agent
+from .strategy_cache import strategy_cache
+from .amount import to_float
+
+# State of the process solving the files, kept between the files: the markets of the most
+# recent venue sections and the strategy cache shared by their agents
+_MAX_MARKETS = 8
+_markets = OrderedDict()
+_strategies = strategy_cache()
+
+def results_file(file_path):
+    """
+    Returns the path of the results of an intent file, as written by mev_project_interface.main().
+    """
+    return file_path.split('.json')[0] + '-results.json'
+
+def _market(venues_data):
+    """
+    Returns the market of a venues section, reusing the market of an identical section (same
+    venues, reserves and curves) solved before by this process.
+    """
+    key = json.dumps(venues_data, sort_keys=True)
+    Market = _markets.get(key)
+    if Market is not None:
+        _markets.move_to_end(key)
+        return Market, True
+    Market = market([venue.from_json(venue_name, venue_info['reserves'], venue_info.get('curve'))
+                     for venue_name, venue_info in venues_data.items()])
+    _markets[key] = Market
+    while len(_markets) > _MAX_MARKETS:
+        _markets.popitem(last=False)
+    return Market, False
+
+def _solve_file(file_path, verbose=False):
+    """
+    Solves the order of an intent file, as mev_project_interface.main() without plotting, and
+    writes its results next to it. Runs in a worker process, or in the process of the runner.
+
+    Parameters:
+    -----------
+    file_path : str
+        The path to the JSON file with the order and the venues.
+    verbose : bool, optional
+        Prints additional information. Default is False.
+
+    Returns:
+    --------
+    dict
+        The record of the file in the summary: the 'file', the 'order' number, the 'status' and
+        the 'message' of the solver (the status is None if the tokens are not connected, 'error'
+        if the file could not be solved), the executed amounts and the 'surplus' in buy tokens
+        over the limit price, whether the market was 'reused' and the 'seconds' spent.
+    """
+    start = time.perf_counter()
+    record = {'file': file_path}
+    try:
+        with open(file_path, 'r') as f:
+            data = json.load(f)
+
+        # Only the first order of the file, as mev_project_interface.main()
+        order_number, order_data = next(iter(data['orders'].items()))
+        Order = order.from_json(order_number, order_data)
+        Market, reused = _market(data['venues'])
+
+        Agent = agent(strategy_cache=_strategies)
+        Agent.read_order(Order)
+        if Market.find_paths(Order.sell_token, Order.buy_token):
+            Agent.read_market(Market, verbose=verbose)
+            Agent.optimize_strategy(verbose=verbose)
+            status, message = int(Agent.result.status), str(Agent.result.message)
+        else:
+            Agent.venues = Market.venues
+            status, message = None, f"No paths found from {Order.sell_token} to {Order.buy_token}"
+        Agent.print_results(file=results_file(file_path))
+
+        ex_sell_amount = float(to_float(Agent.order.raw_ex_sell_amount))
+        ex_buy_amount = float(to_float(Agent.order.raw_ex_buy_amount))
+        record.update({
+            'order': order_number,
+            'status': status,
+            'message': message,
+            'ex_sell_amount': ex_sell_amount,
+            'ex_buy_amount': ex_buy_amount,
+            'surplus': ex_buy_amount - ex_sell_amount * Order.limit_buy_amount / Order.limit_sell_amount,
+            'reused': reused
+        })
+    except Exception as error:
+        record.update({'status': 'error', 'message': f"{type(error).__name__}: {error}"})
+    record['seconds'] = time.perf_counter() - start
+    if verbose:
+        print(f"{file_path}: status {record['status']} in {record['seconds']:.3f}s")
+    return record
+
+class replay_runner:
+    """
+    A class to solve a whole directory, or glob, of intent files in one run, e.g. to replay
+    recorded instances, instead of starting an interpreter per file.
+
+    Each file is solved as mev_project_interface.main() solves it, without plotting, and its
+    results are written to <file>-results.json. The files are spread across a pool of worker
+    processes, each solving many files: the interpreter, the imports and the strategy cache
+    are set up once per worker, and a worker reuses the market of the previous files whose
+    venues section is identical, reserves and curves included, instead of building it again.
+    With resume, the files that already have their results are skipped, so an interrupted run
+    can be started again. A summary gathers the status, the surplus and the timing of each file,
+    the records of the skipped files being taken from the summary of the previous run.
+
+    Attributes:
+    -----------
+    patterns : list
+        The directories, whose .json files are solved, and the glob patterns of the files.
+    workers : int
+        The number of worker processes.
+    resume : bool
+        Skips the files that already have their results.
+    summary_file : str
+        The path of the summary, excluded from the files and read by solve() with resume.
+    files : list
+        The intent files found, sorted.
+    records : list
+        The record of each file, see _solve_file(), in the order of files. The skipped files
+        have the record of the previous summary, if any, or the 'skipped' status.
+    solved : int
+        The number of files solved by the last solve(), without error.
+    skipped : int
+        The number of files skipped by the last solve().
+    seconds : float
+        The wall time of the last solve().
+
+    Methods:
+    --------
+    collect():
+        Finds the intent files matching the patterns.
+    solve(verbose=False):
+        Solves the files in the worker processes.
+    summary():
+        Returns the summary of the run.
+    print_summary(file=None):
+        Prints the summary, either to the console or to a specified file.
+    """
+
+    def __init__(self, patterns, workers=None, resume=False, summary_file=None):
+        """
+        Constructs all the necessary attributes for the replay_runner object.
+
+        Parameters:
+        -----------
+        patterns : str or list
+            A directory, whose .json files are solved, or a glob pattern of the files, or a list of them.
+        workers : int, optional
+            The number of worker processes. Default is the number of CPUs.
+        resume : bool, optional
+            Skips the files that already have their results. Default is False.
+        summary_file : str, optional
+            The path of the summary, excluded from the files and read by solve() with resume. Default is None.
+        """
+        self.patterns = [patterns] if isinstance(patterns, str) else list(patterns)
+        self.workers = workers or os.cpu_count() or 1
+        self.resume = resume
+        self.summary_file = summary_file
+        self.files = None
+        self.records = None
+        self.solved = 0
+        self.skipped = 0
+        self.seconds = None
+
+    def collect(self):
+        """
+        Finds the intent files: the .json files of the directories and the files matching the
+        glob patterns, except the results files and the summary.
+
+        Returns:
+        --------
+        list
+            The paths of the files, sorted.
+        """
+        excluded = os.path.abspath(self.summary_file) if self.summary_file else None
+        files = set()
+        for pattern in self.patterns:
+            if os.path.isdir(pattern):
+                pattern = os.path.join(pattern, '*.json')
+            files.update(path for path in glob.glob(pattern)
+                         if os.path.isfile(path) and not path.endswith('-results.json') and os.path.abspath(path) != excluded)
+        self.files = sorted(files)
+        return self.files
+
+    def solve(self, verbose=False):
+        """
+        Solves the files.
+
+        This method performs the following steps:
+        1. Finds the files (collect()) and, with resume, skips those that already have their results
+           and reads the summary of the previous run, if any.
+        2. Sends the files to the worker processes in chunks, the files of a chunk being solved one
+           after the other by the same worker. With one worker, or one file, the files are solved
+           in this process.
+        3. Stores the record of each file in the order of files.
+
+        Parameters:
+        -----------
+        verbose : bool, optional
+            Prints additional information. Default is False.
+        """
+        start = time.perf_counter()
+        files = self.collect()
+        pending = [path for path in files if not (self.resume and os.path.exists(results_file(path)))]
+        self.skipped = len(files) - len(pending)
+        previous = {}
+        if self.resume and self.summary_file and os.path.exists(self.summary_file):
+            with open(self.summary_file, 'r') as f:
+                previous = json.load(f)
+        if verbose:
+            print(f"{len(files)} files, {self.skipped} already solved, {self.workers} workers.")
+
+        if self.workers == 1 or len(pending) <= 1:
+            solved = [_solve_file(path, verbose) for path in pending]
+        else:
+            workers = min(self.workers, len(pending))
+            chunksize = max(1, min(64, len(pending) // (4 * workers)))
+            from concurrent.futures import ProcessPoolExecutor
+
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                solved = list(executor.map(_solve_file, pending, itertools.repeat(verbose), chunksize=chunksize))
+
+        self.solved = sum(1 for record in solved if record['status'] != 'error')
+        records = {record['file']: record for record in solved}
+        previous_records = {record['file']: record for record in previous.get('instances', [])}
+        self.records = [records.get(path) or previous_records.get(path) or {'file': path, 'status': 'skipped'}
+                        for path in files]
+        self.seconds = time.perf_counter() - start
+
+    def summary(self):
+        """
+        Returns the summary of the run.
+
+        Returns:
+        --------
+        dict
+            The number of 'files', of files 'solved' without error by the run and 'skipped', of files
+            that could not be solved ('failed'), the count of each solver status ('statuses'), the 'wall_seconds' of
+            the run, the mean and percentiles of the seconds per file ('seconds') and the record of
+            each file ('instances').
+        """
+        statuses = {}
+        for record in self.records:
+            statuses[str(record['status'])] = statuses.get(str(record['status']), 0) + 1
+        seconds = np.asarray([record['seconds'] for record in self.records if 'seconds' in record], dtype=float)
+        return {
+            'files': len(self.files),
+            'solved': self.solved,
+            'skipped': self.skipped,
+            'failed': sum(1 for record in self.records if record.get('status') == 'error'),
+            'statuses': statuses,
+            'wall_seconds': self.seconds,
+            'seconds': {
+                'mean': float(seconds.mean()),
+                'p50': float(np.percentile(seconds, 50)),
+                'p90': float(np.percentile(seconds, 90)),
+                'max': float(seconds.max())
+            } if seconds.size else {},
+            'instances': self.records
+        }
+
+    def print_summary(self, file=None):
+        """
+        Prints the summary of the run, either to the console or to a specified file.
+
+        Parameters:
+        -----------
+        file : str, optional
+            The file path where the summary should be written. If None, it is printed to the console.
+        """
+        output = json.dumps(self.summary(), indent=4)
+        if file:
+            with open(file, 'w') as f:
+                f.write(output)
+        else:
+            print(output)
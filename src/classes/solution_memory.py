@@ -0,0 +1,178 @@
+import threading
+from collections import OrderedDict
+
+class solution_memory:
+    """
+    A class to remember the last optimal allocation of the most recent token pairs, so that the
+    next order on a pair starts SLSQP from it instead of from zero, the corner where the buy
+    constraint is violated. Consecutive orders on a pair after small reserve changes usually
+    land very close to the previous optimum.
+
+    The memory is a bounded LRU keyed by (sell_token, buy_token). An entry holds the share of the
+    limit sell amount sold along each route, keyed by the venues and tokens of the route, so it
+    is independent of the order of the routes in the strategy and of the reserves: a warm start
+    rescales the shares to the limit sell amount of the new order, and the routes not in the
+    entry start from zero.
+
+    Note:
+        - The memory is shared by the agents and thread safe, so it can serve agents solving
+          concurrently. An entry is replaced, never modified.
+
+    Attributes:
+    -----------
+    max_size : int
+        The maximum number of entries.
+    entries : OrderedDict
+        The entries, the least recently used first.
+    hits : int
+        The number of lookups answered by the memory.
+    misses : int
+        The number of lookups not answered by the memory.
+    fallbacks : int
+        The number of warm starts that failed, the optimization being solved again from zero.
+
+    Methods:
+    --------
+    route_key(path):
+        Returns the key of a route in the entries.
+    initial_guess(sell_token, buy_token, paths, limit_sell_amount):
+        Returns the warm start of the routes of an order, or None.
+    remember(sell_token, buy_token, paths, coins_sell, limit_sell_amount):
+        Stores the optimal allocation of an order.
+    record_fallback():
+        Counts a warm start that failed.
+    clear():
+        Removes all the entries.
+    stats():
+        Returns the size and the hit, miss and fallback statistics of the memory.
+    """
+
+    def __init__(self, max_size=1024):
+        """
+        Constructs all the necessary attributes for the solution_memory object.
+
+        Parameters:
+        -----------
+        max_size : int, optional
+            The maximum number of entries. Default is 1024.
+        """
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def route_key(path):
+        """
+        Returns the key of a route: the (venue, sell_token, buy_token) of each of its edges.
+
+        Parameters:
+        -----------
+        path : list
+            The edges of the route, see agent.paths.
+
+        Returns:
+        --------
+        tuple
+            The key of the route.
+        """
+        return tuple((edge_data['venue'], edge_data['sell_token'], edge_data['buy_token']) for edge_data in path)
+
+    def initial_guess(self, sell_token, buy_token, paths, limit_sell_amount):
+        """
+        Returns the warm start of the routes of an order: the shares of the limit sell amount of the
+        last optimal allocation of the pair, rescaled to limit_sell_amount, zero for the new routes.
+
+        Parameters:
+        -----------
+        sell_token : str
+            The token sold by the order.
+        buy_token : str
+            The token bought by the order.
+        paths : list
+            The routes of the strategy of the order.
+        limit_sell_amount : float
+            The limit sell amount of the order.
+
+        Returns:
+        --------
+        list
+            The initial amount sold along each route, or None if the pair is not in the memory or
+            none of its routes is in the strategy.
+        """
+        with self._lock:
+            shares = self.entries.get((sell_token, buy_token))
+            if shares is not None:
+                self.entries.move_to_end((sell_token, buy_token))
+        guess = None
+        if shares is not None:
+            guess = [shares.get(self.route_key(path), 0.0) * limit_sell_amount for path in paths]
+            if not any(guess):
+                guess = None
+        with self._lock:
+            if guess is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return guess
+
+    def remember(self, sell_token, buy_token, paths, coins_sell, limit_sell_amount):
+        """
+        Stores the optimal allocation of an order as the share of its limit sell amount sold along
+        each route, evicting the least recently used entries beyond max_size.
+
+        Parameters:
+        -----------
+        sell_token : str
+            The token sold by the order.
+        buy_token : str
+            The token bought by the order.
+        paths : list
+            The routes of the strategy of the order.
+        coins_sell : array_like
+            The optimal amount sold along each route.
+        limit_sell_amount : float
+            The limit sell amount of the order.
+        """
+        shares = {self.route_key(path): float(amount) / limit_sell_amount
+                  for path, amount in zip(paths, coins_sell) if amount > 0}
+        with self._lock:
+            self.entries[(sell_token, buy_token)] = shares
+            self.entries.move_to_end((sell_token, buy_token))
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def record_fallback(self):
+        """
+        Counts a warm start that failed.
+        """
+        with self._lock:
+            self.fallbacks += 1
+
+    def clear(self):
+        """
+        Removes all the entries, keeping the statistics.
+        """
+        with self._lock:
+            self.entries.clear()
+
+    def stats(self):
+        """
+        Returns the size and the hit, miss and fallback statistics of the memory.
+
+        Returns:
+        --------
+        dict
+            The 'size', 'max_size', 'hits', 'misses', 'fallbacks' and 'hit_rate' of the memory.
+        """
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'fallbacks': self.fallbacks,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
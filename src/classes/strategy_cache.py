@@ -0,0 +1,156 @@
+import threading
+from collections import OrderedDict
+
+class strategy_cache:
+    """
+    A class to keep the compiled strategies of the most recent token pairs, so that the orders
+    repeating a pair against the same topology skip the search of the routes and the copy of
+    their edges.
+
+    The cache is a bounded LRU keyed by (sell_token, buy_token, topology_version) of the market.
+    An entry holds the routes and the compiled path_engine of a pair, which refer to the reserves
+    through their reserve slots: an agent reading an entry evaluates the engine on the current
+    reserves (path_engine.with_reserves()), so reserve updates do not invalidate the entries, while venues added or removed change the topology version.
+
+    Note:
+        - When a pair has more than max_routes routes, the best ones depend on the reserves: such
+          a truncated entry is only used with the reserve version it was created with. Complete
+          entries, holding all the routes of the pair, are used whatever the reserves.
+        - The liquidities stored in the edges of the routes are those when the entry was
+          created: the agents reading an entry copy the edges with the current liquidities.
+        - The entries are shared by the agents and never modified, and the cache is thread safe,
+          so it can serve agents solving concurrently.
+
+    Attributes:
+    -----------
+    max_size : int
+        The maximum number of entries.
+    entries : OrderedDict
+        The entries, the least recently used first.
+    hits : int
+        The number of lookups answered by the cache.
+    misses : int
+        The number of lookups not answered by the cache.
+    evictions : int
+        The number of entries removed to respect max_size.
+
+    Methods:
+    --------
+    get(Market, sell_token, buy_token, max_routes, reserve_version=None):
+        Returns the entry of a token pair, or None.
+    put(Market, sell_token, buy_token, max_routes, paths, engine, complete=True):
+        Stores the compiled strategy of a token pair.
+    clear():
+        Removes all the entries.
+    stats():
+        Returns the size and the hit and miss statistics of the cache.
+    """
+
+    def __init__(self, max_size=256):
+        """
+        Constructs all the necessary attributes for the strategy_cache object.
+
+        Parameters:
+        -----------
+        max_size : int, optional
+            The maximum number of entries. Default is 256.
+        """
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, Market, sell_token, buy_token, max_routes, reserve_version=None):
+        """
+        Returns the entry of a token pair for the current topology of a market, or None.
+        An entry created by another market, or with another max_routes, or a truncated entry
+        created with other reserves, is a miss.
+
+        Parameters:
+        -----------
+        Market : market
+            The market, or market snapshot, read by the agent.
+        sell_token : str
+            The token sold by the order.
+        buy_token : str
+            The token bought by the order.
+        max_routes : int
+            The maximum number of routes of the strategy.
+        reserve_version : int, optional
+            The version of the reserves the agent reads, None if they are not those of a version
+            of the market, e.g. with trades not yet committed. Default is None.
+
+        Returns:
+        --------
+        dict
+            The 'paths' and the compiled 'engine' of the pair, or None.
+        """
+        key = (sell_token, buy_token, Market.topology_version)
+        with self._lock:
+            entry = self.entries.get(key)
+            if (entry is None or entry['market'] is not getattr(Market, 'source', Market) or entry['max_routes'] != max_routes or
+                    not (entry['complete'] or (reserve_version is not None and entry['reserve_version'] == reserve_version))):
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, Market, sell_token, buy_token, max_routes, paths, engine, complete=True):
+        """
+        Stores the compiled strategy of a token pair, evicting the least recently used entries
+        beyond max_size.
+
+        Parameters:
+        -----------
+        Market : market
+            The market, or market snapshot, the strategy was built from.
+        sell_token : str
+            The token sold by the order.
+        buy_token : str
+            The token bought by the order.
+        max_routes : int
+            The maximum number of routes of the strategy.
+        paths : list
+            The routes of the strategy.
+        engine : path_engine
+            The compiled engine of the routes.
+        complete : bool, optional
+            Whether the routes are all the routes of the pair, not only the best max_routes. Default is True.
+        """
+        key = (sell_token, buy_token, Market.topology_version)
+        with self._lock:
+            self.entries[key] = {'market': getattr(Market, 'source', Market), 'max_routes': max_routes,
+                                 'complete': complete, 'reserve_version': Market.reserve_version, 'paths': paths, 'engine': engine}
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Removes all the entries, keeping the statistics.
+        """
+        with self._lock:
+            self.entries.clear()
+
+    def stats(self):
+        """
+        Returns the size and the hit and miss statistics of the cache.
+
+        Returns:
+        --------
+        dict
+            The 'size', 'max_size', 'hits', 'misses', 'evictions' and 'hit_rate' of the cache.
+        """
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
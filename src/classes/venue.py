@@ -3,6 +3,8 @@ import json
 import numpy as np
 import copy
 import sys
+from .amount import parse_amounts, format_amount, to_raw, to_float
+from .curves import make_curve
 
 class venue:
     """
@@ -14,16 +16,20 @@ class venue:
         The name of the trading venue.
     reserves : dict
         A dictionary containing the token reserves in the venue.
+    raw_reserves : dict
+        The exact token reserves in the venue, as integers of 10^-18 units (see amount.py).
+    curve : curve
+        The AMM curve of the venue (see curves.py), a fee-less constant product by default.
     
     Methods:
     --------
-    from_json(name, data):
+    from_json(name, data, curve=None):
         Creates a venue instance from JSON data.
     print_info():
         Prints the venue information in a JSON-like formatted string.
     """
     
-    def __init__(self, name, reserves):
+    def __init__(self, name, reserves, raw_reserves=None, curve=None):
         """
         Constructs all the necessary attributes for the venue object.
         
@@ -33,12 +39,20 @@ class venue:
             The name of the trading venue.
         reserves : dict
             A dictionary containing the token reserves in the venue.
+        raw_reserves : dict, optional
+            The exact token reserves in 10^-18 units. Default is the conversion of reserves.
+        curve : curve, optional
+            The AMM curve of the venue. Default is None, a fee-less constant product curve.
         """
         self.name = name
         self.reserves = reserves
+        if raw_reserves is None:
+            raw_reserves = {token: to_raw(amount) for token, amount in reserves.items()}
+        self.raw_reserves = raw_reserves
+        self.curve = curve if curve is not None else make_curve()
 
     @staticmethod
-    def from_json(name, data):
+    def from_json(name, data, curve=None):
         """
         Creates a venue instance from JSON data.
         
@@ -48,24 +62,30 @@ class venue:
             The name of the trading venue.
         data : dict
             The JSON data containing the venue's reserves.
+        curve : str or dict, optional
+            The 'curve' entry of the venue in the JSON data, the name of the curve or a dictionary with
+            its 'type' and parameters (see curves.make_curve()). Default is None, a fee-less constant product.
         
         Returns:
         --------
         venue: venue class
             An instance of the venue class.
         """
-        reserves = {token: np.float64(data[token].replace("_", ".")) for token in data}
-        return venue(name, reserves)
+        raw_reserves = dict(zip(data.keys(), parse_amounts(data.values())))
+        reserves = {token: to_float(amount) for token, amount in raw_reserves.items()}
+        return venue(name, reserves, raw_reserves, make_curve(curve))
 
 
     def print_info(self):
         """
         Prints the venue information in a JSON-like formatted string.
         """
-        formatted_reserves = {token: f"{amount:.18f}".replace(".","_") for token, amount in self.reserves.items()}
+        formatted_reserves = {token: format_amount(amount) for token, amount in self.raw_reserves.items()}
         venue_data = {
             self.name: {
                 "reserves": formatted_reserves
             }
         }
+        if self.curve.to_json() != make_curve().to_json():
+            venue_data[self.name]["curve"] = self.curve.to_json()
         print(json.dumps(venue_data, indent=4))
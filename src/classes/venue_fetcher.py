@@ -0,0 +1,359 @@
+import re
+import time
+import threading
+from .venue import venue
+from .amount import parse_amount, format_amount
+
+class venue_fetcher:
+    """
+    A class to refresh the reserves of many pools from their web pages concurrently, and to write
+    them into a market.
+
+    The pages are fetched by a pool of threads over one shared requests session, whose connection
+    pool is as large as the thread pool, so the connections to a host are kept alive and reused.
+    Every request has a timeout, and the connection errors and the 429 and 5xx responses are
+    retried with an exponential backoff. The pages are parsed in memory: the liquidity of a token
+    is the number following 'pooled {token} is' in the page. A pool fetched less than ttl seconds
+    ago is not fetched again.
+
+    The reserves are written into the market in one batch through market.apply_reserve_updates(),
+    only the amounts that changed, so the path index and the strategies of the agents stay valid.
+    The pools not in the market yet are added as constant product venues.
+
+    Note:
+        - requests is imported when the session is first needed, so that solving orders does not
+          load it. Any object with the get() method of a requests session can be passed instead,
+          e.g. to serve the pages from a local stand-in server or from memory.
+        - A pool that cannot be fetched or parsed keeps its reserves in the market, and the reason
+          is stored in errors.
+
+    Attributes:
+    -----------
+    market : market
+        The market the reserves are written into, if any.
+    pools : dict
+        The 'url' and the two 'tokens' of each pool, keyed by venue name.
+    workers : int
+        The number of threads fetching the pages.
+    timeout : float
+        The seconds to wait for the server to connect and to answer each request.
+    retries : int
+        The number of times a failed request is retried.
+    backoff : float
+        The backoff factor of the retries: the n-th retry waits backoff * 2^(n-1) seconds.
+    ttl : float
+        The seconds the reserves of a pool fetched are considered fresh.
+    cache : dict
+        The time of the last fetch and the exact reserves of each pool, keyed by venue name.
+    errors : dict
+        The reason why a pool could not be refreshed by the last refresh(), keyed by venue name.
+    fetches : int
+        The number of pages fetched.
+    hits : int
+        The number of pools answered by the cache.
+    failures : int
+        The number of pools that could not be fetched or parsed.
+
+    Methods:
+    --------
+    add_pool(venue_name, url, token1, token2):
+        Adds a pool to refresh.
+    add_pools(pools):
+        Adds several pools to refresh.
+    parse_liquidity(text, token1, token2):
+        Returns the exact liquidities of two tokens in the text of a pool page.
+    fetch(venue_name, force=False):
+        Returns the reserves of a pool, fetching its page if the cache is stale.
+    refresh(venue_names=None, force=False):
+        Fetches the reserves of many pools concurrently.
+    apply(reserves, Market=None):
+        Writes reserves into the market in one batch.
+    update_market(venue_names=None, force=False, Market=None):
+        Refreshes the pools and writes their reserves into the market.
+    stats():
+        Returns the fetch, cache and failure statistics.
+    close():
+        Closes the connections of the session.
+    """
+
+    def __init__(self, Market=None, workers=16, timeout=5.0, retries=3, backoff=0.2, ttl=10.0, session=None):
+        """
+        Constructs all the necessary attributes for the venue_fetcher object.
+
+        Parameters:
+        -----------
+        Market : market, optional
+            The market the reserves are written into. Default is None.
+        workers : int, optional
+            The number of threads fetching the pages, and of connections kept per host. Default is 16.
+        timeout : float, optional
+            The seconds to wait for the server to connect and to answer each request. Default is 5.
+        retries : int, optional
+            The number of times a failed request is retried. Default is 3.
+        backoff : float, optional
+            The backoff factor of the retries. Default is 0.2.
+        ttl : float, optional
+            The seconds the reserves of a pool fetched are considered fresh. Default is 10.
+        session : requests.Session, optional
+            The session used to fetch the pages. Default is a session with a pool of workers
+            connections per host, retrying the failed requests.
+        """
+        self.market = Market
+        self.pools = {}
+        self.workers = workers
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.ttl = ttl
+        self.cache = {}
+        self.errors = {}
+        self.fetches = 0
+        self.hits = 0
+        self.failures = 0
+        self._session = session
+        self._patterns = {}
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        """
+        The session used to fetch the pages, created the first time it is needed. It is created
+        under the lock, so that the threads of a refresh share one session and one connection pool.
+        """
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    from urllib3.util.retry import Retry
+
+                    retry = Retry(total=self.retries, backoff_factor=self.backoff, status_forcelist=(429, 500, 502, 503, 504),
+                                  allowed_methods=frozenset(['GET']))
+                    adapter = HTTPAdapter(pool_connections=self.workers, pool_maxsize=self.workers, max_retries=retry)
+                    session = requests.Session()
+                    session.headers['User-Agent'] = 'Mozilla/5.0'
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self._session = session
+        return self._session
+
+    def add_pool(self, venue_name, url, token1, token2):
+        """
+        Adds a pool to refresh, replacing the pool with the same name.
+
+        Parameters:
+        -----------
+        venue_name : str
+            The name of the venue of the pool.
+        url : str
+            The URL of the page of the pool.
+        token1 : str
+            The string of the first token.
+        token2 : str
+            The string of the second token.
+        """
+        self.pools[venue_name] = {'url': url, 'tokens': (token1, token2)}
+        with self._lock:
+            self.cache.pop(venue_name, None)
+
+    def add_pools(self, pools):
+        """
+        Adds several pools to refresh.
+
+        Parameters:
+        -----------
+        pools : iterable
+            The (venue_name, url, token1, token2) of each pool.
+        """
+        for venue_name, url, token1, token2 in pools:
+            self.add_pool(venue_name, url, token1, token2)
+
+    def _pattern(self, token):
+        """
+        Returns the compiled regular expression of the liquidity of a token.
+        """
+        pattern = self._patterns.get(token)
+        if pattern is None:
+            pattern = self._patterns[token] = re.compile(rf'pooled {re.escape(token)} is ([\d,\.]+)')
+        return pattern
+
+    def parse_liquidity(self, text, token1, token2):
+        """
+        Returns the exact liquidities of two tokens in the text of a pool page, where they follow
+        'pooled {token} is', with ',' as thousands separator.
+
+        Parameters:
+        -----------
+        text : str
+            The text of the page.
+        token1 : str
+            The string of the first token.
+        token2 : str
+            The string of the second token.
+
+        Returns:
+        --------
+        dict
+            The liquidity of each token in 10^-18 units, or None if one of them is not in the text.
+        """
+        reserves = {}
+        for token in (token1, token2):
+            match = self._pattern(token).search(text)
+            if match is None:
+                return None
+            reserves[token] = parse_amount(match.group(1).replace(',', '').rstrip('.'))
+        return reserves
+
+    def fetch(self, venue_name, force=False):
+        """
+        Returns the reserves of a pool, from the cache if they were fetched less than ttl seconds
+        ago, otherwise fetching and parsing its page.
+
+        Parameters:
+        -----------
+        venue_name : str
+            The name of the venue of the pool.
+        force : bool, optional
+            Fetches the page even if the cache is fresh. Default is False.
+
+        Returns:
+        --------
+        dict
+            The liquidity of each token of the pool in 10^-18 units, or None if the page could not
+            be fetched or parsed, the reason being stored in errors.
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = self.cache.get(venue_name)
+            if cached is not None and not force and now - cached[0] < self.ttl:
+                self.hits += 1
+                return cached[1]
+
+        pool = self.pools[venue_name]
+        reserves = None
+        try:
+            response = self.session.get(pool['url'], timeout=self.timeout)
+            response.raise_for_status()
+            reserves = self.parse_liquidity(response.text, *pool['tokens'])
+            error = None if reserves is not None else "Liquidity values not found in the page"
+        except Exception as exception:
+            error = f"{type(exception).__name__}: {exception}"
+
+        with self._lock:
+            self.fetches += 1
+            if reserves is None:
+                self.failures += 1
+                self.errors[venue_name] = error
+            else:
+                self.cache[venue_name] = (now, reserves)
+        return reserves
+
+    def refresh(self, venue_names=None, force=False):
+        """
+        Fetches the reserves of many pools concurrently, the pools fresh in the cache excepted.
+
+        Parameters:
+        -----------
+        venue_names : list, optional
+            The names of the pools to refresh. Default is all the pools.
+        force : bool, optional
+            Fetches the pages even if the cache is fresh. Default is False.
+
+        Returns:
+        --------
+        dict
+            The liquidity of each token in 10^-18 units, keyed by venue name, for the pools refreshed.
+            The pools that could not be refreshed are in errors.
+        """
+        venue_names = list(self.pools) if venue_names is None else list(venue_names)
+        with self._lock:
+            for venue_name in venue_names:
+                self.errors.pop(venue_name, None)
+        if self.workers == 1 or len(venue_names) <= 1:
+            fetched = [self.fetch(venue_name, force) for venue_name in venue_names]
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(venue_names))) as executor:
+                fetched = list(executor.map(lambda venue_name: self.fetch(venue_name, force), venue_names))
+        return {venue_name: reserves for venue_name, reserves in zip(venue_names, fetched) if reserves is not None}
+
+    def apply(self, reserves, Market=None):
+        """
+        Writes reserves into the market in one batch: the amounts that changed are updated through
+        market.apply_reserve_updates(), and the pools not in the market are added as new venues.
+
+        Parameters:
+        -----------
+        reserves : dict
+            The liquidity of each token in 10^-18 units, keyed by venue name, see refresh().
+        Market : market, optional
+            The market to write into. Default is self.market.
+
+        Returns:
+        --------
+        set
+            The names of the venues changed or added.
+        """
+        Market = Market if Market is not None else self.market
+        updates = []
+        Venues = []
+        for venue_name, raw_reserves in reserves.items():
+            if venue_name in Market.venue_index and Market.venues[Market.venue_index[venue_name]].raw_reserves.keys() >= set(raw_reserves):
+                updates.extend((venue_name, token, amount) for token, amount in raw_reserves.items()
+                               if amount != Market.raw_reserve(Market.reserve_slot(venue_name, token)))
+            else:
+                if venue_name in Market.venue_index:
+                    Market.remove_venue(venue_name)
+                Venues.append(venue.from_json(venue_name, {token: format_amount(amount) for token, amount in raw_reserves.items()}))
+
+        changed = Market.apply_reserve_updates(updates, raw=True) if updates else set()
+        if Venues:
+            Market.add_venues(Venues)
+            changed |= {Venue.name for Venue in Venues}
+        return changed
+
+    def update_market(self, venue_names=None, force=False, Market=None):
+        """
+        Refreshes the pools concurrently (refresh()) and writes their reserves into the market in one batch (apply()).
+
+        Parameters:
+        -----------
+        venue_names : list, optional
+            The names of the pools to refresh. Default is all the pools.
+        force : bool, optional
+            Fetches the pages even if the cache is fresh. Default is False.
+        Market : market, optional
+            The market to write into. Default is self.market.
+
+        Returns:
+        --------
+        set
+            The names of the venues changed or added.
+        """
+        return self.apply(self.refresh(venue_names, force=force), Market)
+
+    def stats(self):
+        """
+        Returns the fetch, cache and failure statistics.
+
+        Returns:
+        --------
+        dict
+            The number of 'pools', of pages fetched ('fetches'), of pools answered by the cache
+            ('hits'), of 'failures', and the 'errors' of the last refresh.
+        """
+        return {
+            'pools': len(self.pools),
+            'fetches': self.fetches,
+            'hits': self.hits,
+            'failures': self.failures,
+            'errors': dict(self.errors)
+        }
+
+    def close(self):
+        """
+        Closes the connections of the session.
+        """
+        if self._session is not None:
+            self._session.close()
@@ -0,0 +1,104 @@
+from collections.abc import Sequence
+from .venue import venue
+from .amount import SCALE
+
+class venue_view(venue):
+    """
+    A class to represent a venue of a market as a view over the reserve arrays of the market.
+
+    The view does not store the reserves: reserves and raw_reserves are built from the reserve
+    slots of the venue when they are read, so they always show the current reserves of the
+    market, and each reserve is stored once, in the arrays. The dictionaries returned are
+    copies, the reserves are changed through market.apply_reserve_updates().
+
+    Attributes:
+    -----------
+    name : str
+        The name of the trading venue.
+    reserves : dict
+        The token reserves in the venue, read from the reserve arrays.
+    raw_reserves : dict
+        The exact token reserves in the venue, as integers of 10^-18 units, read from the reserve arrays.
+    curve : curve
+        The AMM curve of the venue (see curves.py).
+    """
+
+    __slots__ = ('name', 'curve', '_arrays', '_first_slot', '_last_slot')
+
+    def __init__(self, name, curve, arrays, first_slot, last_slot):
+        """
+        Constructs all the necessary attributes for the venue_view object.
+
+        Parameters:
+        -----------
+        name : str
+            The name of the trading venue.
+        curve : curve
+            The AMM curve of the venue.
+        arrays : tuple
+            The (tokens, reserve_tokens, reserves, raw_whole, raw_fraction) of the market, shared by its views.
+        first_slot : int
+            The first reserve slot of the venue.
+        last_slot : int
+            The reserve slot following the last one of the venue.
+        """
+        self.name = name
+        self.curve = curve
+        self._arrays = arrays
+        self._first_slot = first_slot
+        self._last_slot = last_slot
+
+    @property
+    def reserves(self):
+        tokens, reserve_tokens, reserves, _, _ = self._arrays
+        return {tokens[reserve_tokens[slot]]: reserves[slot] for slot in range(self._first_slot, self._last_slot)}
+
+    @property
+    def raw_reserves(self):
+        tokens, reserve_tokens, _, raw_whole, raw_fraction = self._arrays
+        return {tokens[reserve_tokens[slot]]: int(raw_whole[slot]) * SCALE + int(raw_fraction[slot])
+                for slot in range(self._first_slot, self._last_slot)}
+
+class venue_views(Sequence):
+    """
+    A class to represent the venues of a market as a read-only sequence of venue_view objects,
+    created when they are read, so that the market stores no object per venue.
+
+    Methods:
+    --------
+    __len__():
+        Returns the number of venues.
+    __getitem__(index):
+        Returns the view of a venue, or a list of views for a slice.
+    """
+
+    def __init__(self, names, curves, indptr, arrays):
+        """
+        Constructs all the necessary attributes for the venue_views object.
+
+        Parameters:
+        -----------
+        names : list
+            The venue names, indexed by venue id.
+        curves : list
+            The AMM curve of each venue, indexed by venue id.
+        indptr : np.ndarray
+            The reserve slots of venue v are indptr[v]:indptr[v + 1].
+        arrays : tuple
+            The (tokens, reserve_tokens, reserves, raw_whole, raw_fraction) of the market.
+        """
+        self._names = names
+        self._curves = curves
+        self._indptr = indptr
+        self._arrays = arrays
+
+    def __len__(self):
+        return len(self._names)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[venue_id] for venue_id in range(*index.indices(len(self)))]
+        name = self._names[index]
+        venue_id = index + len(self) if index < 0 else index
+        return venue_view(name, self._curves[venue_id], self._arrays,
+                          int(self._indptr[venue_id]), int(self._indptr[venue_id + 1]))
@@ -0,0 +1,123 @@
+import numpy as np
+
+class solver_result:
+    """
+    A class to store the outcome of a solver, with the same fields the agent
+    reads from the result of scipy.optimize.minimize.
+
+    Attributes:
+    -----------
+    x : np.ndarray
+        The optimal amounts sold along each path.
+    status : int
+        0 if the solution is optimal, 2 if the limit buy amount cannot be met.
+    success : bool
+        Whether the solution is optimal.
+    message : str
+        A description of the outcome.
+    nit : int
+        Number of iterations.
+    nfev : int
+        Number of function evaluations.
+    njev : int
+        Number of gradient evaluations.
+    """
+
+    def __init__(self, x, status, message, nit=1, nfev=1, njev=0):
+        self.x = x
+        self.status = status
+        self.success = status == 0
+        self.message = message
+        self.nit = nit
+        self.nfev = nfev
+        self.njev = njev
+
+def water_filling(reserve_in, reserve_out, limit_sell_amount, limit_buy_amount, partial_fill=False):
+    """
+    Exact surplus maximization over parallel routes that do not share venues, each route
+    being a constant product (virtual) pool b_i = R_out a_i/(R_in + a_i).
+
+    The KKT conditions equalize the marginal rate R_in R_out/(R_in + a_i)^2 of all the routes
+    receiving flow to a common marginal price λ, while the routes whose marginal rate at zero
+    size, R_out/R_in, is below λ stay empty. For a given λ the allocation is
+    a_i = max(0, sqrt(R_in R_out/λ) - R_in), so once the set of active routes is known λ
+    follows in closed form. Sorting the routes by marginal rate at zero, the active set is the
+    shortest prefix whose λ is above the rate of the next route.
+
+    This method performs the following steps:
+    1. Fill-or-kill: λ is set by the sell limit, sum(a_i) = limit_sell_amount.
+    2. Partial fill: the marginal rate drops to 1/exch_rate = limit_buy/limit_sell, unless the
+       sell limit binds first.
+    3. If the total bought is below limit_buy_amount, the partial fill is pushed until
+       sum(b_i) = limit_buy_amount. If even that exceeds the sell limit the order cannot be filled.
+
+    Parameters:
+    -----------
+    reserve_in : array_like
+        The sell token liquidity of the virtual pool of each route.
+    reserve_out : array_like
+        The buy token liquidity of the virtual pool of each route.
+    limit_sell_amount : float
+        The maximum amount of sell token of the order.
+    limit_buy_amount : float
+        The minimum amount of buy token of the order.
+    partial_fill : bool, optional
+        Whether partial filling of the order is allowed. Default is False (fill-or-kill).
+
+    Returns:
+    --------
+    solver_result
+        The optimal amounts sold along each route and the status of the solution.
+    """
+    reserve_in = np.asarray(reserve_in, dtype=float)
+    reserve_out = np.asarray(reserve_out, dtype=float)
+
+    # Sort routes by decreasing marginal rate at zero size
+    rate_at_zero = reserve_out / reserve_in
+    order = np.argsort(-rate_at_zero)
+    next_rate = np.append(rate_at_zero[order][1:], 0.0)
+    geometric_mean = np.sqrt(reserve_in * reserve_out)
+
+    def allocation(marginal_price):
+        return np.maximum(0.0, geometric_mean / np.sqrt(marginal_price) - reserve_in)
+
+    def marginal_price_sold(total_sell):
+        # sum_k (s_k/sqrt(λ) - R_in_k) = total_sell over the active prefix
+        sqrt_price = np.cumsum(geometric_mean[order]) / (total_sell + np.cumsum(reserve_in[order]))
+        return _first_valid(sqrt_price**2, next_rate)
+
+    def marginal_price_bought(total_buy):
+        # sum_k (R_out_k - s_k sqrt(λ)) = total_buy over the active prefix
+        sqrt_price = (np.cumsum(reserve_out[order]) - total_buy) / np.cumsum(geometric_mean[order])
+        sqrt_price = np.where(sqrt_price > 0.0, sqrt_price, np.nan)
+        return _first_valid(sqrt_price**2, next_rate)
+
+    if partial_fill:
+        marginal_price = limit_buy_amount / limit_sell_amount
+        if allocation(marginal_price).sum() > limit_sell_amount:
+            marginal_price = marginal_price_sold(limit_sell_amount)
+    else:
+        marginal_price = marginal_price_sold(limit_sell_amount)
+    x = allocation(marginal_price)
+    total_bought = np.sum(reserve_out * x / (reserve_in + x))
+
+    if total_bought >= limit_buy_amount:
+        return solver_result(x, 0, "Optimal allocation found (water filling)")
+
+    if partial_fill:
+        marginal_price = marginal_price_bought(limit_buy_amount)
+        if not np.isnan(marginal_price) and allocation(marginal_price).sum() <= limit_sell_amount:
+            return solver_result(allocation(marginal_price), 0, "Optimal allocation found (water filling)")
+        x = allocation(marginal_price_sold(limit_sell_amount))
+
+    return solver_result(x, 2, "The limit buy amount cannot be met with the available liquidity")
+
+def _first_valid(marginal_prices, next_rate):
+    """
+    Returns the marginal price of the shortest active prefix of routes for which the
+    next route would not receive flow.
+    """
+    valid = np.nonzero(marginal_prices >= next_rate)[0]
+    if len(valid) == 0:
+        return np.nan
+    return marginal_prices[valid[0]]
@@ -2,16 +2,13 @@ import sys
 import os
 import argparse
 import json
-from matplotlib import pyplot as plt
-import re
-import requests
-from bs4 import BeautifulSoup
+import time
 import numpy as np
 
 # Add the src directory to the system path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
 
-from classes import order, venue, market, agent
+from classes import order, venue, market, agent, batch_auction, strategy_cache, solution_memory, format_amount
 
 def load_data(file_path):
     """
@@ -64,6 +61,26 @@ def create_order(data):
 
     return Order
 
+def create_orders(data):
+    """
+    Create a list of Order instances from the loaded JSON data, one for each order in the file.
+
+    Parameters:
+    -----------
+    data: dict 
+        The loaded JSON data.
+
+    Returns:
+    --------
+    Orders: list
+        A list of Order instances.
+    """
+    Orders = []
+    for index in data['orders']:
+        Orders.append(order.from_json(index, data['orders'][index]))
+
+    return Orders
+
 def create_venues(data):
     """
     Create a list of Venue instances from the loaded JSON data.
@@ -81,7 +98,7 @@ def create_venues(data):
     Venues = []
     # Read venues from the file and gather data
     for venue_name, venue_info in data['venues'].items():
-        Venue = venue.from_json(venue_name, venue_info['reserves'])
+        Venue = venue.from_json(venue_name, venue_info['reserves'], venue_info.get('curve'))
         Venues.append(Venue)
 
     return Venues
@@ -132,11 +149,476 @@ def main(file_path, plot_strategy=False, verbose=False):
         Agent.plot_strategy()
 
     # Optimize the strategy
-    sold_amount, bought_amount = Agent.optimize_strategy()
+    sold_amount, bought_amount = Agent.optimize_strategy(verbose=True)
 
     # Output results in JSON file
     Agent.print_results(file=file_path.split('.json')[0]+'-results.json')
 
+def main_batch(file_path, venues_file=None, verbose=False):
+    """
+    Solves all the orders of a JSON file jointly, as a batch auction, and creates an output json.
+
+    Parameters:
+    -----------
+    file_path : str
+        The path to the JSON file with the orders (e.g. the batch*.json files).
+    venues_file : str, optional
+        The path to a JSON file with the venues, if the file of the orders has none.
+    verbose : bool, optional
+        Prints additional verbose information
+
+    The function performs the following steps:
+    1. Fetches the orders, and the venues if present, from the specified json-file_path.
+    2. Fetches the venues from venues_file, if given.
+    3. Nets opposing orders against each other (coincidence of wants) and routes the
+       residual amounts through the venues, see batch_auction.
+    4. Creates an output json file with the executed amounts of each order.
+    """
+    # Load data from JSON file
+    data = load_data(file_path)
+
+    # Create Orders and Venues from JSON data
+    Orders = create_orders(data)
+    if venues_file:
+        Venues = create_venues(load_data(venues_file))
+    elif 'venues' in data:
+        Venues = create_venues(data)
+    else:
+        Venues = []
+
+    # Solve the orders jointly
+    Batch = batch_auction(Orders, Venues)
+    Batch.solve(verbose=verbose)
+
+    # Output results in JSON file
+    Batch.print_results(file=file_path.split('.json')[0]+'-results.json')
+
+def main_parallel(file_path, venues_file=None, workers=None, verbose=False):
+    """
+    Solves all the orders of a JSON file one after the other, each against the reserves left by
+    the previous ones, solving the independent orders in parallel, and creates an output json.
+
+    Parameters:
+    -----------
+    file_path : str
+        The path to the JSON file with the orders.
+    venues_file : str, optional
+        The path to a JSON file with the venues, if the file of the orders has none.
+    workers : int, optional
+        The number of worker processes. Default is the number of CPUs.
+    verbose : bool, optional
+        Prints additional verbose information
+
+    The function performs the following steps:
+    1. Fetches the orders and the venues from the specified json-file_path, or from venues_file.
+    2. Partitions the orders into groups not sharing any venue and solves the groups in a
+       pool of worker processes, see parallel_scheduler.
+    3. Creates an output json file with the executed amounts of each order.
+    """
+    # The worker processes are only set up by this entry point
+    from classes.parallel_scheduler import parallel_scheduler
+
+    # Load data from JSON file
+    data = load_data(file_path)
+
+    # Create Orders and Venues from JSON data
+    Orders = create_orders(data)
+    Venues = create_venues(load_data(venues_file) if venues_file else data)
+
+    # Solve the independent orders in parallel
+    Scheduler = parallel_scheduler(Orders, market(Venues), workers=workers)
+    Scheduler.solve(verbose=verbose)
+
+    # Output results in JSON file
+    Scheduler.print_results(file=file_path.split('.json')[0]+'-results.json')
+
+def main_replay(patterns, workers=None, resume=False, summary_file=None, verbose=False):
+    """
+    Solves many intent files in one run, e.g. to replay recorded instances, writing the results
+    of each file as main() does, and a summary of the run.
+
+    Parameters:
+    -----------
+    patterns : str or list
+        A directory, whose .json files are solved, or a glob pattern of the files, or a list of them.
+    workers : int, optional
+        The number of worker processes. Default is the number of CPUs.
+    resume : bool, optional
+        Skips the files that already have their results. Default is False.
+    summary_file : str, optional
+        The path of the JSON summary of the run. Default is None, the summary is printed.
+    verbose : bool, optional
+        Prints additional verbose information
+
+    The function performs the following steps:
+    1. Finds the intent files of the directories and of the glob patterns.
+    2. Solves the first order of each file, as main() without plotting, spreading the files across
+       a pool of worker processes that reuse their setup and, for identical venues, their markets,
+       see replay_runner. With resume, the files that already have their results are skipped.
+    3. Creates the output json file of each file solved, and the summary of the status, the surplus
+       and the timing of each file.
+    """
+    from classes.replay_runner import replay_runner
+
+    Runner = replay_runner(patterns, workers=workers, resume=resume, summary_file=summary_file)
+    Runner.solve(verbose=verbose)
+    Runner.print_summary(file=summary_file)
+    return Runner
+
+def read_stream(stream, follow=False, poll_interval=0.1):
+    """
+    Reads a newline-delimited JSON stream, one message per line, without loading it in memory.
+
+    Parameters:
+    -----------
+    stream : file object
+        The stream to read, e.g. sys.stdin or an open file.
+    follow : bool, optional
+        Keeps waiting for new lines at the end of the stream, as `tail -f`. Default is False.
+    poll_interval : float, optional
+        The seconds to wait before reading again the end of a followed stream. Default is 0.1.
+
+    Yields:
+    -------
+    data: dict
+        The message of each line. Lines that are not valid JSON are reported and skipped.
+    """
+    buffer = ''
+    while True:
+        line = stream.readline()
+        if not line:
+            if not follow:
+                break
+            time.sleep(poll_interval)
+            continue
+        buffer += line
+        if follow and not buffer.endswith('\n'):
+            continue # The line is still being written
+        line, buffer = buffer.strip(), ''
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError:
+            print(f"Error decoding JSON line: {line[:80]}", file=sys.stderr)
+
+def update_market(Market, data):
+    """
+    Applies the 'venues' section of a message, with the format of the JSON files, to the market.
+    The reserves of the venues already in the market are updated in place, the other venues are added.
+    A venue declaring another curve than the one in the market is replaced.
+
+    Parameters:
+    -----------
+    Market : market
+        The market to update.
+    data : dict
+        The message containing the venues.
+
+    Returns:
+    --------
+    set
+        The names of the venues changed or added.
+    """
+    updates = []
+    Venues = []
+    for venue_name, venue_info in data.get('venues', {}).items():
+        reserves = venue_info['reserves']
+        if (venue_name in Market.venue_index and Market.venues[Market.venue_index[venue_name]].reserves.keys() >= set(reserves) and
+                ('curve' not in venue_info or
+                 venue.from_json(venue_name, {}, venue_info['curve']).curve.to_json() ==
+                 Market.venue_curves[Market.venue_index[venue_name]].to_json())):
+            updates.extend((venue_name, token, amount) for token, amount in reserves.items())
+        else:
+            # New venue, or a venue whose tokens or curve changed
+            if venue_name in Market.venue_index:
+                Market.remove_venue(venue_name)
+            Venues.append(venue.from_json(venue_name, reserves, venue_info.get('curve')))
+
+    changed = Market.apply_reserve_updates(updates) if updates else set()
+    if Venues:
+        Market.add_venues(Venues)
+        changed |= {Venue.name for Venue in Venues}
+    return changed
+
+def solve_order(Order, Market, commit=False, verbose=False, Agent=None):
+    """
+    Solves one order against the market and returns its result.
+
+    Parameters:
+    -----------
+    Order : order
+        The order to solve.
+    Market : market
+        The market, or market snapshot, to solve the order against.
+    commit : bool, optional
+        Applies the trades of the order to the reserves of the market. Default is False.
+    verbose : bool, optional
+        Prints additional verbose information
+    Agent : agent, optional
+        The agent solving the order, e.g. to commit its trades later. Default is a new agent.
+
+    Returns:
+    --------
+    dict
+        The result of the order in the format of agent.results(), with the 'status' and
+        the 'message' of the solver. The status is None if the tokens are not connected.
+    """
+    if Agent is None:
+        Agent = agent()
+    Agent.read_order(Order)
+    if not Market.find_paths(Order.sell_token, Order.buy_token):
+        Agent.venues = Market.venues
+        result = Agent.results()
+        result['status'] = None
+        result['message'] = f"No paths found from {Order.sell_token} to {Order.buy_token}"
+        return result
+
+    Agent.read_market(Market, verbose=verbose)
+    Agent.optimize_strategy(verbose=verbose)
+    if commit:
+        Agent.commit()
+
+    result = Agent.results()
+    result['status'] = int(Agent.result.status)
+    result['message'] = str(Agent.result.message)
+    return result
+
+def main_stream(stream=None, output=None, follow=False, commit=False, verbose=False):
+    """
+    Long running version of main: reads a newline-delimited JSON stream mixing orders and
+    venue updates, keeps the market in memory and writes one result line per order as soon
+    as it is solved.
+
+    Each line of the stream is a JSON object with the format of the input files, with an
+    'orders' section, a 'venues' section, or both. The venues are applied to the market
+    before the orders of the same line are solved.
+
+    Parameters:
+    -----------
+    stream : file object, optional
+        The stream to read. Default is sys.stdin.
+    output : file object, optional
+        The stream where the result lines are written. Default is sys.stdout.
+    follow : bool, optional
+        Keeps waiting for new lines at the end of the stream, as `tail -f`. Default is False.
+    commit : bool, optional
+        Applies the trades of each order to the reserves of the market. Default is False.
+    verbose : bool, optional
+        Prints additional verbose information
+
+    The function performs the following steps:
+    1. Creates an empty market, a strategy cache and a solution memory, once.
+    2. Reads the stream one line at a time (read_stream()).
+    3. Applies the venues of the line to the market (update_market()).
+    4. Solves the orders of the line one at a time (solve_order()), with agents sharing the
+       strategy cache and the solution memory, which warm starts the orders repeating a pair, writing and flushing one result line, in the format of agent.results(),
+       for each of them.
+    A line whose venues or orders cannot be read, or an order that cannot be solved, writes an
+    {"error": ...} line instead, as the solver service does, and the stream keeps being read. The
+    orders of a line whose venues cannot be applied are not solved.
+    """
+    if stream is None:
+        stream = sys.stdin
+    if output is None:
+        output = sys.stdout
+
+    Market = market([])
+    Cache = strategy_cache()
+    Memory = solution_memory()
+    for data in read_stream(stream, follow=follow):
+        try:
+            if 'venues' in data:
+                update_market(Market, data)
+            Orders = create_orders(data) if 'orders' in data else []
+        except Exception as error:
+            Orders = []
+            output.write(json.dumps({'error': f"{type(error).__name__}: {error}"}) + '\n')
+            output.flush()
+        for Order in Orders:
+            try:
+                result = solve_order(Order, Market, commit=commit, verbose=verbose, Agent=agent(strategy_cache=Cache, solution_memory=Memory))
+            except Exception as error:
+                result = {'error': f"{type(error).__name__}: {error}", 'order': Order.order_number}
+            output.write(json.dumps(result) + '\n')
+            output.flush()
+
+def latency_stats(latencies):
+    """
+    Returns the number of requests and the mean, 50th, 90th and 99th percentile and maximum
+    of their latencies, in milliseconds.
+    """
+    if not latencies:
+        return {'count': 0}
+    latencies = np.asarray(latencies) * 1e3
+    return {
+        'count': int(latencies.size),
+        'mean_ms': float(latencies.mean()),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p90_ms': float(np.percentile(latencies, 90)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'max_ms': float(latencies.max())
+    }
+
+async def handle_request(data, Market, state, commit=False, verbose=False):
+    """
+    Handles one request of the solver service and returns its response lines.
+
+    A request is a JSON object with the format of the input files, with a 'venues' section,
+    an 'orders' section, or both, and an optional 'id' copied to the responses. The venues are
+    applied to the market first. The orders are solved in threads, so that the event loop keeps
+    accepting requests. Without commit, the orders are solved concurrently against the same
+    snapshot of the market. With commit, every order changes the reserves seen by the next ones:
+    the requests hold the lock of the service one after the other, and the orders of a request
+    are solved one after the other against the market, each trade being committed before the
+    next order is solved.
+    A request {"stats": true} returns the latency statistics of the service and the statistics of
+    the strategy cache and of the solution memory shared by the agents.
+
+    Parameters:
+    -----------
+    data : dict
+        The request.
+    Market : market
+        The market held in memory by the service.
+    state : dict
+        The state of the service: the 'snapshot' of the market, the 'lock' serializing the requests
+        with commit, the 'latencies' of the requests, and the 'strategy_cache' and the 'solution_memory'
+        of the agents.
+    commit : bool, optional
+        Applies the trades of each order to the reserves of the market. Default is False.
+    verbose : bool, optional
+        Prints additional verbose information
+
+    Returns:
+    --------
+    list
+        One result per order, in the format of agent.results() with the 'status' and the
+        'message' of the solver, or the names of the 'changed' venues for a request without
+        orders, or the 'stats' of the service.
+    """
+    start = time.perf_counter()
+    if data.get('stats'):
+        return [{'id': data.get('id'), 'stats': latency_stats(state['latencies']),
+                 'strategy_cache': state['strategy_cache'].stats(), 'solution_memory': state['solution_memory'].stats()}]
+
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    if commit:
+        # The market is only changed while holding the lock, so the order solved in a thread reads
+        # the market itself, with the trades committed by the previous orders
+        async with state['lock']:
+            changed = update_market(Market, data) if 'venues' in data else set()
+            Orders = create_orders(data) if 'orders' in data else []
+            responses = []
+            for Order in Orders:
+                Agent = agent(strategy_cache=state['strategy_cache'], solution_memory=state['solution_memory'])
+                responses.append(await loop.run_in_executor(None, solve_order, Order, Market, True, verbose, Agent))
+    else:
+        changed = update_market(Market, data) if 'venues' in data else set()
+        Orders = create_orders(data) if 'orders' in data else []
+        if Orders:
+            # One snapshot per version of the market, shared by the requests in flight
+            Snapshot = state.get('snapshot')
+            if Snapshot is None or Snapshot.version != (Market.topology_version, Market.reserve_version):
+                Snapshot = state['snapshot'] = Market.snapshot()
+            Agents = [agent(strategy_cache=state['strategy_cache'], solution_memory=state['solution_memory']) for Order in Orders]
+            responses = await asyncio.gather(*(loop.run_in_executor(None, solve_order, Order, Snapshot, False, verbose, Agent)
+                                               for Order, Agent in zip(Orders, Agents)))
+    if not Orders:
+        responses = [{'changed': sorted(changed)}]
+
+    latency = time.perf_counter() - start
+    state['latencies'].append(latency)
+    for response in responses:
+        response['id'] = data.get('id')
+        response['latency_ms'] = latency * 1e3
+    return responses
+
+async def handle_connection(reader, writer, Market, state, commit=False, verbose=False):
+    """
+    Serves the requests of one client of the solver service, one JSON object per line.
+    Each request is handled in its own task, so the requests of a client are in flight
+    concurrently and their responses, one JSON line each, are written as soon as they are ready.
+    """
+    import asyncio
+
+    async def respond(line):
+        try:
+            responses = await handle_request(json.loads(line), Market, state, commit=commit, verbose=verbose)
+        except json.JSONDecodeError:
+            responses = [{'error': f"Error decoding JSON line: {line[:80]}"}]
+        except Exception as error:
+            responses = [{'error': f"{type(error).__name__}: {error}"}]
+        writer.write(''.join(json.dumps(response) + '\n' for response in responses).encode())
+        await writer.drain()
+
+    tasks = set()
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        line = line.decode().strip()
+        if line:
+            task = asyncio.create_task(respond(line))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+    writer.close()
+
+async def serve(host='127.0.0.1', port=8765, unix_socket=None, venues_file=None, commit=False, verbose=False):
+    """
+    Runs the solver service until it is cancelled.
+
+    Parameters:
+    -----------
+    host : str, optional
+        The address to listen on. Default is '127.0.0.1'.
+    port : int, optional
+        The TCP port to listen on. Default is 8765.
+    unix_socket : str, optional
+        The path of a unix socket to listen on instead of the TCP port.
+    venues_file : str, optional
+        The path to a JSON file with the venues loaded at startup.
+    commit : bool, optional
+        Applies the trades of each order to the reserves of the market. Default is False.
+    verbose : bool, optional
+        Prints additional verbose information
+    """
+    import asyncio
+    from collections import deque
+
+    Market = market(create_venues(load_data(venues_file)) if venues_file else [])
+    state = {'snapshot': None, 'lock': asyncio.Lock(), 'latencies': deque(maxlen=100000),
+             'strategy_cache': strategy_cache(), 'solution_memory': solution_memory()}
+
+    async def client(reader, writer):
+        await handle_connection(reader, writer, Market, state, commit=commit, verbose=verbose)
+
+    if unix_socket:
+        server = await asyncio.start_unix_server(client, path=unix_socket)
+    else:
+        server = await asyncio.start_server(client, host, port)
+    print("Solver service listening on " + (unix_socket or f"{host}:{port}"), file=sys.stderr)
+    async with server:
+        await server.serve_forever()
+
+def main_service(host='127.0.0.1', port=8765, unix_socket=None, venues_file=None, commit=False, verbose=False):
+    """
+    Long running solver service: holds the market in memory and solves the orders, and applies
+    the venue updates, received as JSON lines over a local TCP port or unix socket, answering
+    with one JSON line per order in the format of agent.results() and its latency.
+    See serve() for the parameters and handle_request() for the protocol.
+    """
+    import asyncio
+
+    try:
+        asyncio.run(serve(host, port, unix_socket, venues_file, commit, verbose))
+    except KeyboardInterrupt:
+        pass
+
 def add_venue_to_json(url, token1, token2, json_file, delete_tmp=True):
     """
     Extracts liquidity data for specified tokens from a given URL and updates a JSON file with this information.
@@ -152,82 +634,48 @@ def add_venue_to_json(url, token1, token2, json_file, delete_tmp=True):
     json_file : str
         The path to the JSON intent file to be updated.
     delete_tmp: bool, optional
-        Flag indicating whether to delete the temporary HTML file after processing. Defaults to True.
+        Unused, kept for compatibility: the HTML content is parsed in memory and no temporary file is written.
 
     The function performs the following steps:
-    1. Fetches HTML content from the specified URL.
-    2. Parses the HTML to extract liquidity values for the specified tokens.
+    1. Fetches HTML content from the specified URL, with a venue_fetcher.
+    2. Parses the HTML in memory to extract the exact liquidity values for the specified tokens.
     3. Updates the JSON file with the extracted liquidity values under a new venue name.
-    4. Deletes the temporary HTML file if delete_tmp is set to True.
 
     Note:
         - The function assumes that the token liquidity values can be found in the HTML content with the format 'pooled {token} is {value}'.
-        - The function handles the precision of token values by formatting them to 18 decimal places and replacing '.' with '_'.
+        - The token values are written in the underscore format, with 18 decimal places.
+        - To refresh many pools, and to write their reserves into a market instead of a JSON file, use venue_fetcher directly.
     """
+    # Construct the venue name
+    venue_name = f"METEORA_{token1}_{token2}"
+
+    from classes.venue_fetcher import venue_fetcher
+
     print('Loading data from ' + url)
-    response = requests.get(url, headers={'User-Agent': 'Mozilla/5.0'})
-
-    # Check if the request was successful
-    if response.status_code == 200:
-        # Parse the HTML content
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        # Save the parsed HTML to a file
-        with open('pool_data.html', 'w') as f:
-            f.write(str(soup))
-
-        # Read the file and process the content
-        with open('pool_data.html', 'r') as file_:
-            lines = file_.readlines()
-
-        # Initialize values for token1 and token2
-        token1_value = None
-        token2_value = None
-
-        # Iterate through each line to find the target value
-        for line in lines:
-            if f'pooled {token1}' in line:
-                # Use regular expressions to find the values after 'pooled <token1>' and 'pooled <token2>'
-                token1_match = re.search(rf'pooled {token1} is ([\d,\.]+)', line)
-                token2_match = re.search(rf'pooled {token2} is ([\d,\.]+)', line)
-
-                if token1_match and token2_match:
-                    token1_value = np.float64(token1_match.group(1).replace(',', ''))
-                    token2_value = np.float64(token2_match.group(1).replace(',', ''))
-
-                    print(" ")
-                    print(f"Extracted {token1} liquidity: {token1_value}")
-                    print(f"Extracted {token2} liquidity: {token2_value}")
-                    print(" ")
-                else:
-                    print("Values not found in the line")
-
-        # Delete the file after processing
-        if delete_tmp:
-            os.remove('pool_data.html')
-            print("Temporary 'pool_data.html' file storing pool information has been deleted.")
+    Fetcher = venue_fetcher(workers=1)
+    Fetcher.add_pool(venue_name, url, token1, token2)
+    reserves = Fetcher.fetch(venue_name)
+    Fetcher.close()
+
+    if reserves is None:
+        print("No valid token values were extracted: " + Fetcher.errors[venue_name])
+        return
+
+    print(" ")
+    print(f"Extracted {token1} liquidity: {format_amount(reserves[token1])}")
+    print(f"Extracted {token2} liquidity: {format_amount(reserves[token2])}")
+    print(" ")
 
     # Load the existing JSON data
-    json_file = 'data.json'
     with open(json_file, 'r') as file:
         data = json.load(file)
 
-    # Construct the venue name
-    venue_name = f"METEORA_{token1}_{token2}"
-
     # Add the new section to the 'venues' key
-    if token1_value is not None and token2_value is not None:
-        data['venues'][venue_name] = {
-            'reserves': {
-                token1: f"{token1_value:.18f}".replace('.','_'),
-                token2: f"{token2_value:.18f}".replace('.','_')
-            }
-        }
-
-        # Save the updated JSON back to the file
-        with open(json_file, 'w') as file:
-            json.dump(data, file, indent=4)
-        print("New venue " + venue_name + " added to the JSON file " + json_file)
-    else:
-        print("No valid token values were extracted.")
-
+    data['venues'][venue_name] = {
+        'reserves': {token: format_amount(amount) for token, amount in reserves.items()}
+    }
+
+    # Save the updated JSON back to the file
+    with open(json_file, 'w') as file:
+        json.dump(data, file, indent=4)
+    print("New venue " + venue_name + " added to the JSON file " + json_file)
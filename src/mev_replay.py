@@ -0,0 +1,21 @@
+import sys
+import os
+import argparse
+
+# Add the src directory to the system path
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+import mev_project_interface as mev_interface
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Solves the intent files of directories or glob patterns in one run, "
+                                                 "writing <file>-results.json for each file and a summary of the run.")
+    parser.add_argument("patterns", nargs="+", help="Directories, whose .json files are solved, or glob patterns of the files.")
+    parser.add_argument("--workers", type=int, default=None, help="The number of worker processes.")
+    parser.add_argument("--resume", action="store_true", help="Skip the files that already have their results.")
+    parser.add_argument("--summary", default=None, help="The JSON file of the summary, printed if not given.")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Print additional information.")
+    args = parser.parse_args()
+
+    mev_interface.main_replay(args.patterns, workers=args.workers, resume=args.resume, summary_file=args.summary,
+                              verbose=args.verbose)
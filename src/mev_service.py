@@ -0,0 +1,25 @@
+import sys
+import os
+import argparse
+
+# Add the src directory to the system path
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+import mev_project_interface as mev_interface
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the solver as a resident service, answering JSON line requests "
+                                                 "of orders and venue updates over a local socket.")
+    parser.add_argument("--host", default="127.0.0.1", help="The address to listen on.")
+    parser.add_argument("--port", type=int, default=8765, help="The TCP port to listen on.")
+    parser.add_argument("--unix", default=None, help="The path of a unix socket to listen on instead of the TCP port.")
+    parser.add_argument("--venues", default=None, help="A JSON file with the venues loaded at startup.")
+    parser.add_argument("--commit", action="store_true", help="Apply the trades of each order to the market reserves.")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Print additional information to stderr.")
+    args = parser.parse_args()
+
+    # The responses go to the clients, the verbose information to stderr
+    if args.verbose:
+        sys.stdout = sys.stderr
+
+    mev_interface.main_service(args.host, args.port, args.unix, args.venues, commit=args.commit, verbose=args.verbose)
@@ -0,0 +1,26 @@
+import sys
+import os
+import argparse
+
+# Add the src directory to the system path
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+import mev_project_interface as mev_interface
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Solves the orders of a JSON file without plotting, writing the results "
+                                                 "to <file>-results.json.")
+    parser.add_argument("file", help="The JSON file with the order, or the orders, and the venues.")
+    parser.add_argument("--batch", action="store_true", help="Solve all the orders jointly, as a batch auction.")
+    parser.add_argument("--parallel", action="store_true", help="Solve all the orders in sequence, the independent ones in parallel.")
+    parser.add_argument("--workers", type=int, default=None, help="The number of worker processes of --parallel.")
+    parser.add_argument("--venues", default=None, help="A JSON file with the venues, if the file of the orders has none.")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Print additional information.")
+    args = parser.parse_args()
+
+    if args.batch:
+        mev_interface.main_batch(args.file, args.venues, verbose=args.verbose)
+    elif args.parallel:
+        mev_interface.main_parallel(args.file, args.venues, workers=args.workers, verbose=args.verbose)
+    else:
+        mev_interface.main(args.file, verbose=args.verbose)
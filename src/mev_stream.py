@@ -0,0 +1,33 @@
+import sys
+import os
+import argparse
+
+# Add the src directory to the system path
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+import mev_project_interface as mev_interface
+from classes import instruments, json_lines_sink
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Solves a newline-delimited JSON stream of orders and venue updates, "
+                                                 "writing one result line per order.")
+    parser.add_argument("file", nargs="?", help="The stream file to read, stdin if not given.")
+    parser.add_argument("-f", "--follow", action="store_true", help="Keep reading the file as it grows, as tail -f.")
+    parser.add_argument("--commit", action="store_true", help="Apply the trades of each order to the market reserves.")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Print additional information to stderr.")
+    parser.add_argument("--trace", help="Append the timing spans and counters of the solver to this JSON lines file.")
+    args = parser.parse_args()
+
+    if args.trace:
+        instruments.set_sink(json_lines_sink(args.trace))
+
+    # The verbose information goes to stderr, stdout only carries the result lines
+    output = sys.stdout
+    if args.verbose:
+        sys.stdout = sys.stderr
+
+    if args.file:
+        with open(args.file, 'r') as stream:
+            mev_interface.main_stream(stream, output, follow=args.follow, commit=args.commit, verbose=args.verbose)
+    else:
+        mev_interface.main_stream(sys.stdin, output, commit=args.commit, verbose=args.verbose)